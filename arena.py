@@ -0,0 +1,209 @@
+import argparse
+import csv
+import json
+import random
+import sys
+import time
+
+import numpy as np
+
+from connect4 import C4, MCTS_MAX_ITER, MINMAX_MAX_DEPTH, MINMAX_TIME_BUDGET, SOLVER_EMPTY_CELLS, agents, agent_classes, create_agent
+from records import RecordWriter
+
+# HEADLESS ARENA
+# Plays Connect4 games between two agents of the agents table, without GUI and without any delay
+# Every game is recorded (moves played, time spent thinking on each move and what the agents report about their
+# searches) so it can be saved as JSON, CSV (without the search reports) or added to a compact game record file
+# Usage: python arena.py mcts minmax --games 20 --seed 1 --json results.json
+
+
+
+# Plays one game between two agents and returns its record
+# agent_1 is Player 1 (starts the game), agent_2 is Player 2
+def play_game(agent_1, agent_2, seed=None):
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+
+    game = C4()
+    controllers = { 1: agent_1, -1: agent_2 }
+    player = 1
+    winner = 0
+    moves = []
+    think_times = []
+    searches = []
+
+    while not game.game_ended():
+        start = time.perf_counter()
+        col = controllers[player].move(game, player)
+        think_times.append(time.perf_counter() - start)
+        searches.append(controllers[player].last_search)
+
+        if not game.try_move(col):
+            raise ValueError("Player %d played an illegal move (column %s)" % (player, col))
+        game.play(col, player)
+        moves.append(int(col))
+
+        if game.winning_move(player):
+            winner = player
+            break
+        player *= -1
+
+    return { 'seed': seed,
+             'winner': winner,
+             'plies': len(moves),
+             'moves': moves,
+             'think_times': think_times,
+             'searches': searches }
+
+
+
+# Plays n_games between two agents (given by name or by number in the agents table)
+# Options are passed to the agents constructors, each game uses its own seed (seed + game number)
+# on_search, if given, is called with (game number, player, search info) after every move of a searching agent
+def run_arena(agent_1_name, agent_2_name, n_games, seed=None, agent_1_options=None, agent_2_options=None, on_search=None):
+    agent_1_name = agents.get(agent_1_name, agent_1_name)
+    agent_2_name = agents.get(agent_2_name, agent_2_name)
+    agent_1 = create_agent(agent_1_name, **(agent_1_options or {}))
+    agent_2 = create_agent(agent_2_name, **(agent_2_options or {}))
+
+    results = []
+    for i in range(n_games):
+        if on_search is not None:
+            agent_1.on_search = lambda info, i=i: on_search(i, 1, info)
+            agent_2.on_search = lambda info, i=i: on_search(i, -1, info)
+        agent_1.reset()
+        agent_2.reset()
+        result = play_game(agent_1, agent_2, None if seed is None else seed + i)
+        result['game'] = i
+        result['agent_1'] = agent_1_name
+        result['agent_2'] = agent_2_name
+        results.append(result)
+
+    agent_1.close()
+    agent_2.close()
+    return results
+
+
+
+# Number of wins for each player and draws
+def summarize(results):
+    summary = { 'games': len(results), 'player_1_wins': 0, 'player_2_wins': 0, 'draws': 0 }
+    for result in results:
+        if result['winner'] == 1:
+            summary['player_1_wins'] += 1
+        elif result['winner'] == -1:
+            summary['player_2_wins'] += 1
+        else:
+            summary['draws'] += 1
+    return summary
+
+
+
+def write_json(results, path):
+    with open(path, 'w') as f:
+        json.dump({ 'summary': summarize(results), 'games': results }, f, indent=2)
+
+
+
+# One row per game, moves are written as a string of columns and think times separated by ';'
+def write_csv(results, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['game', 'seed', 'agent_1', 'agent_2', 'winner', 'plies', 'moves', 'think_times'])
+        for r in results:
+            writer.writerow([r['game'], r['seed'], r['agent_1'], r['agent_2'], r['winner'], r['plies'],
+                             ''.join(str(m) for m in r['moves']),
+                             ';'.join('%.6f' % t for t in r['think_times'])])
+
+
+
+# Agent names accepted on the command line (names or numbers of the agents table)
+def agent_name(value):
+    name = agents.get(int(value), value) if value.isdigit() else value
+    if name not in agent_classes:
+        raise argparse.ArgumentTypeError("unknown agent '%s' (choose from %s)" % (value, ', '.join(agent_classes)))
+    return name
+
+
+
+# Constructor options of an agent, taken from the command line arguments
+def agent_options(name, args):
+    if name == 'minmax':
+        return { 'time_budget': args.minmax_time, 'max_depth': args.minmax_depth, 'workers': args.minmax_workers, 'book': args.book,
+                 'solver_cells': args.solver_cells }
+    if name == 'mcts':
+        return { 'max_iter': args.mcts_iter or None, 'time_budget': args.mcts_time, 'game_time': args.mcts_game_time, 'early_stop': args.mcts_early_stop,
+                 'workers': args.mcts_workers, 'parallel': args.mcts_parallel, 'playouts': args.mcts_playouts,
+                 'max_tree_size': args.mcts_tree_size, 'storage': args.mcts_storage, 'max_nodes': args.mcts_nodes, 'book': args.book,
+                 'solver_cells': args.solver_cells }
+    return {}
+
+
+
+# Search hook writing one JSON line per search to an open file
+def log_search(f):
+    def on_search(game, player, info):
+        f.write(json.dumps(dict(info, game=game, player=player)) + '\n')
+        f.flush()
+    return on_search
+
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Play Connect4 games between two agents without the GUI")
+    parser.add_argument('agent_1', type=agent_name, help="Player 1 agent (%s)" % ', '.join(agent_classes))
+    parser.add_argument('agent_2', type=agent_name, help="Player 2 agent (%s)" % ', '.join(agent_classes))
+    parser.add_argument('--games', type=int, default=10, help="number of games to play")
+    parser.add_argument('--seed', type=int, default=None, help="seed of the first game (game i uses seed + i)")
+    parser.add_argument('--json', default=None, help="write the game records to this JSON file")
+    parser.add_argument('--csv', default=None, help="write the game records to this CSV file")
+    parser.add_argument('--record', default=None, help="add the games to this game record file (see records.py)")
+    parser.add_argument('--search-log', default=None, help="write the statistics of every search to this file (one JSON object per line)")
+    parser.add_argument('--book', default=None, help="opening book file used by minmax and MCTS (see book.py)")
+    parser.add_argument('--solver-cells', type=int, default=SOLVER_EMPTY_CELLS, help="empty cells left when minmax and MCTS start solving the game exactly (0 never)")
+    parser.add_argument('--minmax-time', type=float, default=MINMAX_TIME_BUDGET, help="minmax time budget per move (seconds)")
+    parser.add_argument('--minmax-depth', type=int, default=MINMAX_MAX_DEPTH, help="minmax maximum search depth")
+    parser.add_argument('--minmax-workers', type=int, default=1, help="minmax worker processes per search (Lazy SMP)")
+    parser.add_argument('--mcts-iter', type=int, default=MCTS_MAX_ITER, help="MCTS iterations per move (cap, 0 for no cap)")
+    parser.add_argument('--mcts-time', type=float, default=None, help="MCTS time budget per move (seconds)")
+    parser.add_argument('--mcts-game-time', type=float, default=None, help="MCTS clock for the whole game (seconds)")
+    parser.add_argument('--mcts-early-stop', action='store_true', help="stop MCTS searches once the best move cannot change")
+    parser.add_argument('--mcts-playouts', type=int, default=1, help="random playouts per MCTS leaf (played at once with NumPy)")
+    parser.add_argument('--mcts-storage', choices=('nodes', 'array', 'graph'), default='nodes', help="MCTS tree storage (Node objects, NumPy arrays or a graph of positions)")
+    parser.add_argument('--mcts-nodes', type=int, default=None, help="maximum number of nodes of the array MCTS tree or of the graph table")
+    parser.add_argument('--mcts-tree-size', type=int, default=None, help="maximum number of nodes of the MCTS subtree kept for the next move (no limit by default)")
+    parser.add_argument('--mcts-workers', type=int, default=1, help="MCTS worker processes per move")
+    parser.add_argument('--mcts-parallel', choices=('root', 'tree'), default='root', help="parallel MCTS mode (with --mcts-workers > 1)")
+    return parser.parse_args(argv)
+
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    log = open(args.search_log, 'w') if args.search_log else None
+    try:
+        results = run_arena(args.agent_1, args.agent_2, args.games, args.seed,
+                            agent_options(args.agent_1, args), agent_options(args.agent_2, args),
+                            log_search(log) if log else None)
+    finally:
+        if log:
+            log.close()
+
+    if args.json:
+        write_json(results, args.json)
+    if args.csv:
+        write_csv(results, args.csv)
+    if args.record:
+        with RecordWriter(args.record, append=True) as writer:
+            for result in results:
+                writer.write(result)
+
+    summary = summarize(results)
+    print("%s (Player 1) vs %s (Player 2): %d games, %d - %d, %d draws" % (
+        args.agent_1, args.agent_2, summary['games'], summary['player_1_wins'], summary['player_2_wins'], summary['draws']))
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
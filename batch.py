@@ -0,0 +1,126 @@
+import argparse
+import sys
+
+import numpy as np
+
+from connect4 import CELL_BITS, COLUMN_COUNT, COLUMN_HEIGHT, ROW_COUNT, score_boards
+from rollouts import connected_four
+
+# BATCH EVALUATION
+# Scores and classifies many stored positions at once, without building a C4 for each of them
+# Positions are given either as boards, an (N, 6, 7) array of 1, -1 and 0 laid out like C4.board, or as bitboards,
+# an (N, 2) uint64 array holding the tokens of Player 1 and Player 2 (C4.masks[1] and C4.masks[-1])
+# The positions are processed chunk by chunk (chunk_size positions at a time) so the temporary arrays stay small
+# Usage: python batch.py positions.npy --output results.npz
+
+# Positions evaluated at once
+BATCH_CHUNK_SIZE = 16384
+
+# Status of a position
+STATUS_ONGOING = 0
+STATUS_PLAYER_1 = 1
+STATUS_PLAYER_2 = -1
+STATUS_DRAW = 2
+# Both players have four in a row (cannot happen in a real game)
+STATUS_INVALID = 3
+
+ONE = np.uint64(1)
+CELL_WEIGHTS = ONE << CELL_BITS.reshape(-1)
+# Bit of the top cell of every column
+TOP_BITS = [np.uint64(c * COLUMN_HEIGHT + ROW_COUNT - 1) for c in range(COLUMN_COUNT)]
+
+
+
+# Bitboards (N, 2) of boards (N, 6, 7)
+def boards_to_bitboards(boards):
+    cells = np.asarray(boards).reshape(len(boards), ROW_COUNT * COLUMN_COUNT)
+    bitboards = np.zeros((len(cells), 2), dtype=np.uint64)
+    for i, player in enumerate((1, -1)):
+        bitboards[:, i] = np.bitwise_or.reduce(np.where(cells == player, CELL_WEIGHTS, np.uint64(0)), axis=1)
+    return bitboards
+
+
+
+# Boards (N, 6, 7) of bitboards (N, 2), with int8 cells
+def bitboards_to_boards(bitboards):
+    bitboards = np.asarray(bitboards, dtype=np.uint64)
+    p1 = (bitboards[:, 0:1] >> CELL_BITS.reshape(1, -1)) & ONE
+    p2 = (bitboards[:, 1:2] >> CELL_BITS.reshape(1, -1)) & ONE
+    return (p1.astype(np.int8) - p2.astype(np.int8)).reshape(len(bitboards), ROW_COUNT, COLUMN_COUNT)
+
+
+
+# Status (see STATUS_*) and legal moves of positions given as bitboards
+# The legal moves are a bitmask of the columns that can be played (bit c for column c), 0 once the game is over
+def classify_bitboards(bitboards):
+    p1_won = connected_four(bitboards[:, 0])
+    p2_won = connected_four(bitboards[:, 1])
+    mask = bitboards[:, 0] | bitboards[:, 1]
+    full = np.zeros(len(mask), dtype=np.int64)
+    legal = np.zeros(len(mask), dtype=np.uint8)
+    for c, top in enumerate(TOP_BITS):
+        column_full = ((mask >> top) & ONE).astype(bool)
+        full += column_full
+        legal |= (~column_full).astype(np.uint8) << np.uint8(c)
+
+    status = np.full(len(mask), STATUS_ONGOING, dtype=np.int8)
+    status[full == COLUMN_COUNT] = STATUS_DRAW
+    status[p1_won] = STATUS_PLAYER_1
+    status[p2_won] = STATUS_PLAYER_2
+    status[p1_won & p2_won] = STATUS_INVALID
+    legal[status != STATUS_ONGOING] = 0
+    return status, legal
+
+
+
+# Heuristic scores (like score_position, for player), status and legal moves of every position
+# Give either boards or bitboards (see above), the results are three arrays of N values
+def evaluate_batch(boards=None, bitboards=None, player=1, chunk_size=BATCH_CHUNK_SIZE):
+    if (boards is None) == (bitboards is None):
+        raise ValueError("Give either boards or bitboards")
+    n = len(boards) if boards is not None else len(bitboards)
+    scores = np.zeros(n, dtype=np.int64)
+    status = np.zeros(n, dtype=np.int8)
+    legal = np.zeros(n, dtype=np.uint8)
+
+    for start in range(0, n, chunk_size):
+        end = min(n, start + chunk_size)
+        if boards is not None:
+            chunk_boards = np.asarray(boards[start:end], dtype=np.int8)
+            chunk_bitboards = boards_to_bitboards(chunk_boards)
+        else:
+            chunk_bitboards = np.asarray(bitboards[start:end], dtype=np.uint64)
+            chunk_boards = bitboards_to_boards(chunk_bitboards)
+        scores[start:end] = score_boards(chunk_boards, player)
+        status[start:end], legal[start:end] = classify_bitboards(chunk_bitboards)
+    return scores, status, legal
+
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Score and classify Connect4 positions stored in a NumPy file")
+    parser.add_argument('positions', help=".npy file of boards (N, 6, 7) or bitboards (N, 2)")
+    parser.add_argument('--output', default='results.npz', help="write the scores, status and legal moves to this .npz file")
+    parser.add_argument('--player', type=int, choices=(1, -1), default=1, help="player the scores are given for")
+    parser.add_argument('--chunk-size', type=int, default=BATCH_CHUNK_SIZE, help="positions evaluated at once")
+    return parser.parse_args(argv)
+
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # The file is memory-mapped, only the chunk being evaluated is read
+    positions = np.load(args.positions, mmap_mode='r')
+    if positions.ndim == 3:
+        scores, status, legal = evaluate_batch(boards=positions, player=args.player, chunk_size=args.chunk_size)
+    else:
+        scores, status, legal = evaluate_batch(bitboards=positions, player=args.player, chunk_size=args.chunk_size)
+    np.savez(args.output, scores=scores, status=status, legal=legal)
+    print("%d positions: %d ongoing, %d won by Player 1, %d won by Player 2, %d draws" % (
+        len(status), (status == STATUS_ONGOING).sum(), (status == STATUS_PLAYER_1).sum(),
+        (status == STATUS_PLAYER_2).sum(), (status == STATUS_DRAW).sum()))
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,376 @@
+import argparse
+import gc
+import json
+import math
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from connect4 import (C4, COLUMN_COUNT, MCTS, MCTS_FACTOR, IncrementalEvaluator, MinimaxStats, MoveOrdering, Node, ROW_COUNT, TranspositionTable,
+                      default_policy, minimax, score_position, tree_size)
+
+# ENGINE BENCHMARKS
+# Measures the speed of the engine on a fixed corpus of positions with fixed seeds, so two runs (or two versions of
+# the code) can be compared number for number
+# - perft: number of positions reached by playing every legal move down to a depth (checks move generation too)
+# - calls per second of the board functions used by the searches
+# - minimax nodes per second at each depth, MCTS iterations and playouts per second, peak memory of an MCTS tree
+# Every timing sample runs its workload again and again for at least BENCH_MIN_TIME seconds, and the best of
+# BENCH_REPEATS samples is kept: tiny workloads are not timed on a single run. The samples are taken in rounds over
+# all the timings (so a slow stretch of the machine only spoils one of them), and their spread tells how noisy the
+# metric is on this machine
+# Results are written as JSON, and a previous result file can be given as a baseline: any metric that got worse by
+# more than its tolerance (or a node count that changed) is reported and the script exits with status 1
+# The tolerance of a metric is the one given, widened to BENCH_SPREAD_FACTOR times its spread when it is noisier
+# Usage: python benchmark.py --output baseline.json
+#        python benchmark.py --baseline baseline.json --tolerance 0.15
+
+# Positions of the corpus, seed of the games that build it and number of plies played in them
+BENCH_CORPUS_SIZE = 64
+BENCH_CORPUS_SEED = 2024
+BENCH_MIN_PLIES = 4
+BENCH_MAX_PLIES = 30
+# Every timing is repeated and the best one is kept (the others are slowed down by the rest of the machine)
+BENCH_REPEATS = 5
+# Shortest sample of a timing (seconds), the workload is run as many times as needed to last this long
+BENCH_MIN_TIME = 0.2
+# Relative slowdown allowed before a metric counts as a regression, and the multiple of the spread of a metric
+# (between its samples, in the baseline or in the new run) it is widened to
+BENCH_TOLERANCE = 0.10
+BENCH_SPREAD_FACTOR = 2.0
+# Minimax searches shallower than this are too short to be timed (their node counts are still checked)
+BENCH_MIN_TIMED_DEPTH = 3
+
+
+
+# Positions reached by random games (seeded), none of them finished
+def build_corpus(size=BENCH_CORPUS_SIZE, seed=BENCH_CORPUS_SEED):
+    rng = random.Random(seed)
+    corpus = []
+    while len(corpus) < size:
+        game = C4()
+        plies = rng.randint(BENCH_MIN_PLIES, BENCH_MAX_PLIES)
+        for _ in range(plies):
+            game.play(rng.choice(game.available_cols()))
+            if game.is_winner() != 0:
+                break
+        if game.is_winner() == 0 and not game.game_ended():
+            corpus.append(game)
+    return corpus
+
+
+
+# Number of positions depth plies away from state (finished games are not played further)
+def perft(state, depth):
+    if depth == 0:
+        return 1
+    if state.is_winner() != 0:
+        return 0
+    nodes = 0
+    player = state.to_move()
+    for col in state.available_cols():
+        state.play(col, player)
+        nodes += perft(state, depth - 1)
+        state.undo()
+    return nodes
+
+
+
+# One metric of the results: which way is better tells the comparison whether a bigger value is a regression
+# Timed metrics also keep the spread of their samples
+def metric(value, unit, better, spread=None):
+    m = { 'value': value, 'unit': unit, 'better': better }
+    if spread is not None:
+        m['spread'] = spread
+    return m
+
+
+
+# Timed workloads are not measured where they are set up, but added to timed as name: (count, unit, run)
+# run does the workload once and returns the seconds it took (setup left out), count is what one run does (nodes,
+# calls...) and the metric is the rate count / seconds
+# The metric is reserved in results, so that it is listed next to the others of its benchmark
+def add_timing(results, timed, name, count, unit, run):
+    results[name] = None
+    timed[name] = (count, unit, run)
+
+
+
+# run for a function whose whole call is timed
+def timed_call(fn):
+    def run():
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
+    return run
+
+
+
+# Seconds of one run, out of as many runs as needed to last min_time seconds
+# The garbage collector is off meanwhile (like timeit), its pauses land on whichever run happens to trigger them
+def sample(run, min_time=BENCH_MIN_TIME):
+    runs = 0
+    elapsed = 0.0
+    gc.collect()
+    gc.disable()
+    try:
+        while runs == 0 or elapsed < min_time:
+            elapsed += run()
+            runs += 1
+    finally:
+        gc.enable()
+    return elapsed / runs
+
+
+
+# Measures every timed workload: one run to warm up, then repeats rounds taking one sample of each workload, so that
+# the samples of a metric are spread over the whole benchmark and a slow stretch of the machine cannot spoil all
+# of them. The best sample is kept, and the spread of the metric is (median - best) / best
+def measure(results, timed, repeats=BENCH_REPEATS, min_time=BENCH_MIN_TIME):
+    samples = { name: [] for name in timed }
+    for count, unit, run in timed.values():
+        run()
+    for _ in range(repeats):
+        for name, (count, unit, run) in timed.items():
+            samples[name].append(sample(run, min_time))
+    for name, (count, unit, run) in timed.items():
+        times = sorted(samples[name])
+        best = times[0]
+        results[name] = metric(count / best, unit, 'higher', (times[len(times) // 2] - best) / best)
+
+
+
+# Node counts of every depth from the empty board, speed of the deepest one only (the others are a few hundred nodes)
+def bench_perft(results, timed, corpus, depth, corpus_depth):
+    for d in range(1, depth + 1):
+        results['perft.start.d%d.nodes' % d] = metric(perft(C4(), d), 'nodes', 'equal')
+    add_timing(results, timed, 'perft.start.d%d.nps' % depth, results['perft.start.d%d.nodes' % depth]['value'],
+               'nodes/s', timed_call(lambda: perft(C4(), depth)))
+
+    nodes = sum(perft(state, corpus_depth) for state in corpus)
+    results['perft.corpus.d%d.nodes' % corpus_depth] = metric(nodes, 'nodes', 'equal')
+    add_timing(results, timed, 'perft.corpus.d%d.nps' % corpus_depth, nodes, 'nodes/s',
+               timed_call(lambda: [perft(state, corpus_depth) for state in corpus]))
+
+
+
+# Calls per second of the board functions, each called on every position of the corpus (loops times over)
+def bench_calls(results, timed, corpus, loops):
+    players = [state.to_move() for state in corpus]
+    pairs = list(zip(corpus, players)) * loops
+    calls = {
+        'winning_move': lambda: [state.winning_move(player) for state, player in pairs],
+        'is_winner': lambda: [state.is_winner() for state, player in pairs],
+        'available_cols': lambda: [state.available_cols() for state, player in pairs],
+        'score_position': lambda: [score_position(state, player) for state, player in pairs],
+    }
+    for name, fn in calls.items():
+        add_timing(results, timed, 'calls.%s' % name, len(pairs), 'calls/s', timed_call(fn))
+
+
+
+# Minimax nodes per second for each depth, over the first positions of the corpus
+# Every search starts with an empty transposition table and move ordering (like a fresh agent), which are set up
+# outside of the timing
+def bench_minimax(results, timed, corpus, max_depth, positions, seed):
+    tt = TranspositionTable()
+
+    def searches(depth, counts):
+        def run():
+            nodes = 0
+            elapsed = 0.0
+            for state in corpus[:positions]:
+                random.seed(seed)
+                board = state.copy()
+                board.attach_evaluator(IncrementalEvaluator(board))
+                ordering = MoveOrdering()
+                ordering.root_depth = depth
+                stats = MinimaxStats()
+                stats.root_depth = depth
+                tt.clear()
+                start = time.perf_counter()
+                minimax(board, depth, -math.inf, math.inf, True, tt, ordering, player=board.to_move(), stats=stats)
+                elapsed += time.perf_counter() - start
+                nodes += stats.nodes
+            counts.append(nodes)
+            return elapsed
+        return run
+
+    for depth in range(1, max_depth + 1):
+        counts = []
+        run = searches(depth, counts)
+        run()
+        results['minimax.d%d.nodes' % depth] = metric(counts[0], 'nodes', 'equal')
+        if depth >= BENCH_MIN_TIMED_DEPTH:
+            add_timing(results, timed, 'minimax.d%d.nps' % depth, counts[0], 'nodes/s', run)
+
+
+
+# MCTS iterations per second (one playout per leaf), random playouts per second (one at a time and in NumPy
+# batches) and peak memory used while building a tree
+def bench_mcts(results, timed, corpus, iterations, positions, batch, seed):
+    from rollouts import batch_playouts
+
+    done = []
+
+    def searches():
+        random.seed(seed)
+        np.random.seed(seed)
+        iterations_done = 0
+        elapsed = 0.0
+        for state in corpus[:positions]:
+            info = {}
+            MCTS(iterations, Node(state.copy()), MCTS_FACTOR, state.to_move(), info=info)
+            iterations_done += info['iterations']
+            elapsed += info['elapsed']
+        done.append(iterations_done)
+        return elapsed
+
+    searches()
+    add_timing(results, timed, 'mcts.iterations_per_second', done[0], 'iterations/s', searches)
+
+    def playouts():
+        random.seed(seed)
+        for state in corpus[:positions]:
+            board = state.copy()
+            for _ in range(iterations // 10):
+                default_policy(board, board.to_move())
+
+    add_timing(results, timed, 'mcts.playouts_per_second', positions * (iterations // 10), 'playouts/s',
+               timed_call(playouts))
+
+    def batches():
+        np.random.seed(seed)
+        for state in corpus[:positions]:
+            batch_playouts(state, state.to_move(), batch)
+
+    add_timing(results, timed, 'mcts.batch_playouts_per_second', positions * batch, 'playouts/s', timed_call(batches))
+
+    # Memory of a whole tree (Node objects) from the empty board, traced while it is built
+    random.seed(seed)
+    tracemalloc.start()
+    root = Node(C4())
+    MCTS(iterations, root, MCTS_FACTOR, 1)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    nodes = tree_size(root)
+    results['mcts.tree_peak_bytes'] = metric(peak, 'bytes', 'lower')
+    results['mcts.tree_bytes_per_node'] = metric(peak / nodes, 'bytes/node', 'lower')
+
+
+
+def run_benchmarks(quick=False, repeats=BENCH_REPEATS, seed=BENCH_CORPUS_SEED):
+    corpus = build_corpus(seed=seed)
+    results = {}
+    timed = {}
+    bench_perft(results, timed, corpus, 5 if quick else 6, 3)
+    bench_calls(results, timed, corpus, 20 if quick else 200)
+    bench_minimax(results, timed, corpus, 4 if quick else 6, 8 if quick else 16, seed)
+    bench_mcts(results, timed, corpus, 500 if quick else 2000, 4 if quick else 8, 256, seed)
+    measure(results, timed, repeats)
+    return { 'machine': machine_info(),
+             'settings': { 'quick': quick, 'repeats': repeats, 'seed': seed, 'corpus_size': len(corpus) },
+             'metrics': results }
+
+
+
+def machine_info():
+    return { 'python': platform.python_version(),
+             'numpy': np.__version__,
+             'platform': platform.platform(),
+             'processor': platform.processor(),
+             'board': '%dx%d' % (ROW_COUNT, COLUMN_COUNT) }
+
+
+
+# Metrics of current that are worse than in baseline: (name, baseline value, current value, relative change)
+# Node counts must be exactly equal, rates and memory may move by the tolerance (see metric_tolerance)
+def compare(baseline, current, tolerance=BENCH_TOLERANCE):
+    regressions = []
+    for name, old in baseline['metrics'].items():
+        new = current['metrics'].get(name)
+        if new is None:
+            continue
+        change = (new['value'] - old['value']) / old['value'] if old['value'] else 0.0
+        allowed = metric_tolerance(old, new, tolerance)
+        if old['better'] == 'equal':
+            worse = new['value'] != old['value']
+        elif old['better'] == 'higher':
+            worse = change < -allowed
+        else:
+            worse = change > allowed
+        if worse:
+            regressions.append((name, old['value'], new['value'], change))
+    return regressions
+
+
+
+# Tolerance of a metric: the one given, or BENCH_SPREAD_FACTOR times the larger spread of its two runs when that
+# is wider (a metric that moves that much between the samples of one run cannot be compared any closer)
+def metric_tolerance(old, new, tolerance=BENCH_TOLERANCE):
+    return max(tolerance, BENCH_SPREAD_FACTOR * max(old.get('spread', 0.0), new.get('spread', 0.0)))
+
+
+
+def format_results(results, baseline=None):
+    lines = []
+    for name, m in results['metrics'].items():
+        line = "%-40s %16s %s" % (name, format_value(m['value']), m['unit'])
+        if baseline is not None and name in baseline['metrics']:
+            old = baseline['metrics'][name]['value']
+            if old:
+                line += "  (%+.1f%%)" % (100 * (m['value'] - old) / old)
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+
+def format_value(value):
+    return '%d' % value if isinstance(value, int) else '%.1f' % value
+
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Connect4 engine on a fixed corpus of positions")
+    parser.add_argument('--quick', action='store_true', help="smaller depths and fewer iterations")
+    parser.add_argument('--repeats', type=int, default=BENCH_REPEATS, help="timing samples of at least %.1fs each (the best one is kept)" % BENCH_MIN_TIME)
+    parser.add_argument('--seed', type=int, default=BENCH_CORPUS_SEED, help="seed of the corpus and of the searches")
+    parser.add_argument('--output', default=None, help="write the results to this JSON file")
+    parser.add_argument('--baseline', default=None, help="compare the results with this JSON file")
+    parser.add_argument('--tolerance', type=float, default=BENCH_TOLERANCE, help="relative slowdown allowed against the baseline")
+    return parser.parse_args(argv)
+
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_benchmarks(args.quick, args.repeats, args.seed)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(format_results(results, baseline))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if baseline is not None:
+        if baseline['settings'] != results['settings']:
+            print("Warning: the baseline was run with other settings %s" % baseline['settings'])
+        regressions = compare(baseline, results, args.tolerance)
+        for name, old, new, change in regressions:
+            print("REGRESSION %s: %s -> %s (%+.1f%%)" % (name, format_value(old), format_value(new), 100 * change))
+        if regressions:
+            return 1
+    return 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
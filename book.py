@@ -0,0 +1,172 @@
+import argparse
+import math
+import multiprocessing
+import random
+import struct
+import sys
+import time
+
+import numpy as np
+
+from connect4 import C4, TranspositionTable, iterative_deepening, mirror_col
+
+# OPENING BOOK
+# The first plies of a game are searched offline once and for all: every position reachable in the first plies
+# is searched with minmax to a fixed depth and its best move and score are saved in a binary file
+# A position and its mirror image share one entry, saved under the canonical key with the move of the canonical side
+# File layout (little endian): a header (magic, number of positions, plies, search depth), then the position keys
+# sorted (uint64, see C4.canonical_key), the scores (int32, from the point of view of the player to move) and the best moves
+# (int8), each in its own block so the keys can be memory-mapped and binary searched without reading the file
+# Usage: python book.py --plies 6 --depth 8 --output opening_book.bin --workers 8
+
+BOOK_MAGIC = b'C4BOOK02'
+BOOK_HEADER = struct.Struct('<8sQII')
+# Default number of plies covered by the book and minmax depth of the searches
+BOOK_PLIES = 6
+BOOK_DEPTH = 8
+# Transposition table of every search (a new one for every position, so the results do not depend on the order)
+BOOK_TT_BYTES = 1024 * 1024
+# Scores are saved as int32: won and lost positions are clamped
+BOOK_MAX_SCORE = 2 ** 31 - 1
+
+
+
+# Read-only view of a book file: only the pages touched by the binary search are read from disk
+class OpeningBook(object):
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            magic, count, plies, depth = BOOK_HEADER.unpack(f.read(BOOK_HEADER.size))
+        if magic != BOOK_MAGIC:
+            raise ValueError("'%s' is not an opening book (or was built by an older version, build it again)" % path)
+        self.path = path
+        self.count = count
+        self.plies = plies
+        self.depth = depth
+        offset = BOOK_HEADER.size
+        if count > 0:
+            self.keys = np.memmap(path, dtype='<u8', mode='r', offset=offset, shape=(count,))
+            self.scores = np.memmap(path, dtype='<i4', mode='r', offset=offset + 8 * count, shape=(count,))
+            self.moves = np.memmap(path, dtype=np.int8, mode='r', offset=offset + 12 * count, shape=(count,))
+
+
+
+    def __len__(self):
+        return self.count
+
+
+
+    # Best move and score of the position of state (for the player to move), or None if it is not in the book
+    def lookup(self, state):
+        if self.count == 0 or len(state.moves) >= self.plies:
+            return None
+        canonical, mirrored = state.canonical_key()
+        key = np.uint64(canonical)
+        i = int(np.searchsorted(self.keys, key))
+        if i < self.count and self.keys[i] == key:
+            move = int(self.moves[i])
+            return mirror_col(move) if mirrored else move, int(self.scores[i])
+        return None
+
+
+
+# Opens a book given by path (an OpeningBook is returned as it is, None stays None)
+def open_book(book):
+    if book is None or isinstance(book, OpeningBook):
+        return book
+    return OpeningBook(book)
+
+
+
+# Move of the book for player in game, or None when the book has nothing for this position
+def book_move(book, game, player):
+    if book is None or player != game.to_move():
+        return None
+    return book.lookup(game)
+
+
+
+# Every position (not finished) reachable in less than plies plies, each one once (mirror images are left out)
+def book_positions(plies):
+    positions = []
+    frontier = [C4()]
+    for ply in range(plies):
+        positions.extend(frontier)
+        next_frontier = {}
+        for state in frontier:
+            for col in state.available_cols():
+                child = state.copy()
+                child.play(col)
+                if child.is_winner() == 0 and not child.game_ended():
+                    next_frontier.setdefault(child.canonical_key()[0], child)
+        frontier = list(next_frontier.values())
+    return positions
+
+
+
+# Worker: searches one position to the book depth and returns (key, score, move)
+def search_position(task):
+    state, depth, seed = task
+    random.seed(seed)
+    player = state.to_move()
+    col, value, _ = iterative_deepening(state, math.inf, depth, TranspositionTable(BOOK_TT_BYTES), player=player)
+    score = max(-BOOK_MAX_SCORE, min(BOOK_MAX_SCORE, value))
+    key, mirrored = state.canonical_key()
+    return key, int(score), mirror_col(col) if mirrored else col
+
+
+
+def write_book(path, entries, plies, depth):
+    entries = sorted(entries)
+    keys = np.array([e[0] for e in entries], dtype='<u8')
+    scores = np.array([e[1] for e in entries], dtype='<i4')
+    moves = np.array([e[2] for e in entries], dtype=np.int8)
+    with open(path, 'wb') as f:
+        f.write(BOOK_HEADER.pack(BOOK_MAGIC, len(entries), plies, depth))
+        f.write(keys.tobytes())
+        f.write(scores.tobytes())
+        f.write(moves.tobytes())
+
+
+
+# Searches every position of the first plies (spread over a pool of worker processes) and writes the book
+def build_book(path, plies=BOOK_PLIES, depth=BOOK_DEPTH, workers=None, seed=0, progress=None):
+    positions = book_positions(plies)
+    tasks = [(state, depth, seed + i) for i, state in enumerate(positions)]
+    entries = []
+    with multiprocessing.Pool(workers) as pool:
+        for entry in pool.imap_unordered(search_position, tasks, chunksize=16):
+            entries.append(entry)
+            if progress is not None:
+                progress(len(entries), len(tasks))
+    write_book(path, entries, plies, depth)
+    return len(entries)
+
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build a Connect4 opening book with minmax")
+    parser.add_argument('--plies', type=int, default=BOOK_PLIES, help="positions of the first plies to search")
+    parser.add_argument('--depth', type=int, default=BOOK_DEPTH, help="minmax search depth")
+    parser.add_argument('--output', default='opening_book.bin', help="book file to write")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes (default: one per core)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the searches (position i uses seed + i)")
+    return parser.parse_args(argv)
+
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    start = time.perf_counter()
+
+    def progress(done, total):
+        if done % 100 == 0 or done == total:
+            print("[%d/%d] %.1fs" % (done, total, time.perf_counter() - start), flush=True)
+
+    n = build_book(args.output, args.plies, args.depth, args.workers, args.seed, progress)
+    print("%d positions written to %s" % (n, args.output))
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
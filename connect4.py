@@ -1,9 +1,8 @@
 import numpy as np
 import random
-import pygame
 import sys
 import math
-import copy
+import time
 
 # Followed the python tutorial by Siddhi Sawant - https://www.askpython.com/python/examples/connect-four-game
 # Followed MCTS implementation by Alfredo de la Fuente - https://github.com/Alfo5123/Connect4/blob/master/README.md
@@ -15,13 +14,54 @@ COLUMN_COUNT = 7
 # MCTS CONFIG
 MCTS_MAX_ITER = 5000
 MCTS_FACTOR = 2.0
+# Anytime MCTS: how often (in iterations) the deadline and the early stop are checked
+MCTS_CHECK_EVERY = 32
+# How often (in iterations, a multiple of MCTS_CHECK_EVERY) the progress of a search is reported
+MCTS_PROGRESS_EVERY = 512
+# Game time management: critical positions (a threat on the board) get this many times the normal share of the clock,
+# and a single move never uses more than this share of the time left
+MCTS_CRITICAL_TIME_FACTOR = 2.0
+MCTS_MAX_CLOCK_SHARE = 0.5
 # MINMAX CONFIG
+# Fixed search depth, used when minimax is called directly instead of through iterative deepening
 MINMAX_DEPTH = 5
 MINMAX_PLAYER = -1
-
-# I cannot explain what this is for, only that Alfredo de la Fuente refers to it in their is_winner method
-dx = [1, 1,  1,  0]
-dy = [1, 0,  -1,  1]
+# Wall-clock budget (in seconds) of the iterative deepening driver, and the deepest it may go
+MINMAX_TIME_BUDGET = 1.0
+MINMAX_MAX_DEPTH = ROW_COUNT * COLUMN_COUNT
+# Scores past this value mean a forced win or loss was found
+MINMAX_WIN_SCORE = 1000000000000
+# Memory budget of the minimax transposition table (in bytes)
+MINMAX_TT_BYTES = 16 * 1024 * 1024
+# Both agents solve the game exactly (see solver.py) once this many cells or fewer are left empty (0 never)
+SOLVER_EMPTY_CELLS = 16
+# Transposition table entry flags: exact value, lower bound (fail high) or upper bound (fail low)
+TT_EXACT = 0
+TT_LOWER = 1
+TT_UPPER = 2
+# Bytes used by one entry (key, value, depth, move, flag)
+TT_ENTRY_BYTES = 8 + 8 + 1 + 1 + 1
+
+# BITBOARD LAYOUT
+# Each player is stored as one integer mask, one bit per cell, column by column (bottom to top)
+# Every column gets an extra sentinel bit on top so that shifts never wrap from one column into the next
+#  6 13 20 27 34 41 48
+#  5 12 19 26 33 40 47
+#  4 11 18 25 32 39 46
+#  3 10 17 24 31 38 45
+#  2  9 16 23 30 37 44
+#  1  8 15 22 29 36 43
+#  0  7 14 21 28 35 42
+COLUMN_HEIGHT = ROW_COUNT + 1
+BOTTOM_MASK = sum(1 << (c * COLUMN_HEIGHT) for c in range(COLUMN_COUNT))
+BOARD_MASK = BOTTOM_MASK * ((1 << ROW_COUNT) - 1)
+# Bit index of every cell, using the (row, col) convention of the 2D board (row 0 is the top row)
+CELL_BITS = np.array([[c * COLUMN_HEIGHT + (ROW_COUNT - 1 - r) for c in range(COLUMN_COUNT)] for r in range(ROW_COUNT)], dtype=np.uint64)
+# Shifts used to find four in a row: vertical, horizontal, diagonal (/) and diagonal (\)
+DIRECTIONS = (1, COLUMN_HEIGHT, COLUMN_HEIGHT + 1, COLUMN_HEIGHT - 1)
+# Bits of one column, and the shifts that move every column to its mirror column
+COLUMN_BITS = (1 << COLUMN_HEIGHT) - 1
+MIRROR_SHIFTS = [(c * COLUMN_HEIGHT, (COLUMN_COUNT - 1 - c) * COLUMN_HEIGHT) for c in range(COLUMN_COUNT)]
 
 # Pygame GUI RGB colors and time
 BLUE = (0,0,255)
@@ -29,6 +69,14 @@ BLACK = (0,0,0)
 RED = (255,0,0)
 YELLOW = (255,255,0)
 
+# PYGAME SCREEN SIZE
+SQUARESIZE = 100
+# Define width and height of our board
+width = COLUMN_COUNT * SQUARESIZE
+height = (ROW_COUNT+1) * SQUARESIZE
+size = (width, height)
+RADIUS = int(SQUARESIZE/2 - 5)
+
 # PYGAME DELAY BETWEEN GAMES AND TURNS
 WAIT_TIME = 10000
 TURN_DELAY = 2000
@@ -41,7 +89,7 @@ symbols = { 1:'x',
 
 # Determine which agent controls Player 1 or Player 2
 # 4 choices: human, random selector, minmax algorithm or mcts
-agents = { 0: 'player',
+agents = { 0: 'human',
            1: 'rand',
            2: 'minmax',
            3: 'mcts' }
@@ -50,200 +98,374 @@ agents = { 0: 'player',
 
 ### CONNECT4 BOARD CLASS
 class C4(object):
+    # Incremental evaluator kept up to date by play/undo (None unless attach_evaluator was called)
+    evaluator = None
 
     def __init__(self):
-        # A 6x7 2D array containing tokens and game states
-        self.board = np.zeros((ROW_COUNT, COLUMN_COUNT))
+        # One bitboard per player (see BITBOARD LAYOUT above)
+        self.masks = {1: 0, -1: 0}
+        # Number of tokens currently stacked in each column
+        self.heights = [0] * COLUMN_COUNT
+        # Move stack used by undo, holds (previous last_move, row, col, player)
+        self.moves = []
         # Records the last move attempted
         self.last_move = [None, None]
 
 
 
+    # Cheap copy of the game state (the bitboards are plain integers, so only the lists need copying)
+    def copy(self):
+        aux = C4.__new__(C4)
+        aux.masks = {1: self.masks[1], -1: self.masks[-1]}
+        aux.heights = self.heights[:]
+        aux.moves = self.moves[:]
+        aux.last_move = self.last_move[:]
+        return aux
+
+
+
+    # Makes copy.deepcopy (used by callers of the engine) use the cheap copy above instead of walking the whole object
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+
+
+    # A 6x7 2D array containing tokens and game states (1, -1 or 0), rebuilt from the bitboards
+    # This is a read-only snapshot (writing into it raises instead of silently leaving the game unchanged), use
+    # place_token or play to change the game
+    @property
+    def board(self):
+        p1 = (np.uint64(self.masks[1]) >> CELL_BITS) & np.uint64(1)
+        p2 = (np.uint64(self.masks[-1]) >> CELL_BITS) & np.uint64(1)
+        board = p1.astype(np.float64) - p2.astype(np.float64)
+        board.flags.writeable = False
+        return board
+
+
+
+    # Bitboard of all the tokens on the board (both players)
+    def mask(self):
+        return self.masks[1] | self.masks[-1]
+
+
+
+    # Unique integer identifying the position (the sentinel bit of every column encodes its height)
+    def key(self):
+        return self.masks[1] + self.mask() + BOTTOM_MASK
+
+
+
+    # Key of the mirror image of the position (left and right swapped)
+    def mirror_key(self):
+        return mirror_bitboard(self.key())
+
+
+
+    # Canonical key of the position, shared with its mirror image (the smaller of both keys), and whether the position
+    # is the mirrored one (its moves must then be mirrored too, see mirror_col)
+    def canonical_key(self):
+        key = self.key()
+        mirrored = mirror_bitboard(key)
+        if mirrored < key:
+            return mirrored, True
+        return key, False
+
+
+
+    # Check if the position is its own mirror image (the empty board for instance)
+    def is_symmetric(self):
+        heights = self.heights
+        return heights == heights[::-1] and self.masks[1] == mirror_bitboard(self.masks[1])
+
+
+
+    # Bitboard with one bit set for the next open cell of every column that is not full
+    def legal_moves_mask(self):
+        return (self.mask() + BOTTOM_MASK) & BOARD_MASK
+
+
+
+    # Bitboard of the empty cells (playable now or not) that would give player four in a row
+    def winning_cells(self, player):
+        return winning_positions(self.masks[player], self.mask())
+
+
+
+    # Check if player has a winning move right now
+    def can_win_next(self, player):
+        return (self.winning_cells(player) & self.legal_moves_mask()) != 0
+
+
+
+    # Player whose turn it is, assuming Player 1 started the game
+    def to_move(self):
+        return 1 if sum(self.heights) % 2 == 0 else -1
+
+
+
+    # Attach an IncrementalEvaluator built from the current board, or detach it with None
+    # Copies of the state do not carry the evaluator
+    def attach_evaluator(self, evaluator):
+        self.evaluator = evaluator
+
+
+
     # Place a token in a selected column with row already computed
     def place_token(self, row, col, player):
-        self.board[row][col] = player
+        # Plain ints: a NumPy integer would turn the masks into fixed-size integers
+        row, col = int(row), int(col)
+        self.moves.append((self.last_move, row, col, player))
+        self.masks[player] |= 1 << (col * COLUMN_HEIGHT + ROW_COUNT - 1 - row)
+        self.heights[col] = ROW_COUNT - row
+        self.last_move = [row, col]
+        if self.evaluator is not None:
+            self.evaluator.add(row, col, player)
+
+
+
+    # Drop a token in a column (in place) and return the row it landed in
+    def play(self, col, player=None):
+        if player is None:
+            player = self.to_move()
+        # Plain int: a NumPy integer (from np.random.choice for instance) would turn the masks into fixed-size integers
+        col = int(col)
+        height = self.heights[col]
+        row = ROW_COUNT - 1 - height
+        self.moves.append((self.last_move, row, col, player))
+        self.masks[player] |= 1 << (col * COLUMN_HEIGHT + height)
+        self.heights[col] = height + 1
+        self.last_move = [row, col]
+        if self.evaluator is not None:
+            self.evaluator.add(row, col, player)
+        return row
+
+
+
+    # Take back the most recent move (played with play or place_token) and return its column
+    def undo(self):
+        last_move, row, col, player = self.moves.pop()
+        self.masks[player] &= ~(1 << (col * COLUMN_HEIGHT + ROW_COUNT - 1 - row))
+        self.heights[col] = ROW_COUNT - 1 - row
+        self.last_move = last_move
+        if self.evaluator is not None:
+            self.evaluator.remove(row, col, player)
+        return col
 
 
 
     # Find the first available row (starting from the bottom)
     def get_next_open_row(self, col):
-        if (col < 0 or col >= COLUMN_COUNT or self.board[0][col] != 0 ):
-            return -1;
-        
-        for r in range(ROW_COUNT-1, -1, -1):
-            if self.board[r][col] == 0:
-                return r
-        return ROW_COUNT-1
+        if (col < 0 or col >= COLUMN_COUNT or self.heights[col] >= ROW_COUNT):
+            return -1
+
+        return ROW_COUNT - 1 - self.heights[col]
 
 
 
     def available_cols(self):
         # Returns the full list of legal moves that for next player.
-        available = []
-        for i in range(COLUMN_COUNT):
-            if( self.board[0][i] == 0 ):
-                available.append(i)
+        heights = self.heights
+        return [c for c in range(COLUMN_COUNT) if heights[c] < ROW_COUNT]
 
-        return available
+
+
+    # Legal moves that lead to different positions: on a symmetric board a move and its mirror are worth the same,
+    # so only the left half (and the centre) is kept
+    def distinct_cols(self):
+        cols = self.available_cols()
+        if self.is_symmetric():
+            return [c for c in cols if c <= (COLUMN_COUNT - 1) // 2]
+        return cols
 
 
 
     # Check if position is available (row not full)
     def try_move(self, col):
-        return self.board[0][col] == 0
-        
+        return 0 <= col < COLUMN_COUNT and self.heights[col] < ROW_COUNT
+
 
 
     # Check if the game has ended (no ore available columns to play in)
     def game_ended(self):
-        if len(self.available_cols()) == 0:
-            return True
-        else:
-            return False
+        return (self.masks[1] | self.masks[-1]) == BOARD_MASK
 
 
 
     # Determines the next state by playing randomly
     def next_state(self, player):
-        aux = copy.deepcopy(self)
+        aux = self.copy()
         possible_moves = aux.available_cols()
 
         if len(possible_moves) > 0:
-            col = np.random.choice(possible_moves)
-            row = aux.get_next_open_row(col)
-            aux.place_token(row, col, player)
-            aux.last_move = [row, col]
+            col = random.choice(possible_moves)
+            aux.play(col, player)
         return aux
 
 
 
+    # Returns True if a bitboard holds four aligned tokens
+    # Shifting by one direction and AND-ing twice leaves a bit only where four tokens line up
+    @staticmethod
+    def connected_four(bitboard):
+        for shift in DIRECTIONS:
+            m = bitboard & (bitboard >> shift)
+            if m & (m >> (2 * shift)):
+                return True
+        return False
+
+
+
     # Find if most recent play was a winning move
     # There are two functions that try to achieve the same thing (determine if there is a winner)
     # However, is_winner looks at it irrelevant from who played last, and is more useful when exploring a state tree
     def winning_move(self, player):
-        # return False
-        # Check horizontal locations for win
-        for c in range(COLUMN_COUNT-3):
-            for r in range(ROW_COUNT):
-                if self.board[r][c] == player and self.board[r][c+1] == player and self.board[r][c+2] == player and self.board[r][c+3] == player:
-                    return True
-    
-        # Check vertical locations for win
-        for c in range(COLUMN_COUNT):
-            for r in range(ROW_COUNT-3):
-                if self.board[r][c] == player and self.board[r+1][c] == player and self.board[r+2][c] == player and self.board[r+3][c] == player:
-                    return True
-    
-        # Check positively sloped diaganols
-        for c in range(COLUMN_COUNT-3):
-            for r in range(ROW_COUNT-3):
-                if self.board[r][c] == player and self.board[r+1][c+1] == player and self.board[r+2][c+2] == player and self.board[r+3][c+3] == player:
-                    return True
-    
-        # Check negatively sloped diaganols
-        for c in range(COLUMN_COUNT-3):
-            for r in range(3, ROW_COUNT):
-                if self.board[r][c] == player and self.board[r-1][c+1] == player and self.board[r-2][c+2] == player and self.board[r-3][c+3] == player:
-                    return True
-                
+        return C4.connected_four(self.masks[player])
+
 
 
     # Takes the board as input and determines if there is a winner.
     # If the game has a winner, it returns the player number (Player1 = 1, Player2 = -1).
-    # If the game is still ongoing, it returns zero.  
+    # If the game is still ongoing, it returns zero.
     def is_winner(self):
-        x = self.last_move[0]
-        y = self.last_move[1]
-
-        if x == None:
-            return 0 
-
-        for d in range(4):
-
-            h_counter = 0
-            c_counter = 0
-
-            for k in range(-3,4):
-
-                u = x + k * dx[d]
-                v = y + k * dy[d]
-
-                if u < 0 or u >= 6:
-                    continue
+        row, col = self.last_move
 
-                if v < 0 or v >= 7:
-                    continue
-
-                if self.board[u][v] == -1:
-                    c_counter = 0
-                    h_counter += 1
-                elif self.board[u][v] == 1:
-                    h_counter = 0
-                    c_counter += 1
-                else:
-                    h_counter = 0
-                    c_counter = 0
-
-                if h_counter == 4:
-                    return -1 
-
-                if c_counter == 4:	
-                    return 1
+        if row is None:
+            return 0
 
+        bit = 1 << (col * COLUMN_HEIGHT + ROW_COUNT - 1 - row)
+        player = 1 if self.masks[1] & bit else -1
+        if C4.connected_four(self.masks[player]):
+            return player
         return 0
 
 
 
     # Print the game board
-    def print_board(self):
+    def print_board(self, screen):
         # Print the game state in the console
         # board_copy = np.copy(self.board).astype(object)
         # for n in [-1, 0, 1]:
         #     board_copy[board_copy==n] = symbols[n]
         # print (board_copy)
+        board = self.board
 
-        # Pygame GUI version
+        # Pygame GUI version: every cell is drawn once, with its hole or its token (RED or YELLOW)
+        # The window itself only redraws the cells that changed (see gui.BoardView)
+        import pygame
+        from gui import draw_cell
         for c in range(COLUMN_COUNT):
             for r in range(ROW_COUNT):
-                pygame.draw.rect(screen, BLUE, (c*SQUARESIZE, r*SQUARESIZE+SQUARESIZE, SQUARESIZE, SQUARESIZE))
-                pygame.draw.circle(screen, BLACK, (int(c*SQUARESIZE+SQUARESIZE/2), int(r*SQUARESIZE+SQUARESIZE+SQUARESIZE/2)), RADIUS)
-        
-        # Draw the player tokens (RED or YELLOW)
-        for c in range(COLUMN_COUNT):
-            for r in range(ROW_COUNT):
-                if self.board[r][c] == 1:
-                    pygame.draw.circle(screen, RED, (int(c*SQUARESIZE+SQUARESIZE/2), height-int((ROW_COUNT-1-r)*SQUARESIZE+SQUARESIZE/2)), RADIUS)
-                elif self.board[r][c] == -1: 
-                    pygame.draw.circle(screen, YELLOW, (int(c*SQUARESIZE+SQUARESIZE/2), height-int((ROW_COUNT-1-r)*SQUARESIZE+SQUARESIZE/2)), RADIUS)
+                draw_cell(screen, r, c, int(board[r][c]))
         pygame.display.update()
 
 
 
     # Reset game board
     def reset_board(self):
-        for c in range(COLUMN_COUNT):
-            for r in range(ROW_COUNT):
-                self.board[r][c] = 0
+        self.masks = {1: 0, -1: 0}
+        self.heights = [0] * COLUMN_COUNT
+        self.moves = []
+        self.last_move = [None, None]
+        if self.evaluator is not None:
+            self.evaluator = IncrementalEvaluator()
+
+
+
+# Mirror image of a bitboard (or of a position key): the columns are swapped from left to right
+# Every column keeps its own bits (a key never carries from one column to the next), so they can be moved one by one
+def mirror_bitboard(bitboard):
+    mirrored = 0
+    for shift, mirror_shift in MIRROR_SHIFTS:
+        mirrored |= ((bitboard >> shift) & COLUMN_BITS) << mirror_shift
+    return mirrored
+
+
+
+# Column of the mirror image of a move
+def mirror_col(col):
+    return COLUMN_COUNT - 1 - col
+
+
+
+# Bitboard of the empty cells (playable now or not) that would complete four in a row for the tokens of position
+# (mask holds the tokens of both players)
+def winning_positions(position, mask):
+    # Vertical: three tokens right below
+    r = (position << 1) & (position << 2) & (position << 3)
+    for shift in DIRECTIONS[1:]:
+        # Horizontal and both diagonals: the missing token can be at either end or inside the line
+        p = (position << shift) & (position << (2 * shift))
+        r |= p & (position << (3 * shift))
+        r |= p & (position >> shift)
+        p = (position >> shift) & (position >> (2 * shift))
+        r |= p & (position << shift)
+        r |= p & (position >> (3 * shift))
+    return r & (BOARD_MASK ^ mask)
 
 
 
 # NODE CLASS (build trees which algorithms will use)
 class Node():
     # Data structure to keep track of algorithm searches
-    # State represents boards at a given time
-    def __init__(self, state, parent = None):
+    # Only the nodes created with a state keep a board (usually the root), the other nodes only remember the move
+    # that leads to them and rebuild their board from the moves on their path when it is asked for
+    def __init__(self, state, parent = None, move = None, player = None):
         self.visits = 1
         self.reward = 0.0
-        self.state = state
         self.children = []
         self.children_move = []
         self.parent = parent
+        # Column played (and by which player) to go from the parent to this node
+        self.move = move
+        self.player = player
+        self.stored_state = state
+        self.proven = None
+        if state is not None:
+            self.set_position(state)
+
+
+
+    # Records what the search needs to know about the position of the node (number of legal moves and winner)
+    # Game-theoretic value of the node for the player who moved into it, once it is proven (MCTS-Solver):
+    # 1 won, -1 lost, 0 drawn, None not proven yet (a finished game is proven right away)
+    def set_position(self, state):
+        self.n_moves = len(state.distinct_cols())
+        self.winner = state.is_winner()
+        if self.winner != 0:
+            self.proven = 1
+        elif self.n_moves == 0:
+            self.proven = 0
+        else:
+            self.proven = None
+
+
+
+    # State represents boards at a given time (a new copy is built for the nodes that do not store one)
+    @property
+    def state(self):
+        path = []
+        node = self
+        while node.stored_state is None:
+            path.append(node)
+            node = node.parent
+        state = node.stored_state.copy()
+        for node in reversed(path):
+            state.play(node.move, node.player)
+        return state
+
+
+
+    # Turns the node into a root: it stores its own board and forgets its parent (and the rest of the tree)
+    def detach(self):
+        if self.stored_state is None:
+            self.stored_state = self.state
+        self.parent = None
 
 
 
     # Nodes are chained together and hold references to their children nodes
-    def add_child(self, child_state, move):
-        child = Node(child_state, self)
+    def add_child(self, child_state, move, player = None):
+        child = Node(child_state, self, move, player)
         self.children.append(child)
         self.children_move.append(move)
 
@@ -258,18 +480,25 @@ class Node():
 
     # Determines if there are still nodes to explore
     def fully_explored(self):
-        if len(self.children) == len(self.state.available_cols()):
+        if len(self.children) == self.n_moves:
             return True
         return False
 
 
 
+    # Determines if the game is over in this node (winner or draw)
+    def terminal(self):
+        return self.winner != 0 or self.n_moves == 0
+
+
+
 # AI PLAYING TECHNIQUES -----------------
 # 1. RANDOM
 def play_random(game):
     # Choose a random available column
     if len(game.available_cols()) > 0:
-        col = np.random.choice(game.available_cols())
+        # Plain int: a NumPy integer would turn the bitboards into fixed-size integers
+        col = int(np.random.choice(game.available_cols()))
         return col
     else:
         # No more columns available, game has ended (check if player won, else is draw)
@@ -278,56 +507,185 @@ def play_random(game):
 
 
 # 2. MONTE CARLO TREE SEARCH
-def MCTS(max_iter, root, factor, player):
-    p = copy.deepcopy(player)
-    for i in range(max_iter):
-        front, p = tree_policy(root, player, factor)
-        reward = default_policy(front.state, p)
-        backpropagate(front, reward, p)
-
+# A single board is played along the selected path and through the playout, then taken back after every iteration
+# (no board is copied during the search)
+# MCTS-Solver: finished games are proven wins or draws, and proofs go up the tree (see prove), a proven node is not
+# searched below anymore (its exact result is backed up instead of a playout), and the search stops once the root is proven
+# With playouts > 1 every new leaf is evaluated by that many random games played at once with NumPy (see rollouts.py)
+# Anytime search: it stops after max_iter iterations (None for no cap) or at the deadline (time.perf_counter() value),
+# whichever comes first, and with early_stop as soon as the best root child cannot be overtaken anymore
+# The number of iterations, the time spent, why the search stopped and the shape of the tree are written in info
+# (a dictionary) if given, see search_info and tree_info
+# progress, if given, is called during the search with the iterations done so far and the best move (see progress_report)
+def MCTS(max_iter, root, factor, player, playouts=1, deadline=None, early_stop=False, info=None, progress=None):
+    if max_iter is None and deadline is None:
+        raise ValueError("MCTS needs an iteration cap or a deadline")
+    if playouts > 1:
+        from rollouts import batch_playouts
+    board = root.state
+    root_depth = len(board.moves)
+    start = time.perf_counter()
+    stopped = 'iterations'
+    # Deepest node selected and lengths of the playouts (only recorded for info)
+    max_depth = 0
+    lengths = [] if info is not None and playouts == 1 else None
+    i = 0
+    while max_iter is None or i < max_iter:
+        if root.proven is not None:
+            stopped = 'proven'
+            break
+        if i > 0 and i % MCTS_CHECK_EVERY == 0:
+            if deadline is not None and time.perf_counter() >= deadline:
+                stopped = 'deadline'
+                break
+            if early_stop and decided(root, remaining_iterations(i, max_iter, start, deadline) * playouts):
+                stopped = 'early'
+                break
+            if progress is not None and i % MCTS_PROGRESS_EVERY == 0 and root.children:
+                progress(progress_report(i, start, max(root.children, key=lambda c: c.visits).move))
+
+        front, p = tree_policy(root, player, factor, board)
+        if info is not None:
+            max_depth = max(max_depth, len(board.moves) - root_depth)
+        if front.proven is not None:
+            reward = proven_reward(front, p, playouts)
+        elif playouts > 1:
+            reward = batch_playouts(board, p, playouts)
+        else:
+            reward = default_policy(board, p, lengths)
+        backpropagate(front, reward, p, playouts)
+        while len(board.moves) > root_depth:
+            board.undo()
+        i += 1
+
+    if info is not None:
+        search_info(info, i, start, stopped)
+        tree_info(info, tree_size(root), max_depth, lengths,
+                  [(c.move, c.visits, c.reward) for c in root.children])
+        info['proven'] = proven_result(root)
+    if not root.children:
+        # Nothing was searched (no iterations allowed): the first move there is
+        return expand(root, player, board.copy())
+    if stopped == 'early':
+        # The move decided proved no other child could catch up with
+        return max(root.children, key=lambda c: c.visits)
     ans = best_child(root, 0)
     return ans
 
 
 
+# Estimated number of iterations left before the iteration cap or the deadline (from the speed so far)
+def remaining_iterations(done, max_iter, start, deadline):
+    remaining = math.inf if max_iter is None else max_iter - done
+    if deadline is not None:
+        now = time.perf_counter()
+        rate = done / max(now - start, 1e-9)
+        remaining = min(remaining, rate * max(0.0, deadline - now))
+    return remaining
+
+
+
+# True when the most visited child of root is also the best one and no other child can catch up with its visits
+# in the remaining visits (a single legal move is always decided)
+# Only the visits are a proof: the remaining visits cannot give the lead to another child, so a search stopped early
+# returns the most visited child (see MCTS). The value check only waits until that child is also the one a complete
+# search would pick by value, it cannot tell how the values would move later on
+def decided(root, remaining_visits):
+    if not root.fully_explored():
+        return False
+    if len(root.children) == 1:
+        return True
+    by_visits = sorted(root.children, key=lambda c: c.visits, reverse=True)
+    first, second = by_visits[0], by_visits[1]
+    if first.visits - second.visits <= remaining_visits:
+        return False
+    return first.reward / first.visits >= max(c.reward / c.visits for c in root.children)
+
+
+
+# Fills a search info dictionary (iterations done, time spent, speed and reason of the stop)
+def search_info(info, iterations, start, stopped):
+    elapsed = time.perf_counter() - start
+    info['iterations'] = iterations
+    info['elapsed'] = elapsed
+    info['iterations_per_second'] = iterations / elapsed if elapsed > 0 else 0.0
+    info['stopped'] = stopped
+
+
+
+# Progress of a search still running: iterations done so far (or depth completed), time spent and best move so far
+# Reports are small dictionaries, made to be passed to another thread (see gui.py)
+def progress_report(iterations, start, column, **fields):
+    report = { 'iterations': iterations, 'elapsed': time.perf_counter() - start, 'column': int(column) }
+    report.update(fields)
+    return report
+
+
+
+# Adds the shape of an MCTS tree to a search info dictionary: number of nodes, depth of the deepest node selected,
+# visits and value of every root child (one entry per column, 0 visits for the moves not tried), and the mean and
+# longest random playout (None when they were not recorded)
+# children holds (move, visits, reward) for every child of the root
+def tree_info(info, size, max_depth, lengths, children):
+    visits = [0] * COLUMN_COUNT
+    values = [None] * COLUMN_COUNT
+    for move, child_visits, child_reward in children:
+        visits[move] = int(child_visits)
+        values[move] = float(child_reward / child_visits)
+    info['tree_size'] = size
+    info['max_depth'] = max_depth
+    info['root_visits'] = visits
+    info['root_values'] = values
+    info['rollout_length_mean'] = sum(lengths) / len(lengths) if lengths else None
+    info['rollout_length_max'] = max(lengths) if lengths else None
+
+
+
 # Determines next move by exploring the tree
-def tree_policy(node, player, factor):
-    while node.state.game_ended() == False and node.state.is_winner() == 0:
+# board starts in the position of node and is left in the position of the node returned
+# The descent stops at the first proven node (finished games included), there is nothing left to learn below it
+def tree_policy(node, player, factor, board):
+    while node.proven is None:
         if node.fully_explored() == False:
-            return expand(node, player), -player
+            return expand(node, player, board), -player
         else:
             node = best_child(node, factor)
+            board.play(node.move, player)
             player *= -1
     return node, player
     
 
 
-# Explores further nodes (moves) from a given fringe
-def expand(node, player):
-    tried_children_move = [m for m in node.children_move]
-    possible_moves = node.state.available_cols()
+# Explores further nodes (moves) from a given fringe (board is in the position of node and is moved to the new child)
+def expand(node, player, board):
+    tried_children_move = node.children_move
+    possible_moves = board.distinct_cols()
 
     for col in possible_moves:
         if col not in tried_children_move:
-            row = node.state.get_next_open_row(col)
-            # Create a new node object that is an identical copy of the original
-            new_state = copy.deepcopy(node.state)
-            new_state.board[row][col] = player
-            new_state.last_move = [row, col]
+            board.play(col, player)
             break
     
-    node.add_child(new_state, col)
-    return node.children[-1]
+    node.add_child(None, col, player)
+    child = node.children[-1]
+    child.set_position(board)
+    return child
 
 
 
 # Calculates the UCB for all child nodes and returns a random child node from the best UCBs
+# A child proven won is taken right away, the children proven lost are left out (unless they all are) and the value
+# of a proven draw is exactly 0
 def best_child(node, factor):
+    wins = [c for c in node.children if c.proven == 1]
+    if wins:
+        return random.choice(wins)
+    children = [c for c in node.children if c.proven != -1] or node.children
     best_score = -math.inf
     best_children = []
-    for c in node.children:
+    for c in children:
         # Calculate the UCB for each node
-        node_value = c.reward / c.visits
+        node_value = 0.0 if c.proven == 0 else c.reward / c.visits
         explore = math.sqrt(math.log(2.0 * node.visits) / float(c.visits))
         score = node_value + factor * explore
         if score == best_score:
@@ -338,80 +696,510 @@ def best_child(node, factor):
             best_children = [c]
             best_score = score
 
-    return np.random.choice(best_children)
+    return random.choice(best_children)
 
 
 
 # Determines the next state by playing randomly
-def default_policy(state, player):
+# The moves are played on state itself and taken back before returning, so state is left unchanged
+# The number of moves played is appended to lengths if given
+def default_policy(state, player, lengths=None):
+    played = 0
     while state.game_ended() == False and state.is_winner() == 0:
-        state = state.next_state(player)
+        state.play(random.choice(state.available_cols()), player)
         player *= -1
-    return state.is_winner()
+        played += 1
+    winner = state.is_winner()
+    for _ in range(played):
+        state.undo()
+    if lengths is not None:
+        lengths.append(played)
+    return winner
 
 
 
 # Update the current node sequence with the simulation result
-def backpropagate(node, reward, player):
+# reward is the sum of the winners of the playouts played from the node (one playout by default)
+# Proofs are passed up the path for as long as they settle the parents
+def backpropagate(node, reward, player, playouts=1):
+    proving = True
     while node != None:
-        node.visits += 1
+        node.visits += playouts
         node.reward -= player * reward
+        if proving:
+            proving = prove(node)
         node = node.parent
         player *= -1
     return
 
 
 
+# Tries to prove a node from its children (their values are for the player to move in the node): one child won is
+# enough to lose, and once every move was tried and proven, the node gets the opposite of the best child
+# Returns whether the node is proven
+def prove(node):
+    if node.proven is None:
+        values = [c.proven for c in node.children]
+        if 1 in values:
+            node.proven = -1
+        elif node.fully_explored() and None not in values:
+            node.proven = -max(values)
+    return node.proven is not None
+
+
+
+# Sum of the winners of playouts games played from a proven node (player is the player to move in it)
+def proven_reward(node, player, playouts=1):
+    return -player * node.proven * playouts
+
+
+
+# Result of a proven root for the player to move ('win', 'loss' or 'draw'), None when it is not proven
+def proven_result(root):
+    if root.proven is None:
+        return None
+    return { -1: 'win', 0: 'draw', 1: 'loss' }[root.proven]
+
+
+
+# SUBTREE REUSE (keep the MCTS tree from one move to the next)
+# Finds the node holding the same position as state (or its mirror image) among the root, its children and
+# grandchildren (our own move and the opponent's reply), or returns None
+# A node holding the mirror image is turned into the root of state: its subtree is mirrored (see mirror_tree)
+def find_subtree(root, state, max_depth=2):
+    key = state.key()
+    mirrored = state.mirror_key()
+    frontier = [root]
+    for depth in range(max_depth + 1):
+        next_frontier = []
+        for node in frontier:
+            node_key = node.state.key()
+            if node_key == key:
+                return node
+            if node_key == mirrored:
+                node.detach()
+                mirror_tree(node)
+                node.stored_state = state.copy()
+                return node
+            next_frontier.extend(node.children)
+        frontier = next_frontier
+    return None
+
+
+
+# Swaps left and right in the moves of a whole tree (the boards stored in the nodes are not changed)
+def mirror_tree(root):
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node.move is not None:
+            node.move = mirror_col(node.move)
+        node.children_move = [mirror_col(move) for move in node.children_move]
+        stack.extend(node.children)
+
+
+
+# Counts the nodes of a tree
+def tree_size(root):
+    size = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        size += 1
+        stack.extend(node.children)
+    return size
+
+
+
+# Cuts a tree down to max_nodes nodes, keeping the shallowest and most visited ones (breadth first)
+# Children that are cut off are simply expanded again later if the search needs them
+# The proofs of the nodes left (MCTS-Solver) are worked out again from the children kept, children first: a proof
+# resting on a child that was cut off is dropped (finished games stay proven)
+def prune_tree(root, max_nodes):
+    kept = 1
+    queue = [root]
+    for node in queue:
+        order = sorted(range(len(node.children)), key=lambda i: node.children[i].visits, reverse=True)
+        keep = sorted(order[:max(0, max_nodes - kept)])
+        node.children = [node.children[i] for i in keep]
+        node.children_move = [node.children_move[i] for i in keep]
+        kept += len(keep)
+        queue.extend(node.children)
+    for node in reversed(queue):
+        if not node.terminal():
+            node.proven = None
+            prove(node)
+    return kept
+
+
+
+# TRANSPOSITION TABLE (cache of positions already searched by minimax)
+# Entries are stored in fixed-size NumPy arrays so the memory used never grows past the budget given
+# Every bucket has two slots: the first one keeps the deepest search (depth-preferred), the second one always takes the newest entry
+class TranspositionTable(object):
+
+    def __init__(self, max_bytes=MINMAX_TT_BYTES):
+        # Number of buckets that fit in the memory budget (2 slots per bucket)
+        self.size = max(1, max_bytes // (2 * TT_ENTRY_BYTES))
+        self.keys = np.zeros((self.size, 2), dtype=np.uint64)
+        self.values = np.zeros((self.size, 2), dtype=np.int64)
+        self.depths = np.zeros((self.size, 2), dtype=np.int8)
+        self.moves = np.zeros((self.size, 2), dtype=np.int8)
+        self.flags = np.zeros((self.size, 2), dtype=np.int8)
+        # Counters to check how useful the table is
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+        self.stores = 0
+
+
+
+    # Spread the position keys over the buckets (multiplicative hashing)
+    def index(self, key):
+        return ((key * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) % self.size
+
+
+
+    # Returns (depth, value, move, flag) for a stored position, or None if it is not in the table
+    def probe(self, key):
+        i = self.index(key)
+        k = np.uint64(key)
+        for slot in range(2):
+            if self.keys[i, slot] == k:
+                self.hits += 1
+                return int(self.depths[i, slot]), int(self.values[i, slot]), int(self.moves[i, slot]), int(self.flags[i, slot])
+        self.misses += 1
+        # The bucket is used by other positions
+        if self.keys[i, 0] != 0 or self.keys[i, 1] != 0:
+            self.collisions += 1
+        return None
+
+
+
+    # Saves the result of a search, following the two-tier replacement policy
+    def store(self, key, depth, value, move, flag):
+        i = self.index(key)
+        k = np.uint64(key)
+        self.stores += 1
+        if self.keys[i, 0] == k or depth >= self.depths[i, 0]:
+            # Deeper (or same) search: the previous depth-preferred entry moves to the always-replace slot
+            if self.keys[i, 0] != k and self.keys[i, 0] != 0:
+                self.write(i, 1, self.keys[i, 0], self.depths[i, 0], self.values[i, 0], self.moves[i, 0], self.flags[i, 0])
+            self.write(i, 0, k, depth, value, move, flag)
+        else:
+            self.write(i, 1, k, depth, value, move, flag)
+
+
+
+    def write(self, i, slot, key, depth, value, move, flag):
+        self.keys[i, slot] = key
+        self.depths[i, slot] = depth
+        self.values[i, slot] = value
+        self.moves[i, slot] = move
+        self.flags[i, slot] = flag
+
+
+
+    # Forget every entry (and the counters)
+    def clear(self):
+        self.keys.fill(0)
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+        self.stores = 0
+
+
+
+    # Hit/miss/collision counters in a dictionary (easy to print or log)
+    def stats(self):
+        probes = self.hits + self.misses
+        return { 'probes': probes,
+                 'hits': self.hits,
+                 'misses': self.misses,
+                 'collisions': self.collisions,
+                 'stores': self.stores,
+                 'hit_rate': self.hits / probes if probes > 0 else 0.0 }
+
+
+
+# Key used by minimax: the position key plus two bits telling which side is maximizing and which player minimax plays
+# Mirror images share their entry: the key is built from the canonical key, and the second value returned tells
+# whether the moves read from or saved to the table must be mirrored
+def tt_key(state, maximizingPlayer, player=MINMAX_PLAYER):
+    key, mirrored = state.canonical_key()
+    return key * 4 + (2 if maximizingPlayer else 0) + (1 if player == 1 else 0), mirrored
+
+
+
+# MOVE ORDERING (alpha/beta prunes more when the best moves are tried first)
+# Moves are sorted by: transposition table move, principal variation, killer moves, history score and finally closeness to the centre
+class MoveOrdering(object):
+
+    def __init__(self):
+        # Depth of the iteration currently searched (used to turn the remaining depth into a ply)
+        self.root_depth = 0
+        # Principal variation of the previous iteration (one column per ply)
+        self.pv = []
+        # Two most recent moves that caused a cutoff at every ply
+        self.killers = [[] for _ in range(MINMAX_MAX_DEPTH + 1)]
+        # How often placing a token in a cell caused a cutoff, for each side (maximizing or not)
+        self.history = { True: np.zeros((ROW_COUNT, COLUMN_COUNT), dtype=np.int64),
+                         False: np.zeros((ROW_COUNT, COLUMN_COUNT), dtype=np.int64) }
+
+
+
+    # Sort the legal moves of a node from the most to the least promising
+    def order(self, state, moves, depth, maximizingPlayer, tt_move=None):
+        ply = self.root_depth - depth
+        pv_move = self.pv[ply] if 0 <= ply < len(self.pv) else None
+        killers = self.killers[ply] if 0 <= ply < len(self.killers) else []
+        history = self.history[maximizingPlayer]
+
+        def priority(col):
+            if col == tt_move:
+                return 4000000000
+            if col == pv_move:
+                return 3000000000
+            if col in killers:
+                return 2000000000 - killers.index(col)
+            centre = COLUMN_COUNT - abs(col - COLUMN_COUNT // 2)
+            return int(history[state.get_next_open_row(col)][col]) * COLUMN_COUNT + centre
+
+        return sorted(moves, key=priority, reverse=True)
+
+
+
+    # Record a move that caused an alpha/beta cutoff (before it is played)
+    def cutoff(self, state, col, depth, maximizingPlayer):
+        ply = self.root_depth - depth
+        if 0 <= ply < len(self.killers):
+            killers = self.killers[ply]
+            if col in killers:
+                killers.remove(col)
+            killers.insert(0, col)
+            del killers[2:]
+        self.history[maximizingPlayer][state.get_next_open_row(col)][col] += depth * depth
+
+
+
+# Raised by minimax when the iterative deepening deadline has passed
+class SearchTimeout(Exception):
+    pass
+
+
+
+# Counters of a minimax search (nodes visited, leaves evaluated and alpha/beta cutoffs at every ply from the root)
+class MinimaxStats(object):
+
+    def __init__(self):
+        self.nodes = 0
+        self.leaves = 0
+        self.cutoffs = [0] * (MINMAX_MAX_DEPTH + 1)
+        # Depth of the search started at the root (turns the remaining depth of a node into its ply)
+        self.root_depth = 0
+
+
+
 # 3. Minmax with alpha/beta pruning
 # This algorithm works recursively
-def minimax(state, depth, alpha, beta, maximizingPlayer):
-    valid_locations = state.available_cols()
+# An optional transposition table (tt) caches the positions already searched
+# An optional move ordering sorts the moves before searching them, and the search stops (SearchTimeout) past the deadline
+# Scores are given from the point of view of player (MINMAX_PLAYER by default)
+# The nodes, leaves and cutoffs are counted in stats (a MinimaxStats) if given
+def minimax(state, depth, alpha, beta, maximizingPlayer, tt=None, ordering=None, deadline=None, player=MINMAX_PLAYER, stats=None):
+    if deadline is not None and time.perf_counter() > deadline:
+        raise SearchTimeout()
+
+    # Mirror moves of a symmetric position are searched once
+    valid_locations = state.distinct_cols()
     is_terminal = is_terminal_node(state)
+    if stats is not None:
+        stats.nodes += 1
 
     if depth == 0 or is_terminal:
+        if stats is not None:
+            stats.leaves += 1
         if is_terminal:
-            if state.winning_move(MINMAX_PLAYER):
+            if state.winning_move(player):
                 return (None, 100000000000000)
-            elif state.winning_move(-MINMAX_PLAYER):
+            elif state.winning_move(-player):
                 return (None, -10000000000000)
             else: # Game is over, no more valid moves
                 return (None, 0)
         else: # Depth is zero
-            return (None, score_position(state, MINMAX_PLAYER))
-        
+            return (None, score_position(state, player))
+
+    # Look up the position in the transposition table
+    alpha_orig, beta_orig = alpha, beta
+    tt_move = None
+    if tt is not None:
+        key, mirrored = tt_key(state, maximizingPlayer, player)
+        entry = tt.probe(key)
+        if entry is not None:
+            tt_depth, tt_value, tt_move, tt_flag = entry
+            if mirrored:
+                tt_move = mirror_col(tt_move)
+            if tt_depth >= depth:
+                if tt_flag == TT_EXACT:
+                    return tt_move, tt_value
+                elif tt_flag == TT_LOWER:
+                    alpha = max(alpha, tt_value)
+                elif tt_flag == TT_UPPER:
+                    beta = min(beta, tt_value)
+                if alpha >= beta:
+                    return tt_move, tt_value
+            # Try the best move found by the previous search first
+            if ordering is None and tt_move in valid_locations:
+                valid_locations.remove(tt_move)
+                valid_locations.insert(0, tt_move)
+
+    if ordering is not None:
+        valid_locations = ordering.order(state, valid_locations, depth, maximizingPlayer, tt_move)
+
     if maximizingPlayer:
         value = -math.inf
         column = random.choice(valid_locations)
         for col in valid_locations:
-            row = state.get_next_open_row(col)
-            state_cp = copy.deepcopy(state)
-            state_cp.place_token(row, col, MINMAX_PLAYER)
-            new_score = minimax(state_cp, depth-1, alpha, beta, False)[1]
+            # Play the move in place and take it back afterwards (even when the search times out)
+            state.play(col, player)
+            try:
+                new_score = minimax(state, depth-1, alpha, beta, False, tt, ordering, deadline, player, stats)[1]
+            finally:
+                state.undo()
             if new_score > value:
                 value = new_score
                 column = col
             alpha = max(alpha, value)
             if alpha >= beta:
+                if ordering is not None:
+                    ordering.cutoff(state, col, depth, maximizingPlayer)
+                if stats is not None:
+                    stats.cutoffs[stats.root_depth - depth] += 1
                 break
         # print("MAX VALUE = ", value)
-        return column, value
 
     else: # Minimizing player
         value = math.inf
         column = random.choice(valid_locations)
         for col in valid_locations:
-            row = state.get_next_open_row(col)
-            state_cp = copy.deepcopy(state)
-            state_cp.place_token(row, col, -MINMAX_PLAYER)
-            new_score = minimax(state_cp, depth-1, alpha, beta, True)[1]
+            # Play the move in place and take it back afterwards (even when the search times out)
+            state.play(col, -player)
+            try:
+                new_score = minimax(state, depth-1, alpha, beta, True, tt, ordering, deadline, player, stats)[1]
+            finally:
+                state.undo()
             if new_score < value:
                 value = new_score
                 column = col
             beta = min(beta, value)
             if alpha >= beta:
+                if ordering is not None:
+                    ordering.cutoff(state, col, depth, maximizingPlayer)
+                if stats is not None:
+                    stats.cutoffs[stats.root_depth - depth] += 1
                 break
         # print("MIN VALUE = ", value)
-        return column, value
+
+    # Save the result with the kind of bound it represents
+    if tt is not None:
+        if value <= alpha_orig:
+            flag = TT_UPPER
+        elif value >= beta_orig:
+            flag = TT_LOWER
+        else:
+            flag = TT_EXACT
+        tt.store(key, depth, value, mirror_col(column) if mirrored else column, flag)
+    return column, value
+
+
+
+# Iterative deepening: search at depth 1, 2, 3... until the time budget runs out (scoring leaves incrementally)
+# Always returns the best move of the deepest iteration that completed, its value and that depth
+# The first iteration is never interrupted, so there is always a move to play
+# The statistics of the whole search are written in info (a dictionary) if given, see minimax_info
+# progress, if given, is called after every completed iteration (see progress_report, iterations counts the depths)
+def iterative_deepening(state, time_budget=MINMAX_TIME_BUDGET, max_depth=MINMAX_MAX_DEPTH, tt=None, ordering=None, player=MINMAX_PLAYER, info=None, progress=None):
+    start = time.perf_counter()
+    deadline = start + time_budget
+    if tt is None:
+        tt = TranspositionTable()
+    if ordering is None:
+        ordering = MoveOrdering()
+    stats = MinimaxStats() if info is not None else None
+    probes, hits = tt.hits + tt.misses, tt.hits
+    # Nodes searched by every completed iteration
+    nodes_by_depth = []
+
+    column, value, depth_reached = None, None, 0
+    # The search runs on a copy of the position that keeps its leaf scores up to date on every move
+    state = state.copy()
+    state.attach_evaluator(IncrementalEvaluator(state))
+    # There is no point searching deeper than the number of empty cells
+    max_depth = min(max_depth, ROW_COUNT * COLUMN_COUNT - sum(state.heights))
+    for depth in range(1, max(1, max_depth) + 1):
+        ordering.root_depth = depth
+        if stats is not None:
+            stats.root_depth = depth
+            nodes_before = stats.nodes
+        try:
+            col, score = minimax(state, depth, -math.inf, math.inf, True, tt, ordering, deadline if depth > 1 else None, player, stats)
+        except SearchTimeout:
+            break
+        column, value, depth_reached = col, score, depth
+        ordering.pv = principal_variation(state, tt, depth, player)
+        if stats is not None:
+            nodes_by_depth.append(stats.nodes - nodes_before)
+        if progress is not None:
+            progress(progress_report(depth, start, col, depth=depth, value=score))
+
+        # Stop early once the result is forced or the time is up
+        if abs(value) >= MINMAX_WIN_SCORE or time.perf_counter() >= deadline:
+            break
+
+    if info is not None:
+        minimax_info(info, stats, nodes_by_depth, tt.hits + tt.misses - probes, tt.hits - hits, start)
+        info.update({ 'column': column, 'value': value, 'depth': depth_reached, 'pv': list(ordering.pv) })
+    return column, value, depth_reached
+
+
+
+# Fills a search info dictionary with the statistics of a minimax search:
+# nodes visited, leaves evaluated, cutoffs at every ply, nodes of every completed iteration, effective branching
+# factor (growth of the node count between the last two iterations), transposition table probes and hits, time spent
+def minimax_info(info, stats, nodes_by_depth, tt_probes, tt_hits, start):
+    elapsed = time.perf_counter() - start
+    cutoffs = stats.cutoffs[:]
+    while len(cutoffs) > 1 and cutoffs[-1] == 0:
+        cutoffs.pop()
+    info['nodes'] = stats.nodes
+    info['leaves'] = stats.leaves
+    info['cutoffs_by_ply'] = cutoffs
+    info['nodes_by_depth'] = nodes_by_depth
+    info['branching_factor'] = nodes_by_depth[-1] / nodes_by_depth[-2] if len(nodes_by_depth) > 1 and nodes_by_depth[-2] > 0 else None
+    info['tt_probes'] = tt_probes
+    info['tt_hits'] = tt_hits
+    info['elapsed'] = elapsed
+    info['nodes_per_second'] = stats.nodes / elapsed if elapsed > 0 else 0.0
+
+
+
+# Follow the best moves saved in the transposition table from a position
+def principal_variation(state, tt, depth, player=MINMAX_PLAYER):
+    pv = []
+    state_cp = state.copy()
+    maximizingPlayer = True
+    for _ in range(depth):
+        key, mirrored = tt_key(state_cp, maximizingPlayer, player)
+        entry = tt.probe(key)
+        if entry is None:
+            break
+        col = mirror_col(entry[2]) if mirrored else entry[2]
+        if not state_cp.try_move(col) or is_terminal_node(state_cp):
+            break
+        pv.append(col)
+        state_cp.play(col, player if maximizingPlayer else -player)
+        maximizingPlayer = not maximizingPlayer
+    return pv
 
 
 
@@ -447,249 +1235,676 @@ def evaluate_window(window, player):
 
 
 
-# Takes a given board state and applies a score to the relevant player
-# This function counts desirable patterns (two in a row, three in a row, winner) which have a point weight 
-# Minmax uses this to determine which moves are worth more (or less) when computing its optimal strategy
-def score_position(state, player):
-    score = 0
-
-    # Score centre column
-    centre_array = [int(i) for i in list(state.board[:, COLUMN_COUNT // 2])]
-    centre_count = centre_array.count(player)
-    score += centre_count * 3
-
-    # Score horizontal positions
+# EVALUATION TABLES
+# The 69 windows of 4 cells (horizontal, vertical and both diagonals) that score_position looks at,
+# as flat cell indices (row * COLUMN_COUNT + col) of the 6x7 board
+def build_windows():
+    windows = []
     for r in range(ROW_COUNT):
-        row_array = [int(i) for i in list(state.board[r, :])]
         for c in range(COLUMN_COUNT - 3):
-            # Create a horizontal window of 4
-            window = row_array[c:c + 4]
-            score += evaluate_window(window, player)
-
-    # Score vertical positions
+            windows.append([r * COLUMN_COUNT + c + i for i in range(4)])
     for c in range(COLUMN_COUNT):
-        col_array = [int(i) for i in list(state.board[:, c])]
         for r in range(ROW_COUNT - 3):
-            # Create a vertical window of 4
-            window = col_array[r:r + 4]
-            score += evaluate_window(window, player)
-
-    # Score positive diagonals
+            windows.append([(r + i) * COLUMN_COUNT + c for i in range(4)])
     for r in range(ROW_COUNT - 3):
         for c in range(COLUMN_COUNT - 3):
-            # Create a positive diagonal window of 4
-            window = [state.board[r + i][c + i] for i in range(4)]
-            score += evaluate_window(window, player)
+            windows.append([(r + i) * COLUMN_COUNT + c + i for i in range(4)])
+            windows.append([(r + 3 - i) * COLUMN_COUNT + c + i for i in range(4)])
+    return windows
+
+WINDOWS = np.array(build_windows(), dtype=np.intp)
+N_WINDOWS = len(WINDOWS)
+# Windows going through every cell (used to update the scores incrementally)
+CELL_WINDOWS = [[w for w in range(N_WINDOWS) if cell in WINDOWS[w]] for cell in range(ROW_COUNT * COLUMN_COUNT)]
+# Score of a window for a player, indexed by the number of tokens of that player and of the opponent in it
+# (built with evaluate_window so the weights are only written once)
+WINDOW_SCORES = np.array([[evaluate_window([1] * p + [-1] * o + [0] * (4 - p - o), 1) if p + o <= 4 else 0
+                           for o in range(5)] for p in range(5)], dtype=np.int64)
+# Same table as plain lists, and the change of the window score when a token is added for the player (own)
+# or for the opponent (other)
+WINDOW_SCORE_LIST = WINDOW_SCORES.tolist()
+DELTA_OWN = [[WINDOW_SCORE_LIST[p + 1][o] - WINDOW_SCORE_LIST[p][o] if p + o < 4 else 0 for o in range(5)] for p in range(5)]
+DELTA_OTHER = [[WINDOW_SCORE_LIST[p][o + 1] - WINDOW_SCORE_LIST[p][o] if p + o < 4 else 0 for o in range(5)] for p in range(5)]
+CENTRE_COLUMN = COLUMN_COUNT // 2
 
-    # Score negative diagonals
-    for r in range(ROW_COUNT - 3):
-        for c in range(COLUMN_COUNT - 3):
-            # Create a negative diagonal window of 4
-            window = [state.board[r + 3 - i][c + i] for i in range(4)]
-            score += evaluate_window(window, player)
 
-    return score
 
+# Takes a given board state and applies a score to the relevant player
+# This function counts desirable patterns (two in a row, three in a row, winner) which have a point weight 
+# Minmax uses this to determine which moves are worth more (or less) when computing its optimal strategy
+# When an incremental evaluator is attached to the state, its running score is used instead of scanning the board
+def score_position(state, player):
+    if state.evaluator is not None:
+        return state.evaluator.score(player)
+    return int(score_boards(state.board[np.newaxis], player)[0])
 
 
-# PYGAME GUI AND INITIALIZATIONS ----------------------------------
-# GAME VARIABLES
-# Create a Connect4 object with a board and available columns tracker variables
-game = C4()
-# Determines the starting player (1 or -1)
-player = 1
-# Counts how many moves have been played in total
-mvcntr = 1
-# Track if the game is over or not (originally this is false)
-game_over = False
-# Track which players are currently playing against each other
-# player_1_agent = agents[0] # 0 - HUMAN
-# player_1_agent = agents[1] # 1 - RANDOM
-# player_1_agent = agents[2] # 2 - MINMAX
-player_1_agent = agents[3] # 3 - MCTS
-
-# player_2_agent = agents[2] # 0 - HUMAN
-# player_2_agent = agents[2] # 1 - RANDOM
-player_2_agent = agents[2] # 2 - MINMAX
-# player_2_agent = agents[2] # 3 - MCTS
-
-# Initialize game
-pygame.init()
-
-# Define our screen size
-SQUARESIZE = 100
 
-# Define width and height of our board
-width = COLUMN_COUNT * SQUARESIZE
-height = (ROW_COUNT+1) * SQUARESIZE
+# Scores a batch of boards (N, 6, 7) at once for player with the same weights as score_position
+def score_boards(boards, player):
+    cells = np.asarray(boards).reshape(len(boards), ROW_COUNT * COLUMN_COUNT)
+    windows = cells[:, WINDOWS]
+    own = (windows == player).sum(axis=2)
+    other = (windows == -player).sum(axis=2)
+    # Score centre column
+    centre = (cells[:, CENTRE_COLUMN::COLUMN_COUNT] == player).sum(axis=1)
+    return WINDOW_SCORES[own, other].sum(axis=1) + centre * 3
 
-size = (width, height)
 
-RADIUS = int(SQUARESIZE/2 - 5)
 
-screen = pygame.display.set_mode(size)
-game.print_board()
-pygame.display.update()
+# INCREMENTAL EVALUATION
+# Keeps the number of tokens of each player in every window, and the resulting score of both players
+# C4 updates it on every play/undo once it is attached (see C4.attach_evaluator), so a leaf score is a lookup
+class IncrementalEvaluator(object):
 
-myfont = pygame.font.SysFont("monospace", 75)
+    def __init__(self, state=None):
+        self.counts = { 1: [0] * N_WINDOWS, -1: [0] * N_WINDOWS }
+        # Empty windows score 0, so an empty board scores 0 for both players
+        self.scores = { 1: 0, -1: 0 }
+        if state is not None:
+            board = state.board
+            for r in range(ROW_COUNT):
+                for c in range(COLUMN_COUNT):
+                    if board[r][c] != 0:
+                        self.add(r, c, int(board[r][c]))
 
 
 
-## GAME LOOP --------------------------------------------------
-while not game_over:
+    def score(self, player):
+        return self.scores[player]
 
-    # Player 1 is controlled by the player or MCTS agent
-    if player == 1:
-        # Add a delay to avoid AI playing too fast
-        pygame.time.wait(TURN_DELAY)
 
-        # Player 1 can be human, MCTS or Minmax
-        if player_1_agent == 'human':
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    sys.exit()
 
-                if event.type == pygame.MOUSEMOTION:
-                    pygame.draw.rect(screen, BLACK, (0,0, width, SQUARESIZE))
-                    posx = event.pos[0]
-                    if player == 1:
-                        pygame.draw.circle(screen, RED, (posx, int(SQUARESIZE/2)), RADIUS)
-                    else: 
-                        pygame.draw.circle(screen, YELLOW, (posx, int(SQUARESIZE/2)), RADIUS)
-                pygame.display.update()
-        
-                # Player 1 is controlled by the Player
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    pygame.draw.rect(screen, BLACK, (0,0, width, SQUARESIZE))
+    # A token of player was placed in (row, col)
+    def add(self, row, col, player):
+        own = self.counts[player]
+        other = self.counts[-player]
+        own_score = 0
+        other_score = 0
+        for w in CELL_WINDOWS[row * COLUMN_COUNT + col]:
+            p = own[w]
+            o = other[w]
+            own_score += DELTA_OWN[p][o]
+            other_score += DELTA_OTHER[o][p]
+            own[w] = p + 1
+        if col == CENTRE_COLUMN:
+            own_score += 3
+        self.scores[player] += own_score
+        self.scores[-player] += other_score
 
-                    if player == 1:
-                        posx = event.pos[0]
-                        col = int(math.floor(posx/SQUARESIZE))
 
-                        # Apply move to game state
-                        if game.try_move(col):
-                            row = game.get_next_open_row(col)
-                            game.place_token(row, col, player)
 
-        # Player 1 is controlled by MCTS agent
-        elif player_1_agent == 'mcts':
-            # Get best move using MCTS
-            o = Node(game)
-            best_move = MCTS(MCTS_MAX_ITER, o, MCTS_FACTOR, player)
-            game = copy.deepcopy(best_move.state)
+    # The token of player in (row, col) was taken back
+    def remove(self, row, col, player):
+        own = self.counts[player]
+        other = self.counts[-player]
+        own_score = 0
+        other_score = 0
+        for w in CELL_WINDOWS[row * COLUMN_COUNT + col]:
+            p = own[w] - 1
+            o = other[w]
+            own_score -= DELTA_OWN[p][o]
+            other_score -= DELTA_OTHER[o][p]
+            own[w] = p
+        if col == CENTRE_COLUMN:
+            own_score -= 3
+        self.scores[player] += own_score
+        self.scores[-player] += other_score
 
-        # Player 1 is controlled by Minmax agent
-        elif player_1_agent == 'minmax':
-            col, minimax_score = minimax(game, MINMAX_DEPTH, -math.inf, math.inf, True)
 
-            # Apply move to game state
-            if game.try_move(col):
-                row = game.get_next_open_row(col)
-                game.place_token(row, col, player)
-            
-        # Detect if Player 1 has won
-        if game.winning_move(player):
-            label = myfont.render("Player 1 wins!!", 1, RED)
-            screen.blit(label, (40,10))
-            game_over = True
-        # Detect if game has ended with no winner (DRAW)
-        elif game.game_ended():
-            label = myfont.render("Draw", 1, BLUE)
-            screen.blit(label, (40,10))
-            game_over = True
-
-        # Mark the next player to play
-        player *= -1
 
-        # Increment move counter
-        mvcntr += 1
-        
-        # Refresh game board
-        game.print_board()
+# Whether the agents should hand the position over to the endgame solver (few empty cells left, player to move)
+def solvable(game, player, solver_cells):
+    return bool(solver_cells) and player == game.to_move() and ROW_COUNT * COLUMN_COUNT - sum(game.heights) <= solver_cells
+
+
+
+# Move an agent plays without searching: from its opening book, or from its endgame solver (created on first use)
+# once few enough cells are left empty
+# Returns (column, search info), or None when the agent has to search (start: time.perf_counter() when the move began)
+def known_move(agent, game, player, start):
+    from book import book_move
+    entry = book_move(agent.book, game, player)
+    if entry is not None:
+        return entry[0], { 'book': True, 'column': entry[0], 'value': entry[1], 'elapsed': time.perf_counter() - start }
+    if solvable(game, player, agent.solver_cells):
+        from solver import Solver, solve_move
+        if agent.solver is None:
+            agent.solver = Solver()
+        return solve_move(agent.solver, game)
+    return None
+
+
+
+# Background search thread of an agent that ponders (share: CPU share of pondering, None for the default)
+def ponder_thread(share=None):
+    from ponder import PONDER_CPU_SHARE, Ponderer
+    return Ponderer(PONDER_CPU_SHARE if share is None else share)
+
+
+
+# AGENTS ----------------------------------------------------------
+# Every AI agent exposes move(game, player), which returns the column to play for player without modifying game,
+# reset(), which is called between two games, and close(), which frees what the agent holds once it is not needed anymore
+# After every move, last_search holds a dictionary describing the search (None for agents that do not search),
+# and on_search, a function that can be given to the searching agents, is called with it (to log or export the numbers)
+# on_progress, if set, is called during the searches with their progress so far (see progress_report), the parallel
+# searches, the book and the solver do not report any
+class RandomAgent(object):
+
+    last_search = None
+    on_search = None
+    on_progress = None
+
+    def move(self, game, player):
+        return play_random(game)
+
+
+
+    def reset(self):
+        pass
+
+
+
+    def close(self):
+        pass
+
+
+
+# With workers > 1 every search runs in a pool of processes sharing one transposition table (Lazy SMP, see lazy_smp.py)
+# With ponder, the position after the reply predicted by the principal variation is searched in the background until
+# the next move (see ponder.py): the transposition table fills up, and when the prediction was right the next search
+# also starts from the move ordering of pondering
+class MinimaxAgent(object):
+
+    def __init__(self, time_budget=MINMAX_TIME_BUDGET, max_depth=MINMAX_MAX_DEPTH, tt_bytes=MINMAX_TT_BYTES, on_search=None, book=None, solver_cells=SOLVER_EMPTY_CELLS,
+                 workers=1, ponder=False, ponder_share=None, on_progress=None):
+        from book import open_book
+        if workers < 1:
+            raise ValueError("Minmax needs at least one worker")
+        if ponder and workers > 1:
+            raise ValueError("Minmax only ponders with a single worker")
+        self.time_budget = time_budget
+        self.max_depth = max_depth
+        self.workers = workers
+        self.tt_bytes = tt_bytes
+        # Minmax keeps its transposition table from one move to the next (entries stay valid between games)
+        self.tt = TranspositionTable(tt_bytes) if workers == 1 else None
+        # The worker processes and their shared table are only started on the first search
+        self.smp = None
+        self.last_search = None
+        self.on_search = on_search
+        self.on_progress = on_progress
+        # Opening book (path of a book file or OpeningBook) looked up before searching
+        self.book = open_book(book)
+        # Endgame solver, created when it is first needed
+        self.solver_cells = solver_cells
+        self.solver = None
+        # Background search between the moves: the position pondered (key), its move ordering and the deepest
+        # iteration completed on it
+        self.ponderer = ponder_thread(ponder_share) if ponder else None
+        self.ponder_key = None
+        self.ponder_ordering = None
+        self.ponder_depth = 0
+
+
+
+    def move(self, game, player):
+        start = time.perf_counter()
+        ordering = None
+        pondered = self.stop_pondering()
+        if pondered is not None:
+            pondered['hit'] = self.ponder_key == game.key()
+            pondered['depth'] = self.ponder_depth
+            if pondered['hit']:
+                ordering = self.ponder_ordering
+        known = known_move(self, game, player, start)
+        if known is not None:
+            col, info = known
+        else:
+            info = {}
+            col, score, depth = self.search(game, player, info, ordering)
+        if pondered is not None:
+            info['ponder'] = pondered
+        self.last_search = info
+        if self.on_search is not None:
+            self.on_search(info)
+        if self.ponderer is not None and len(info.get('pv', [])) > 1:
+            self.start_pondering(game, player, col, info['pv'][1])
+        return col
+
+
 
-        # Reset game after delay when game has ended
-        if game_over:
-            pygame.time.wait(WAIT_TIME)
-            game_over = False
-            player = 1
-            game.reset_board()
-            game.print_board()
-            pygame.draw.rect(screen, BLACK, (0,0, width, SQUARESIZE))
-    
-    # Let's have player 2 play using random or minmax agent or MCTS
-    if player == -1:
-        # Add a delay to avoid AI playing too fast
-        pygame.time.wait(TURN_DELAY)
+    # Iterative deepening in this process, or in the Lazy SMP workers
+    def search(self, game, player, info, ordering=None):
+        if self.workers == 1:
+            return iterative_deepening(game, self.time_budget, self.max_depth, self.tt, ordering, player, info, self.on_progress)
+        import lazy_smp
+        if self.smp is None:
+            self.smp = lazy_smp.LazySMP(self.workers, self.tt_bytes)
+        return self.smp.search(game, self.time_budget, self.max_depth, player, info)
+
+
+
+    # Searches the position after our move col and the predicted reply in the background, slice by slice
+    def start_pondering(self, game, player, col, reply):
+        state = game.copy()
+        state.play(col, player)
+        if state.is_winner() != 0 or not state.try_move(reply):
+            return
+        state.play(reply, -player)
+        if is_terminal_node(state):
+            return
+        self.ponder_key = state.key()
+        self.ponder_ordering = MoveOrdering()
+        self.ponder_depth = 0
+        max_depth = min(self.max_depth, ROW_COUNT * COLUMN_COUNT - sum(state.heights))
+
+        def step():
+            from ponder import PONDER_SLICE
+            _, value, depth = iterative_deepening(state, PONDER_SLICE, max_depth, self.tt, self.ponder_ordering, player)
+            self.ponder_depth = max(self.ponder_depth, depth)
+            # Nothing more to learn once the result is forced or the whole game is searched
+            return abs(value) < MINMAX_WIN_SCORE and depth < max_depth
+
+        self.ponderer.start(step)
+
+
+
+    def stop_pondering(self):
+        return self.ponderer.stop() if self.ponderer is not None else None
+
+
+
+    def reset(self):
+        self.stop_pondering()
+
+
+
+    def close(self):
+        self.stop_pondering()
+        if self.smp is not None:
+            self.smp.close()
+            self.smp = None
+
+
+
+# With workers > 1 the iterations are spread over a pool of processes (see parallel_mcts.py),
+# parallel is either 'root' (one tree per worker) or 'tree' (one shared tree, playouts in the workers)
+# With reuse_tree the subtree of the position actually reached is kept for the next move (at most max_tree_size nodes)
+# playouts is the number of random games played from every new leaf
+# With storage='array' the tree is kept in preallocated NumPy arrays of max_nodes nodes (see mcts_tree.py),
+# this mode runs in a single process and starts a new tree on every move
+# With storage='graph' the positions are kept in a table shared by every order of moves reaching them (see mcts_dag.py),
+# bounded to max_nodes nodes (least recently used evicted first) and kept from one move to the next, in a single process
+# Time control: time_budget gives every move a fixed number of seconds, game_time gives the whole game a clock which
+# is shared between the moves (critical positions get more), max_iter stays a cap (None for no cap)
+# and early_stop ends a search as soon as its result cannot change anymore
+# With ponder, the kept subtree (every reply of the opponent) keeps growing in the background until the next move
+# (see ponder.py), which then starts from the node of the reply actually played
+class MCTSAgent(object):
+
+    def __init__(self, max_iter=MCTS_MAX_ITER, factor=MCTS_FACTOR, workers=1, parallel='root', reuse_tree=True, max_tree_size=None, playouts=1, storage='nodes', max_nodes=None,
+                 time_budget=None, game_time=None, early_stop=False, on_search=None, book=None, solver_cells=SOLVER_EMPTY_CELLS, ponder=False, ponder_share=None,
+                 on_progress=None):
+        from book import open_book
+        if ponder and (storage != 'nodes' or workers > 1 or not reuse_tree):
+            raise ValueError("MCTS only ponders on a kept tree of nodes, in a single process")
+        if parallel not in ('root', 'tree'):
+            raise ValueError("Unknown parallel MCTS mode '%s' (choose from root, tree)" % parallel)
+        if storage not in ('nodes', 'array', 'graph'):
+            raise ValueError("Unknown MCTS tree storage '%s' (choose from nodes, array, graph)" % storage)
+        if storage != 'nodes' and workers > 1:
+            raise ValueError("The %s tree storage only runs in a single process" % storage)
+        if max_iter is None and time_budget is None and game_time is None:
+            raise ValueError("MCTS needs an iteration cap or a time control")
+        self.max_iter = max_iter
+        self.factor = factor
+        self.workers = workers
+        self.parallel = parallel
+        self.reuse_tree = reuse_tree
+        self.max_tree_size = max_tree_size
+        self.playouts = playouts
+        self.storage = storage
+        self.max_nodes = max_nodes
+        self.time_budget = time_budget
+        self.game_time = game_time
+        self.early_stop = early_stop
+        # Time left on the game clock (game_time only)
+        self.clock = game_time
+        # Search info of the last move (iterations, time spent, reason of the stop, shape of the tree)
+        self.last_search = None
+        self.on_search = on_search
+        self.on_progress = on_progress
+        # Opening book (path of a book file or OpeningBook) looked up before searching
+        self.book = open_book(book)
+        # Endgame solver, created when it is first needed
+        self.solver_cells = solver_cells
+        self.solver = None
+        # Array tree store or node table of the graph, created on the first search and reused for every move
+        self.store = None
+        # The pool of worker processes is only started on the first parallel search
+        self.pool = None
+        # Node of the move played last time (its subtree is searched again on the next move)
+        self.root = None
+        # Background search between the moves and what it did
+        self.ponderer = ponder_thread(ponder_share) if ponder else None
+        self.pondered = None
+        # Root of the tree pondered and its visits when pondering started
+        self.ponder_root = None
+
+
+
+    def move(self, game, player):
+        start = time.perf_counter()
+        self.pondered = self.stop_pondering()
+        budget = self.move_budget(game, player)
+        deadline = None if budget is None else start + budget
+        known = known_move(self, game, player, start)
+        if known is not None:
+            col, info = known
+            # There is no tree to keep for the next move
+            self.root = None
+        else:
+            info = {}
+            col = self.search(game, player, budget, deadline, info)
+
+        if self.clock is not None:
+            self.clock = max(0.0, self.clock - (time.perf_counter() - start))
+        info['time_budget'] = budget
+        if self.pondered is not None:
+            info['ponder'] = self.pondered
+        self.last_search = info
+        if self.on_search is not None:
+            self.on_search(info)
+        if self.ponderer is not None and self.root is not None and self.root.proven is None:
+            self.start_pondering(-player)
+        return col
 
-        # Player 1 is controlled by the player or MCTS agent
-        if player_2_agent == 'human':
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    sys.exit()
 
-                if event.type == pygame.MOUSEMOTION:
-                    pygame.draw.rect(screen, BLACK, (0,0, width, SQUARESIZE))
-                    posx = event.pos[0]
-                    if player == 1:
-                        pygame.draw.circle(screen, RED, (posx, int(SQUARESIZE/2)), RADIUS)
-                    else: 
-                        pygame.draw.circle(screen, YELLOW, (posx, int(SQUARESIZE/2)), RADIUS)
-                pygame.display.update()
-        
-                # Player 1 is controlled by the Player
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    pygame.draw.rect(screen, BLACK, (0,0, width, SQUARESIZE))
 
-                    if player == 1:
-                        posx = event.pos[0]
-                        col = int(math.floor(posx/SQUARESIZE))
+    # Seconds given to this move (None when the search is only capped by max_iter)
+    def move_budget(self, game, player):
+        if self.game_time is None:
+            return self.time_budget
+        # Share the clock evenly between our remaining moves, twice as much when there is a threat on the board
+        moves_left = max(1, (ROW_COUNT * COLUMN_COUNT - sum(game.heights) + 1) // 2)
+        budget = self.clock / moves_left
+        if game.winning_cells(1) or game.winning_cells(-1):
+            budget *= MCTS_CRITICAL_TIME_FACTOR
+        return min(budget, self.clock * MCTS_MAX_CLOCK_SHARE)
+
+
+
+    def search(self, game, player, budget, deadline, info):
+        if self.storage == 'array':
+            import mcts_tree
+            if self.store is None:
+                self.store = mcts_tree.TreeStore(self.max_nodes or mcts_tree.MCTS_TREE_NODES)
+            root = self.store.new_root(game)
+            child = mcts_tree.array_mcts(self.max_iter, self.store, root, game, self.factor, player, self.playouts, deadline, self.early_stop, info,
+                                         self.on_progress)
+            return int(self.store.move[child])
+
+        if self.storage == 'graph':
+            import mcts_dag
+            if self.store is None:
+                self.store = mcts_dag.NodeTable(self.max_nodes or mcts_dag.MCTS_GRAPH_NODES)
+            return mcts_dag.graph_mcts(self.max_iter, self.store, game, self.factor, player, self.playouts, deadline, self.early_stop, info,
+                                       self.on_progress)
+
+        if self.workers > 1 and self.parallel == 'root':
+            import parallel_mcts
+            if self.pool is None:
+                self.pool = parallel_mcts.create_pool(self.workers)
+            # The trees live in the workers, there is nothing to keep
+            best_move = parallel_mcts.root_parallel_mcts(game.copy(), player, self.pool, self.workers, self.max_iter, self.factor, self.playouts, budget, info)
+            self.root = None
+            return best_move.move
+
+        root = self.reuse_root(game)
+        if self.pondered is not None:
+            # The reply played was in the pondered tree
+            self.pondered['hit'] = root.visits > 1
+            self.pondered['root_visits'] = root.visits
+        if self.workers > 1:
+            import parallel_mcts
+            if self.pool is None:
+                self.pool = parallel_mcts.create_pool(self.workers)
+            best_move = parallel_mcts.tree_parallel_mcts(game.copy(), player, self.pool, self.workers, self.max_iter, self.factor, root=root, playouts=self.playouts, deadline=deadline, info=info)
+        else:
+            best_move = MCTS(self.max_iter, root, self.factor, player, self.playouts, deadline, self.early_stop, info, self.on_progress)
 
-                        # Apply move to game state
-                        if game.try_move(col):
-                            row = game.get_next_open_row(col)
-                            game.place_token(row, col, player)
+        # Keep only the subtree of the chosen move, the rest of the tree is freed
+        self.root = best_move if self.reuse_tree else None
+        if self.root is not None:
+            self.root.detach()
+        return best_move.move
 
-        # Player 1 is controlled by MCTS agent
-        elif player_2_agent == 'mcts':
-            # Get best move using MCTS
-            o = Node(game)
-            best_move = MCTS(MCTS_MAX_ITER, o, MCTS_FACTOR, player)
-            game = copy.deepcopy(best_move.state)
 
-        # Player 1 is controlled by Minmax agent
-        elif player_2_agent == 'minmax':
-            col, minimax_score = minimax(game, MINMAX_DEPTH, -math.inf, math.inf, True)
 
-            # Apply move to game state
-            if game.try_move(col):
-                row = game.get_next_open_row(col)
-                game.place_token(row, col, player)
-            
-        # Detect if Player 1 has won
-        if game.winning_move(player):
-            label = myfont.render("Player 1 wins!!", 1, RED)
-            screen.blit(label, (40,10))
-            game_over = True
-        # Detect if game has ended with no winner (DRAW)
-        elif game.game_ended():
-            label = myfont.render("Draw", 1, BLUE)
-            screen.blit(label, (40,10))
-            game_over = True
-
-        # Mark the next player to play
-        player *= -1
+    # Root of the next search: the node of the current position in the kept tree, or a new node
+    def reuse_root(self, game):
+        if self.reuse_tree and self.root is not None:
+            node = find_subtree(self.root, game)
+            if node is not None:
+                node.detach()
+                if self.max_tree_size is not None:
+                    prune_tree(node, self.max_tree_size)
+                return node
+        return Node(game.copy())
+
+
+
+    # Grows the kept tree (the position after our move, to_move is the opponent) in the background, slice by slice
+    def start_pondering(self, to_move):
+        root = self.root
+        visits = root.visits
+
+        def step():
+            from ponder import PONDER_SLICE
+            MCTS(None, root, self.factor, to_move, self.playouts, time.perf_counter() + PONDER_SLICE)
+            # A proven tree cannot get any better
+            return root.proven is None
+
+        self.ponderer.start(step)
+        self.ponder_root = (root, visits)
+
+
+
+    def stop_pondering(self):
+        if self.ponderer is None:
+            return None
+        pondered = self.ponderer.stop()
+        if pondered is not None:
+            root, visits = self.ponder_root
+            pondered['iterations'] = (root.visits - visits) // self.playouts
+        return pondered
+
+
+
+    def reset(self):
+        self.stop_pondering()
+        self.root = None
+        self.clock = self.game_time
+
+
+
+    # Stops pondering and the worker processes (if any)
+    def close(self):
+        self.stop_pondering()
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+
+# Agents that can play without the GUI (the human player needs the pygame window)
+agent_classes = { 'rand': RandomAgent,
+                  'minmax': MinimaxAgent,
+                  'mcts': MCTSAgent }
+
+
+
+# Build an agent from its name or from its number in the agents table
+def create_agent(name, **options):
+    name = agents.get(name, name)
+    if name not in agent_classes:
+        raise ValueError("Unknown agent '%s' (choose from %s)" % (name, ', '.join(agent_classes)))
+    return agent_classes[name](**options)
+
+
+
+# PYGAME GUI ------------------------------------------------------
+# pygame is only imported here, so the engine above can be used without a display
+# The event loop runs at a steady frame rate (see gui.py): the AI moves are searched in a background thread, their
+# progress is shown in the header row, and only the parts of the window that changed are redrawn
+# With record_path, every finished game is added to this game record file (see records.py)
+# With ponder, minmax and MCTS search on the opponent's time (and during the turn delay) when they play a human:
+# against another AI of this process, pondering would only slow its search down (see ponder.py)
+def main(player_1_agent, player_2_agent, record_path=None, ponder=False):
+    import pygame
+    from gui import GUI_FPS, BoardView, SearchWorker, progress_text
+    from records import RecordWriter
+
+    # Initialize game
+    pygame.init()
+    screen = pygame.display.set_mode(size)
+    view = BoardView(screen)
+    clock = pygame.time.Clock()
+
+    # Create a Connect4 object with a board and available columns tracker variables
+    game = C4()
+    # Determines the starting player (1 or -1)
+    player = 1
+    # AI agent of each player (None for a human)
+    options = lambda name, opponent: { 'ponder': True } if ponder and opponent == 'human' and name in ('minmax', 'mcts') else {}
+    controllers = { 1: None if player_1_agent == 'human' else create_agent(player_1_agent, **options(player_1_agent, player_2_agent)),
+                   -1: None if player_2_agent == 'human' else create_agent(player_2_agent, **options(player_2_agent, player_1_agent)) }
+    names = { 1: player_1_agent, -1: player_2_agent }
+    colors = { 1: RED, -1: YELLOW }
+    recorder = RecordWriter(record_path, append=True) if record_path else None
+    # Moves of the current game and the time taken by each of them
+    moves = []
+    think_times = []
+    turn_start = time.perf_counter()
+    # Search of the AI player (None while none is running), time (pygame ticks) it may start at to avoid AI playing
+    # too fast, and mouse position of the human player
+    worker = None
+    search_at = pygame.time.get_ticks() + TURN_DELAY
+    posx = None
+    # Result label of a finished game and time the next game starts at
+    result = None
+    restart_at = None
+
+    ## GAME LOOP --------------------------------------------------
+    while True:
+        col = None
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                if recorder:
+                    recorder.close()
+                sys.exit()
+
+            if event.type == pygame.VIDEOEXPOSE:
+                view.invalidate()
+
+            # Human player: wait for a click in a column that is not full
+            if result is None and controllers[player] is None:
+                if event.type == pygame.MOUSEMOTION:
+                    posx = event.pos[0]
 
-        # Increment move counter
-        mvcntr += 1
-        
-        # Refresh game board
-        game.print_board()
+                if event.type == pygame.MOUSEBUTTONDOWN:
+                    posx = event.pos[0]
+                    if col is None and game.try_move(int(math.floor(posx/SQUARESIZE))):
+                        col = int(math.floor(posx/SQUARESIZE))
+
+        now = pygame.time.get_ticks()
+        # AI player (random, minmax or MCTS): start its search after the turn delay, play once it is finished
+        if result is None and controllers[player] is not None:
+            if worker is None and now >= search_at:
+                turn_start = time.perf_counter()
+                worker = SearchWorker(controllers[player], game, player)
+            elif worker is not None and worker.finished():
+                col = worker.result()
+                worker = None
+
+        if col is not None:
+            # Apply move to game state
+            game.play(col, player)
+            moves.append(int(col))
+            think_times.append(time.perf_counter() - turn_start)
+            turn_start = time.perf_counter()
+
+            # Detect if the player has won, or if game has ended with no winner (DRAW)
+            if game.winning_move(player):
+                result = ("Player %d wins!!" % (1 if player == 1 else 2), colors[player])
+            elif game.game_ended():
+                result = ("Draw", BLUE)
+            if result is not None:
+                if recorder:
+                    recorder.write({ 'seed': None,
+                                     'winner': game.is_winner(),
+                                     'moves': moves,
+                                     'think_times': think_times,
+                                     'agent_1': player_1_agent,
+                                     'agent_2': player_2_agent })
+                    recorder.flush()
+                restart_at = now + WAIT_TIME
+
+            # Mark the next player to play
+            player *= -1
+            search_at = now + TURN_DELAY
+            posx = None
 
         # Reset game after delay when game has ended
-        if game_over:
-            pygame.time.wait(WAIT_TIME)
-            game_over = False
+        if result is not None and now >= restart_at:
+            moves = []
+            think_times = []
+            result = None
             player = 1
             game.reset_board()
-            game.print_board()
-            pygame.draw.rect(screen, BLACK, (0,0, width, SQUARESIZE))
\ No newline at end of file
+            for controller in controllers.values():
+                if controller is not None:
+                    controller.reset()
+            search_at = now + TURN_DELAY
+            turn_start = time.perf_counter()
+
+        # Refresh what changed: the board, then the header (result, search progress with the best move so far, or the
+        # token of the human player following the mouse)
+        view.draw_board(game.board)
+        if result is not None:
+            view.draw_header(label=result)
+        elif worker is not None:
+            progress = worker.progress
+            token = (colors[player], progress['column']*SQUARESIZE+SQUARESIZE/2) if progress is not None else None
+            elapsed = round(time.perf_counter() - worker.start, 1)
+            view.draw_header(token=token, text=(progress_text(names[player], progress, elapsed), colors[player]))
+        elif controllers[player] is None and posx is not None:
+            view.draw_header(token=(colors[player], posx))
+        else:
+            view.draw_header()
+        view.flip()
+        clock.tick(GUI_FPS)
+
+
+
+if __name__ == '__main__':
+    # Track which players are currently playing against each other
+    # player_1_agent = agents[0] # 0 - HUMAN
+    # player_1_agent = agents[1] # 1 - RANDOM
+    # player_1_agent = agents[2] # 2 - MINMAX
+    player_1_agent = agents[3] # 3 - MCTS
+
+    # player_2_agent = agents[0] # 0 - HUMAN
+    # player_2_agent = agents[1] # 1 - RANDOM
+    player_2_agent = agents[2] # 2 - MINMAX
+    # player_2_agent = agents[3] # 3 - MCTS
+
+    # File the finished games are added to (see records.py), None to keep no record
+    record_path = None
+    # Let the AI agents search while the other player thinks (off unless started with: python connect4.py --ponder)
+    ponder = '--ponder' in sys.argv[1:]
+
+    main(player_1_agent, player_2_agent, record_path, ponder)
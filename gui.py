@@ -0,0 +1,154 @@
+import threading
+import time
+
+from connect4 import BLACK, BLUE, COLUMN_COUNT, RADIUS, RED, ROW_COUNT, SQUARESIZE, YELLOW, width
+
+# PYGAME FRONT END
+# The window is drawn piece by piece: BoardView remembers what every cell shows and only redraws (and sends to the
+# display) the cells that changed, and the header row above the board when what it shows changes
+# The AI moves are searched in a SearchWorker thread while the event loop keeps running at GUI_FPS frames per second;
+# the searches report their progress (see connect4.progress_report) and the header shows it live
+# The worker is a thread rather than a process: the agents keep their tables and trees from one move to the next, and
+# the event loop gets the interpreter back regularly (a running thread hands it over every sys.getswitchinterval()
+# seconds, and the loop sleeps between two frames)
+
+# Frames per second of the event loop
+GUI_FPS = 30
+# Font sizes of the result of a game and of the search progress
+RESULT_FONT_SIZE = 75
+PROGRESS_FONT_SIZE = 20
+# Color of every cell value
+CELL_COLORS = { 0: BLACK, 1: RED, -1: YELLOW }
+
+
+
+# Draws the cell (r, c) of the board (its square and its hole or token), returns the area drawn
+def draw_cell(screen, r, c, value):
+    import pygame
+    area = pygame.Rect(c*SQUARESIZE, r*SQUARESIZE+SQUARESIZE, SQUARESIZE, SQUARESIZE)
+    pygame.draw.rect(screen, BLUE, area)
+    pygame.draw.circle(screen, CELL_COLORS[value], area.center, RADIUS)
+    return area
+
+
+
+# Board and header row of the window, redrawn only where they changed
+# Drawing calls only draw in the screen surface, flip() sends the areas changed since the last flip to the display
+class BoardView(object):
+
+    def __init__(self, screen):
+        import pygame
+        self.screen = screen
+        self.result_font = pygame.font.SysFont("monospace", RESULT_FONT_SIZE)
+        self.progress_font = pygame.font.SysFont("monospace", PROGRESS_FONT_SIZE)
+        # Value shown in every cell (None before the first drawing) and what the header shows
+        self.cells = [[None] * COLUMN_COUNT for _ in range(ROW_COUNT)]
+        self.header = None
+        self.dirty = []
+
+
+
+    # Redraws the cells whose value changed (board is laid out like C4.board)
+    def draw_board(self, board):
+        for r in range(ROW_COUNT):
+            for c in range(COLUMN_COUNT):
+                value = int(board[r][c])
+                if self.cells[r][c] != value:
+                    self.dirty.append(draw_cell(self.screen, r, c, value))
+                    self.cells[r][c] = value
+
+
+
+    # Header row: a token (color, x of its center), a line of text (text, color) and a result label (text, color),
+    # all optional, redrawn only when one of them changed
+    def draw_header(self, token=None, text=None, label=None):
+        import pygame
+        header = (token, text, label)
+        if header == self.header:
+            return
+        self.header = header
+        area = pygame.Rect(0, 0, width, SQUARESIZE)
+        pygame.draw.rect(self.screen, BLACK, area)
+        if token is not None:
+            pygame.draw.circle(self.screen, token[0], (int(token[1]), int(SQUARESIZE/2)), RADIUS)
+        if text is not None:
+            self.screen.blit(self.progress_font.render(text[0], 1, text[1]), (5, 5))
+        if label is not None:
+            self.screen.blit(self.result_font.render(label[0], 1, label[1]), (40, 10))
+        self.dirty.append(area)
+
+
+
+    # Forgets what is on the display: everything is drawn again next time
+    def invalidate(self):
+        self.cells = [[None] * COLUMN_COUNT for _ in range(ROW_COUNT)]
+        self.header = None
+
+
+
+    def flip(self):
+        import pygame
+        if self.dirty:
+            pygame.display.update(self.dirty)
+            self.dirty = []
+
+
+
+# Searches the move of an agent in a background thread (on a copy of game)
+# While it runs, progress holds the last report of the search (None until the first one), see connect4.progress_report
+class SearchWorker(object):
+
+    def __init__(self, agent, game, player):
+        self.agent = agent
+        self.start = time.perf_counter()
+        self.progress = None
+        self.column = None
+        self.error = None
+        self.done = threading.Event()
+        self.on_progress = agent.on_progress
+        agent.on_progress = self.report
+        self.thread = threading.Thread(target=self.run, args=(game.copy(), player), daemon=True)
+        self.thread.start()
+
+
+
+    # Called in the worker thread: replacing the report is atomic, the event loop reads whole reports
+    def report(self, progress):
+        self.progress = progress
+        if self.on_progress is not None:
+            self.on_progress(progress)
+
+
+
+    def run(self, game, player):
+        try:
+            self.column = self.agent.move(game, player)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+
+
+    def finished(self):
+        return self.done.is_set()
+
+
+
+    # Column chosen by the agent once the search is finished (what the search raised is raised again here)
+    def result(self):
+        self.thread.join()
+        self.agent.on_progress = self.on_progress
+        if self.error is not None:
+            raise self.error
+        return self.column
+
+
+
+# Line of the header describing a search in progress (name of the agent, seconds since the search started)
+def progress_text(name, progress, elapsed):
+    if progress is None:
+        return "%s: thinking, %.1fs" % (name, elapsed)
+    if 'depth' in progress:
+        return "%s: depth %d, %.1fs" % (name, progress['depth'], elapsed)
+    return "%s: %d iterations, %.1fs" % (name, progress['iterations'], elapsed)
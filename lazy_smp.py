@@ -0,0 +1,248 @@
+import math
+import multiprocessing
+import random
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from connect4 import (COLUMN_COUNT, MINMAX_MAX_DEPTH, MINMAX_PLAYER, MINMAX_TIME_BUDGET, MINMAX_TT_BYTES, MINMAX_WIN_SCORE, ROW_COUNT,
+                      IncrementalEvaluator, MinimaxStats, MoveOrdering, SearchTimeout, TranspositionTable, minimax, principal_variation)
+
+# PARALLEL MINMAX (LAZY SMP)
+# Several worker processes run iterative deepening on the same root at once, with nothing to coordinate but a
+# transposition table in shared memory: what one worker stores (bounds, best moves) cuts the searches of the others
+# The workers are kept apart so they do not all search the same tree in the same order: every other worker starts
+# one ply deeper, and every worker but the first breaks the ties of its move ordering at random
+# The main process waits for the deadline and keeps the result of the deepest iteration completed by any worker
+# (the first worker searches from depth 1 without a deadline on it, so there is always a move)
+
+# Bytes of one entry of the shared table (key check word + data word)
+SMP_ENTRY_BYTES = 16
+# Values are packed in 48 bits with the depth, the move and the flag (wins and losses fit)
+SMP_VALUE_BITS = 48
+SMP_MAX_VALUE = 2 ** (SMP_VALUE_BITS - 1) - 1
+
+
+
+# Transposition table kept in a multiprocessing.shared_memory block, used by every worker at once without locks
+# Every slot holds a data word (value, depth, move, flag packed together) and the key xor the data word: a slot
+# half written by another process does not check out and reads as a miss (lockless hashing)
+# Same interface as TranspositionTable (probe, store, clear, stats), the counters are those of this process only
+# With name=None a new block is created (the owner unlinks it with close(unlink=True)), otherwise the block is attached
+class SharedTranspositionTable(TranspositionTable):
+
+    def __init__(self, max_bytes=MINMAX_TT_BYTES, name=None):
+        self.size = max(1, max_bytes // (2 * SMP_ENTRY_BYTES))
+        nbytes = self.size * 2 * SMP_ENTRY_BYTES
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            np.ndarray((nbytes,), dtype=np.uint8, buffer=self.shm.buf).fill(0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.max_bytes = max_bytes
+        self.checks = np.ndarray((self.size, 2), dtype=np.uint64, buffer=self.shm.buf)
+        self.data = np.ndarray((self.size, 2), dtype=np.uint64, buffer=self.shm.buf, offset=self.size * 2 * 8)
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+        self.stores = 0
+
+
+
+    # The bucket comes from the high bits of the product: the size is a power of two with the default budget, and the
+    # low bits of the product only depend on the low bits of the key
+    def index(self, key):
+        return (((key * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) * self.size) >> 64
+
+
+
+    # Data word of the slot if it holds key (and was written completely), else None
+    def read(self, i, slot, key):
+        data = int(self.data[i, slot])
+        if int(self.checks[i, slot]) ^ data == key and data != 0:
+            return data
+        return None
+
+
+
+    def probe(self, key):
+        i = self.index(key)
+        for slot in range(2):
+            data = self.read(i, slot, key)
+            if data is not None:
+                self.hits += 1
+                return unpack_entry(data)
+        self.misses += 1
+        if self.data[i, 0] != 0 or self.data[i, 1] != 0:
+            self.collisions += 1
+        return None
+
+
+
+    # Same two-tier replacement as TranspositionTable (depth-preferred slot, always-replace slot)
+    def store(self, key, depth, value, move, flag):
+        i = self.index(key)
+        self.stores += 1
+        first = int(self.data[i, 0])
+        first_key = int(self.checks[i, 0]) ^ first
+        first_depth = unpack_entry(first)[0] if first != 0 else -1
+        data = pack_entry(depth, value, move, flag)
+        if first_key == key or depth >= first_depth:
+            if first_key != key and first != 0:
+                self.write(i, 1, first_key, first)
+            self.write(i, 0, key, data)
+        else:
+            self.write(i, 1, key, data)
+
+
+
+    # The data word is written before the check word, a reader in between sees a slot that does not check out
+    def write(self, i, slot, key, data):
+        self.data[i, slot] = data
+        self.checks[i, slot] = key ^ data
+
+
+
+    def clear(self):
+        self.checks.fill(0)
+        self.data.fill(0)
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+        self.stores = 0
+
+
+
+    def close(self, unlink=False):
+        # The arrays point into the block, they must go before it is closed
+        self.checks = None
+        self.data = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+
+def pack_entry(depth, value, move, flag):
+    value = max(-SMP_MAX_VALUE, min(SMP_MAX_VALUE, int(value)))
+    return ((value & ((1 << SMP_VALUE_BITS) - 1)) << 16) | ((depth & 0xFF) << 8) | ((move & 0xF) << 4) | (flag & 0xF)
+
+
+
+# (depth, value, move, flag) of a data word
+def unpack_entry(data):
+    value = data >> 16
+    if value > SMP_MAX_VALUE:
+        value -= 1 << SMP_VALUE_BITS
+    return (data >> 8) & 0xFF, value, (data >> 4) & 0xF, data & 0xF
+
+
+
+# Shared tables attached by a worker process (by name), kept open from one search to the next
+worker_tables = {}
+
+
+
+def attach_table(name, max_bytes):
+    if name not in worker_tables:
+        worker_tables[name] = SharedTranspositionTable(max_bytes, name)
+    table = worker_tables[name]
+    table.hits = table.misses = table.collisions = table.stores = 0
+    return table
+
+
+
+# Worker: iterative deepening on the shared table until the time budget (seconds, clocks of different processes
+# cannot be compared) runs out, starting one ply deeper for every other worker
+# Returns the deepest completed iteration (column, value and depth, depth 0 if none completed) and the counters of the search
+def smp_worker(task):
+    state, player, time_budget, max_depth, table_name, table_bytes, worker, seed = task
+    start = time.perf_counter()
+    deadline = start + time_budget
+    tt = attach_table(table_name, table_bytes)
+    random.seed(seed + worker)
+    ordering = MoveOrdering()
+    if worker > 0:
+        # Ties of the move ordering are broken differently in every helper
+        rng = np.random.default_rng(seed + worker)
+        for side in (True, False):
+            ordering.history[side] += rng.integers(0, 2, size=(ROW_COUNT, COLUMN_COUNT))
+    stats = MinimaxStats()
+
+    state = state.copy()
+    state.attach_evaluator(IncrementalEvaluator(state))
+    column, value, depth_reached = None, None, 0
+    first = min(max_depth, 1 + worker % 2)
+    for depth in range(first, max_depth + 1):
+        ordering.root_depth = depth
+        stats.root_depth = depth
+        try:
+            col, score = minimax(state, depth, -math.inf, math.inf, True, tt, ordering, deadline if worker > 0 or depth > 1 else None, player, stats)
+        except SearchTimeout:
+            break
+        column, value, depth_reached = col, score, depth
+        ordering.pv = principal_variation(state, tt, depth, player)
+        if abs(value) >= MINMAX_WIN_SCORE or time.perf_counter() >= deadline:
+            break
+    return { 'worker': worker,
+             'column': column,
+             'value': value,
+             'depth': depth_reached,
+             'nodes': stats.nodes,
+             'leaves': stats.leaves,
+             'tt_probes': tt.hits + tt.misses,
+             'tt_hits': tt.hits }
+
+
+
+# Lazy SMP searcher: a pool of worker processes and the shared transposition table they search with
+# Both are kept from one move to the next (entries stay valid), close() stops the workers and frees the table
+class LazySMP(object):
+
+    def __init__(self, workers, tt_bytes=MINMAX_TT_BYTES, seed=None):
+        self.workers = workers
+        self.tt = SharedTranspositionTable(tt_bytes)
+        self.pool = multiprocessing.Pool(workers)
+        self.seed = seed
+
+
+
+    # Best move for player, its value and the depth it was searched to (like iterative_deepening)
+    # The statistics of the search are written in info if given: the numbers of minimax_info added over the workers,
+    # and the depth reached by every worker
+    def search(self, state, time_budget=MINMAX_TIME_BUDGET, max_depth=MINMAX_MAX_DEPTH, player=MINMAX_PLAYER, info=None):
+        start = time.perf_counter()
+        max_depth = max(1, min(max_depth, ROW_COUNT * COLUMN_COUNT - sum(state.heights)))
+        seed = self.seed if self.seed is not None else random.randrange(2 ** 31)
+        tasks = [(state, player, time_budget, max_depth, self.tt.name, self.tt.max_bytes, w, seed) for w in range(self.workers)]
+        results = self.pool.map(smp_worker, tasks, chunksize=1)
+
+        # Deepest completed iteration, the first worker wins the ties
+        best = max(results, key=lambda r: (r['depth'], -r['worker']))
+        if info is not None:
+            elapsed = time.perf_counter() - start
+            nodes = sum(r['nodes'] for r in results)
+            info.update({ 'nodes': nodes,
+                          'leaves': sum(r['leaves'] for r in results),
+                          'tt_probes': sum(r['tt_probes'] for r in results),
+                          'tt_hits': sum(r['tt_hits'] for r in results),
+                          'elapsed': elapsed,
+                          'nodes_per_second': nodes / elapsed if elapsed > 0 else 0.0,
+                          'workers': self.workers,
+                          'worker_depths': [r['depth'] for r in results],
+                          'column': best['column'],
+                          'value': best['value'],
+                          'depth': best['depth'],
+                          'pv': principal_variation(state, self.tt, best['depth'], player) })
+        return best['column'], best['value'], best['depth']
+
+
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            self.tt.close(unlink=True)
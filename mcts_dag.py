@@ -0,0 +1,284 @@
+import collections
+import math
+import random
+import time
+
+from connect4 import (COLUMN_COUNT, MCTS_CHECK_EVERY, MCTS_FACTOR, MCTS_PROGRESS_EVERY, ROW_COUNT, default_policy, mirror_col, progress_report, proven_result,
+                      proven_reward, remaining_iterations, search_info, tree_info)
+
+# TRANSPOSITION-AWARE MCTS (a graph of positions instead of a tree of move sequences)
+# Every position gets a single node, found by its key in a table, whatever the order of the moves that led to it:
+# the statistics of a position reached in several ways are shared, and it is only stored once
+# The key is the canonical key (see C4.canonical_key), so a position and its mirror image share their node too: the
+# moves and edges of a node are kept for the canonical side, the columns of a mirrored position go through mirror_col
+# A node keeps its own visits and reward (for the player who moved into the position, as in Node), and one edge per
+# move tried with the number of times the search went through that edge
+# - selection: the value of a move is the value of the child position (shared by all its parents), its exploration
+#   term uses the visits of the edge, so every parent explores its own moves evenly
+# - backup: only the path actually followed is updated (its nodes and edges)
+# - proofs (MCTS-Solver, see connect4.prove) are computed the same way, from the children found in the table
+# The table holds at most max_nodes nodes: when it is full the least recently used ones are evicted (the nodes of the
+# current path are always recent), an edge whose child was evicted is expanded again as a new node
+# A proof stays true when the children it came from are evicted, but the root needs them to choose its move: a
+# proven root is proven again from the children still in the table before searching
+# The table is kept from one search to the next: the position reached after two moves is usually already in it
+
+# Default number of nodes of a node table
+MCTS_GRAPH_NODES = 200000
+# Share of the table evicted at once when it is full
+MCTS_GRAPH_EVICT = 0.05
+
+
+
+class GraphNode(object):
+
+    def __init__(self, state):
+        self.key, mirrored = state.canonical_key()
+        self.visits = 1
+        self.reward = 0.0
+        # Legal moves (one of each pair of mirror moves on a symmetric board) and edges tried so far:
+        # column -> [key of the child, visits through this edge], both for the canonical side of the position
+        self.moves = [mirror_col(col) for col in state.distinct_cols()] if mirrored else state.distinct_cols()
+        self.edges = {}
+        self.winner = state.is_winner()
+        if self.winner != 0:
+            self.proven = 1
+        elif not self.moves:
+            self.proven = 0
+        else:
+            self.proven = None
+
+
+
+# Positions of the graph by key, in least recently used order
+class NodeTable(object):
+
+    def __init__(self, max_nodes=MCTS_GRAPH_NODES, evict=MCTS_GRAPH_EVICT):
+        # A whole path from the root to the end of the game must always fit
+        if max_nodes < 2 * ROW_COUNT * COLUMN_COUNT:
+            raise ValueError("A node table needs room for at least %d nodes" % (2 * ROW_COUNT * COLUMN_COUNT))
+        self.max_nodes = max_nodes
+        self.evict_count = max(1, int(max_nodes * evict))
+        self.nodes = collections.OrderedDict()
+        # Nodes created, children found already in the table when an edge was added, and nodes evicted
+        self.created = 0
+        self.transpositions = 0
+        self.evictions = 0
+
+
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+
+    # Node of a key (marked as just used), or None if it is not in the table
+    def get(self, key):
+        node = self.nodes.get(key)
+        if node is not None:
+            self.nodes.move_to_end(key)
+        return node
+
+
+
+    # Node of the position of state (or of its mirror image), created if needed (True is returned with it when it
+    # was already there)
+    def find_or_add(self, state):
+        key = state.canonical_key()[0]
+        node = self.get(key)
+        if node is not None:
+            return node, True
+        if len(self.nodes) >= self.max_nodes:
+            for _ in range(self.evict_count):
+                self.nodes.popitem(last=False)
+            self.evictions += self.evict_count
+        node = GraphNode(state)
+        self.nodes[key] = node
+        self.created += 1
+        return node, False
+
+
+
+    def clear(self):
+        self.nodes.clear()
+
+
+
+# Same search as MCTS (deadline, early stop, proofs, info and progress) on the graph of a NodeTable, from the position of state
+# (played forward and taken back during the search but left unchanged): returns the column chosen
+def graph_mcts(max_iter, table, state, factor=MCTS_FACTOR, player=1, playouts=1, deadline=None, early_stop=False, info=None, progress=None):
+    if max_iter is None and deadline is None:
+        raise ValueError("MCTS needs an iteration cap or a deadline")
+    if playouts > 1:
+        from rollouts import batch_playouts
+    board = state.copy()
+    root, _ = table.find_or_add(board)
+    # Columns of the root node are those of the mirror image of state when it is the canonical side
+    root_mirrored = board.canonical_key()[1]
+    if root.proven is not None and root.winner == 0 and root.moves:
+        # The children a proof came from may have been evicted since
+        root.proven = None
+        prove(table, root)
+    root_depth = len(board.moves)
+    start = time.perf_counter()
+    transpositions, evictions = table.transpositions, table.evictions
+    stopped = 'iterations'
+    max_depth = 0
+    lengths = [] if info is not None and playouts == 1 else None
+    i = 0
+    while max_iter is None or i < max_iter:
+        if root.proven is not None:
+            stopped = 'proven'
+            break
+        if i > 0 and i % MCTS_CHECK_EVERY == 0:
+            if deadline is not None and time.perf_counter() >= deadline:
+                stopped = 'deadline'
+                break
+            if early_stop and decided(table, root, remaining_iterations(i, max_iter, start, deadline) * playouts):
+                stopped = 'early'
+                break
+            if progress is not None and i % MCTS_PROGRESS_EVERY == 0 and root.edges:
+                col = max(root.edges, key=lambda col: root.edges[col][1])
+                progress(progress_report(i, start, mirror_col(col) if root_mirrored else col))
+
+        path = []
+        table.nodes.move_to_end(root.key)
+        front, p = tree_policy(table, root, player, factor, board, path)
+        if info is not None:
+            max_depth = max(max_depth, len(board.moves) - root_depth)
+        if front.proven is not None:
+            reward = proven_reward(front, p, playouts)
+        elif playouts > 1:
+            reward = batch_playouts(board, p, playouts)
+        else:
+            reward = default_policy(board, p, lengths)
+        backpropagate(table, path, front, reward, p, playouts)
+        while len(board.moves) > root_depth:
+            board.undo()
+        i += 1
+
+    children = [(col, child, edge[1]) for col, edge, child in edge_children(table, root)]
+    if info is not None:
+        search_info(info, i, start, stopped)
+        tree_info(info, len(table), max_depth, lengths,
+                  [(mirror_col(col) if root_mirrored else col, visits, child.reward / child.visits * visits) for col, child, visits in children if visits > 0])
+        info['transpositions'] = table.transpositions - transpositions
+        info['evictions'] = table.evictions - evictions
+        info['proven'] = proven_result(root)
+    if not children:
+        # Every child was evicted (or none was tried), there is nothing better to go on
+        col = root.moves[0]
+    elif stopped == 'early':
+        col = max(children, key=lambda c: c[2])[0]
+    else:
+        col = best_edge(children, root, 0)[0]
+    return mirror_col(col) if root_mirrored else col
+
+
+
+# (column, edge, child node) of every edge of node whose child is still in the table
+def edge_children(table, node):
+    children = []
+    for col, edge in node.edges.items():
+        child = table.nodes.get(edge[0])
+        if child is not None:
+            children.append((col, edge, child))
+    return children
+
+
+
+# Determines next move by exploring the graph (board follows the nodes selected, path collects (node, column) of the
+# edges followed, columns of the canonical side) and returns the node reached with the player to move in it
+def tree_policy(table, node, player, factor, board, path):
+    while node.proven is None:
+        mirrored = board.canonical_key()[1]
+        children = [(col, child, edge[1]) for col, edge, child in edge_children(table, node)]
+        if len(children) < len(node.moves):
+            # Untried move, or an edge whose child was evicted: it is expanded (again)
+            tried = set(col for col, _, _ in children)
+            col = next(col for col in node.moves if col not in tried)
+            board.play(mirror_col(col) if mirrored else col, player)
+            child, found = table.find_or_add(board)
+            if found:
+                table.transpositions += 1
+            node.edges[col] = [child.key, 0]
+            path.append((node, col))
+            return child, -player
+        col, child = best_edge(children, node, factor)
+        # The nodes of the path are the most recently used, they are evicted last
+        table.nodes.move_to_end(child.key)
+        path.append((node, col))
+        board.play(mirror_col(col) if mirrored else col, player)
+        node = child
+        player *= -1
+    return node, player
+
+
+
+# UCB of every (column, child, edge visits): value of the child position, exploration from the visits of the edge
+# A child proven won is taken right away, the children proven lost are left out (unless they all are) and the value
+# of a proven draw is exactly 0
+# Returns the (column, child) chosen
+def best_edge(children, node, factor):
+    wins = [(col, child) for col, child, _ in children if child.proven == 1]
+    if wins:
+        return random.choice(wins)
+    candidates = [c for c in children if c[1].proven != -1] or children
+    best_score = -math.inf
+    best = []
+    for col, child, visits in candidates:
+        value = 0.0 if child.proven == 0 else child.reward / child.visits
+        score = value + factor * math.sqrt(math.log(2.0 * node.visits) / max(visits, 1))
+        if score == best_score:
+            best.append((col, child))
+        if score > best_score:
+            best = [(col, child)]
+            best_score = score
+    return random.choice(best)
+
+
+
+# Update the nodes and edges of the path followed with the simulation result (front is the node reached, player is
+# to move in it), then pass the proofs up the path for as long as they settle the parents
+def backpropagate(table, path, front, reward, player, playouts=1):
+    front.visits += playouts
+    front.reward -= player * reward
+    for node, col in reversed(path):
+        player *= -1
+        node.edges[col][1] += playouts
+        node.visits += playouts
+        node.reward -= player * reward
+
+    if front.proven is not None:
+        for node, _ in reversed(path):
+            if not prove(table, node):
+                break
+
+
+
+# Graph version of connect4.prove: one child won is enough to lose, and once every move was tried and every child
+# proven, the node gets the opposite of the best child (children evicted from the table count as not proven)
+def prove(table, node):
+    if node.proven is None:
+        values = [child.proven for _, _, child in edge_children(table, node)]
+        if 1 in values:
+            node.proven = -1
+        elif len(values) == len(node.moves) and None not in values:
+            node.proven = -max(values)
+    return node.proven is not None
+
+
+
+# Graph version of connect4.decided: the edge most visited leads to the best child and cannot be caught up anymore
+# (a search stopped early returns the edge most visited)
+def decided(table, root, remaining_visits):
+    children = edge_children(table, root)
+    if len(children) < len(root.moves):
+        return False
+    if len(children) == 1:
+        return True
+    by_visits = sorted(children, key=lambda c: c[1][1], reverse=True)
+    if by_visits[0][1][1] - by_visits[1][1][1] <= remaining_visits:
+        return False
+    first = by_visits[0][2]
+    return first.reward / first.visits >= max(child.reward / child.visits for _, _, child in children)
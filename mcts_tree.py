@@ -0,0 +1,226 @@
+import math
+import random
+import time
+
+import numpy as np
+
+from connect4 import COLUMN_COUNT, MCTS_CHECK_EVERY, MCTS_FACTOR, MCTS_PROGRESS_EVERY, default_policy, progress_report, remaining_iterations, search_info, tree_info
+
+# ARRAY-BACKED MCTS TREE
+# The whole tree lives in preallocated NumPy arrays (one array per node field) instead of one Python object per node
+# Nodes are numbered, and the children of a node are stored next to each other: when a node is first expanded,
+# one slot is reserved for each of its legal moves (in distinct_cols order) and the children are then added one by
+# one in those slots, like expand does with Node
+# When the pool has no room left for a new block of children the tree stops growing: the search goes on with
+# playouts from the node reached
+
+# Default number of nodes of a tree store (about 28 bytes each)
+MCTS_TREE_NODES = 200000
+
+
+
+class TreeStore(object):
+
+    def __init__(self, max_nodes=MCTS_TREE_NODES):
+        # The root and all of its children must always fit
+        if max_nodes < COLUMN_COUNT + 1:
+            raise ValueError("A tree store needs room for at least %d nodes" % (COLUMN_COUNT + 1))
+        self.max_nodes = max_nodes
+        self.visits = np.zeros(max_nodes, dtype=np.float64)
+        self.reward = np.zeros(max_nodes, dtype=np.float64)
+        self.parent = np.full(max_nodes, -1, dtype=np.int32)
+        # Slot of the first child, number of children added and number of legal moves (size of the block)
+        self.first_child = np.full(max_nodes, -1, dtype=np.int32)
+        self.n_children = np.zeros(max_nodes, dtype=np.int8)
+        self.n_moves = np.zeros(max_nodes, dtype=np.int8)
+        # Column played to reach the node and winner of the node
+        self.move = np.full(max_nodes, -1, dtype=np.int8)
+        self.winner = np.zeros(max_nodes, dtype=np.int8)
+        # Number of slots used
+        self.size = 0
+        # Set when the pool could not hold a new block of children
+        self.full = False
+
+
+
+    # Empties the store and creates the root node for state (the arrays are reused, nothing is reallocated)
+    def new_root(self, state):
+        self.size = 0
+        self.full = False
+        root = self.allocate(1)
+        self.init_node(root, -1, -1, state)
+        return root
+
+
+
+    # Reserves n consecutive slots and returns the first one (or -1 if there is no room)
+    def allocate(self, n):
+        if self.size + n > self.max_nodes:
+            self.full = True
+            return -1
+        first = self.size
+        self.size += n
+        return first
+
+
+
+    def init_node(self, node, parent, move, state):
+        self.visits[node] = 1
+        self.reward[node] = 0.0
+        self.parent[node] = parent
+        self.first_child[node] = -1
+        self.n_children[node] = 0
+        self.n_moves[node] = len(state.distinct_cols())
+        self.move[node] = move
+        self.winner[node] = state.is_winner()
+
+
+
+    def terminal(self, node):
+        return self.winner[node] != 0 or self.n_moves[node] == 0
+
+
+
+    def fully_explored(self, node):
+        return self.n_children[node] == self.n_moves[node]
+
+
+
+    # Number of nodes actually created (reserved slots not used yet are not counted)
+    def node_count(self):
+        return 1 + int(self.n_children[:self.size].sum()) if self.size > 0 else 0
+
+
+
+    # Memory used by the arrays (bytes)
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.visits, self.reward, self.parent, self.first_child, self.n_children,
+                                      self.n_moves, self.move, self.winner))
+
+
+
+# Same search as MCTS (including the deadline, early stop, info and progress), on a TreeStore: returns the slot of the chosen
+# child of root
+# state is the position of root, it is played forward and taken back during the search but left unchanged
+def array_mcts(max_iter, store, root, state, factor=MCTS_FACTOR, player=1, playouts=1, deadline=None, early_stop=False, info=None, progress=None):
+    if max_iter is None and deadline is None:
+        raise ValueError("MCTS needs an iteration cap or a deadline")
+    if playouts > 1:
+        from rollouts import batch_playouts
+    board = state.copy()
+    root_depth = len(board.moves)
+    start = time.perf_counter()
+    stopped = 'iterations'
+    max_depth = 0
+    lengths = [] if info is not None and playouts == 1 else None
+    i = 0
+    while max_iter is None or i < max_iter:
+        if i > 0 and i % MCTS_CHECK_EVERY == 0:
+            if deadline is not None and time.perf_counter() >= deadline:
+                stopped = 'deadline'
+                break
+            if early_stop and decided(store, root, remaining_iterations(i, max_iter, start, deadline) * playouts):
+                stopped = 'early'
+                break
+            if progress is not None and i % MCTS_PROGRESS_EVERY == 0 and store.n_children[root] > 0:
+                first, n = store.first_child[root], store.n_children[root]
+                progress(progress_report(i, start, store.move[first + int(np.argmax(store.visits[first:first + n]))]))
+
+        front, p = tree_policy(store, root, player, factor, board)
+        if info is not None:
+            max_depth = max(max_depth, len(board.moves) - root_depth)
+        if playouts > 1:
+            reward = batch_playouts(board, p, playouts)
+        else:
+            reward = default_policy(board, p, lengths)
+        backpropagate(store, front, reward, p, playouts)
+        while len(board.moves) > root_depth:
+            board.undo()
+        i += 1
+
+    if info is not None:
+        search_info(info, i, start, stopped)
+        first, n = store.first_child[root], store.n_children[root]
+        tree_info(info, store.node_count(), max_depth, lengths,
+                  [(int(store.move[c]), store.visits[c], store.reward[c]) for c in range(first, first + n)])
+    if stopped == 'early':
+        first, n = store.first_child[root], store.n_children[root]
+        return first + int(np.argmax(store.visits[first:first + n]))
+    return best_child(store, root, 0)
+
+
+
+# Array version of connect4.decided: the most visited child is the best one and cannot be caught up anymore
+# (a search stopped early returns the most visited child)
+def decided(store, root, remaining_visits):
+    if not store.fully_explored(root):
+        return False
+    first = store.first_child[root]
+    n = store.n_children[root]
+    if n == 1:
+        return True
+    visits = store.visits[first:first + n]
+    order = np.argsort(visits)
+    if visits[order[-1]] - visits[order[-2]] <= remaining_visits:
+        return False
+    values = store.reward[first:first + n] / visits
+    return values[order[-1]] >= values.max()
+
+
+
+# Determines next move by exploring the tree (board follows the nodes selected)
+def tree_policy(store, node, player, factor, board):
+    while not store.terminal(node):
+        if not store.fully_explored(node):
+            child = expand(store, node, player, board)
+            if child >= 0:
+                return child, -player
+            # No room for the children of this node: play out from here
+            return node, player
+        node = best_child(store, node, factor)
+        board.play(int(store.move[node]), player)
+        player *= -1
+    return node, player
+
+
+
+# Adds the next untried move of node as a child (board is moved to the new child), or returns -1 if the pool is full
+def expand(store, node, player, board):
+    first = store.first_child[node]
+    if first < 0:
+        first = store.allocate(int(store.n_moves[node]))
+        if first < 0:
+            return -1
+        store.first_child[node] = first
+
+    # The children are created in the order of the legal moves (one of each pair of mirror moves on a symmetric board)
+    index = int(store.n_children[node])
+    col = board.distinct_cols()[index]
+    board.play(col, player)
+    child = first + index
+    store.init_node(child, node, col, board)
+    store.n_children[node] = index + 1
+    return child
+
+
+
+# Calculates the UCB of all the children of node at once and returns a random child among the best ones
+def best_child(store, node, factor):
+    first = store.first_child[node]
+    n = store.n_children[node]
+    visits = store.visits[first:first + n]
+    scores = store.reward[first:first + n] / visits
+    if factor != 0:
+        scores = scores + factor * np.sqrt(math.log(2.0 * store.visits[node]) / visits)
+    best = np.flatnonzero(scores == scores.max())
+    return first + int(random.choice(best))
+
+
+
+# Update the current node sequence with the simulation result
+def backpropagate(store, node, reward, player, playouts=1):
+    while node >= 0:
+        store.visits[node] += playouts
+        store.reward[node] -= player * reward
+        node = store.parent[node]
+        player *= -1
@@ -0,0 +1,181 @@
+import multiprocessing
+import random
+import time
+
+import numpy as np
+
+from connect4 import (MCTS, MCTS_FACTOR, MCTS_MAX_ITER, Node, backpropagate, best_child, default_policy, prove, proven_result, proven_reward, search_info, tree_info,
+                      tree_policy, tree_size)
+from rollouts import batch_playouts
+
+# PARALLEL MONTE CARLO TREE SEARCH
+# Two ways of spreading the MCTS iterations over several worker processes:
+# - root parallelization: every worker builds its own tree from the same position, then the statistics of the
+#   root children are added together before choosing the move
+# - tree parallelization: a single tree lives in the main process, a batch of leaves is selected at once (virtual
+#   losses keep the selections apart) and the random playouts of the batch run in the workers
+# Both return the chosen child node, exactly like MCTS, and can also stop on a time budget (see MCTS)
+
+# Visits and reward applied on the path of a leaf waiting for its playout, so the next selections avoid it
+VIRTUAL_LOSS = 1
+
+
+
+# Seeds the random generators of a worker process (base seed + worker number), so runs can be repeated
+def seed_worker(seed):
+    if seed is not None:
+        identity = multiprocessing.current_process()._identity
+        worker_seed = seed + (identity[0] if identity else 0)
+        random.seed(worker_seed)
+        np.random.seed(worker_seed)
+
+
+
+# Pool of worker processes used by both parallel modes (can be kept and reused from one move to the next)
+def create_pool(workers=None, seed=None):
+    return multiprocessing.Pool(workers, initializer=seed_worker, initargs=(seed,))
+
+
+
+# ROOT PARALLELIZATION
+# Worker: runs a full MCTS from the position and returns its search info and the statistics of the root children
+# The time budget is given in seconds (clocks of different processes cannot be compared)
+def root_worker(task):
+    state, player, max_iter, factor, playouts, time_budget = task
+    root = Node(state)
+    info = {}
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    MCTS(max_iter, root, factor, player, playouts, deadline, info=info)
+    return info, root.visits, [(move, child.visits, child.reward, child.proven) for move, child in zip(root.children_move, root.children)]
+
+
+
+# Runs max_iter iterations in total (None for no cap), split between the workers, and merges the root children of all the trees
+def root_parallel_mcts(state, player, pool, workers, max_iter=MCTS_MAX_ITER, factor=MCTS_FACTOR, playouts=1, time_budget=None, info=None):
+    if max_iter is None:
+        shares = [None] * workers
+    else:
+        shares = [max_iter // workers + (1 if i < max_iter % workers else 0) for i in range(workers)]
+    tasks = [(state, player, share, factor, playouts, time_budget) for share in shares if share is None or share > 0]
+
+    start = time.perf_counter()
+    root = Node(state)
+    root.visits = 0
+    children = {}
+    iterations = 0
+    stopped = set()
+    # Tree statistics of the workers: total number of nodes, deepest node and playout lengths
+    size = 0
+    max_depth = 0
+    length_sum = 0.0
+    length_max = None
+    for worker_info, visits, stats in pool.map(root_worker, tasks):
+        iterations += worker_info['iterations']
+        stopped.add(worker_info['stopped'])
+        size += worker_info['tree_size']
+        max_depth = max(max_depth, worker_info['max_depth'])
+        if worker_info['rollout_length_max'] is not None:
+            length_sum += worker_info['rollout_length_mean'] * worker_info['iterations']
+            length_max = max(length_max or 0, worker_info['rollout_length_max'])
+        root.visits += visits
+        for move, child_visits, child_reward, child_proven in stats:
+            if move not in children:
+                root.add_child(None, move, player)
+                children[move] = root.children[-1]
+                children[move].visits = 0
+            children[move].visits += child_visits
+            children[move].reward += child_reward
+            # A proof found by any worker holds for all of them
+            if child_proven is not None:
+                children[move].proven = child_proven
+    prove(root)
+
+    if info is not None:
+        search_info(info, iterations, start, 'proven' if 'proven' in stopped else 'deadline' if 'deadline' in stopped else 'iterations')
+        tree_info(info, size, max_depth, None, [(c.move, c.visits, c.reward) for c in root.children])
+        info['proven'] = proven_result(root)
+        if length_max is not None:
+            info['rollout_length_mean'] = length_sum / iterations
+            info['rollout_length_max'] = length_max
+    return best_child(root, 0)
+
+
+
+# TREE PARALLELIZATION
+# Worker: plays the random playouts of one leaf and returns the winner (or the sum of the winners)
+def rollout_worker(task):
+    state, player, playouts = task
+    if playouts > 1:
+        return batch_playouts(state, player, playouts)
+    return default_policy(state, player)
+
+
+
+# Every node on the path from the leaf to the root looks like a lost visit until the playout comes back
+def add_virtual_loss(node):
+    while node != None:
+        node.visits += VIRTUAL_LOSS
+        node.reward -= VIRTUAL_LOSS
+        node = node.parent
+
+
+
+def remove_virtual_loss(node):
+    while node != None:
+        node.visits -= VIRTUAL_LOSS
+        node.reward += VIRTUAL_LOSS
+        node = node.parent
+
+
+
+# Selects batch_size leaves at a time (with virtual losses), plays their playouts in the pool, then backpropagates
+# An existing tree of the same position can be given as root to keep searching it
+# The deadline is checked between two batches
+def tree_parallel_mcts(state, player, pool, workers, max_iter=MCTS_MAX_ITER, factor=MCTS_FACTOR, batch_size=None, root=None, playouts=1, deadline=None, info=None):
+    if max_iter is None and deadline is None:
+        raise ValueError("MCTS needs an iteration cap or a deadline")
+    if batch_size is None:
+        batch_size = 4 * workers
+    if root is None:
+        root = Node(state)
+    board = root.state
+    root_depth = len(board.moves)
+
+    start = time.perf_counter()
+    stopped = 'iterations'
+    max_depth = 0
+    done = 0
+    while max_iter is None or done < max_iter:
+        if root.proven is not None:
+            stopped = 'proven'
+            break
+        if done > 0 and deadline is not None and time.perf_counter() >= deadline:
+            stopped = 'deadline'
+            break
+        batch = []
+        leaves = []
+        for _ in range(batch_size if max_iter is None else min(batch_size, max_iter - done)):
+            front, p = tree_policy(root, player, factor, board)
+            max_depth = max(max_depth, len(board.moves) - root_depth)
+            add_virtual_loss(front)
+            batch.append((front, p))
+            # The leaf position is sent to a worker, so it needs its own copy
+            leaves.append((board.copy(), p, playouts))
+            while len(board.moves) > root_depth:
+                board.undo()
+
+        rewards = pool.map(rollout_worker, leaves, chunksize=max(1, len(batch) // workers))
+        for (front, p), reward in zip(batch, rewards):
+            remove_virtual_loss(front)
+            # A proven leaf gets its exact result instead of the playouts
+            if front.proven is not None:
+                reward = proven_reward(front, p, playouts)
+            backpropagate(front, reward, p, playouts)
+        done += len(batch)
+
+    # The playouts run in the workers, their lengths are not recorded
+    if info is not None:
+        search_info(info, done, start, stopped)
+        tree_info(info, tree_size(root), max_depth, None, [(c.move, c.visits, c.reward) for c in root.children])
+        info['proven'] = proven_result(root)
+    return best_child(root, 0)
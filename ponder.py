@@ -0,0 +1,76 @@
+import threading
+import time
+
+# PONDERING (searching on the opponent's time)
+# After an agent has moved, a background thread keeps searching the position the opponent will have to answer
+# The work is done in short slices (a step function searches for about PONDER_SLICE seconds and returns False when
+# there is nothing left to search), so pondering can be cancelled between two slices and its CPU use capped: after a
+# slice of t seconds the thread sleeps t * (1 - share) / share seconds
+# The searches themselves decide what is kept (transposition table, tree), see MinimaxAgent and MCTSAgent
+# Limitation: the thread shares the interpreter lock with everything else in the process, so pondering only pays off
+# when the opponent does not search in the same process (a human in the pygame window). Two agents of one process
+# (arena, tournament) would each slow the other's search down without any gain, they do not ponder
+
+# Length of a slice of work (seconds)
+PONDER_SLICE = 0.05
+# Share of one core used while pondering
+PONDER_CPU_SHARE = 0.5
+# Seconds of work after which pondering stops on its own (None: until cancelled)
+PONDER_MAX_TIME = 30.0
+
+
+
+class Ponderer(object):
+
+    def __init__(self, share=PONDER_CPU_SHARE, max_time=PONDER_MAX_TIME):
+        if not 0 < share <= 1:
+            raise ValueError("The pondering CPU share must be in (0, 1]")
+        self.share = share
+        self.max_time = max_time
+        self.thread = None
+        self.cancelled = threading.Event()
+        # Time spent working and number of slices of the current (or last) pondering
+        self.busy = 0.0
+        self.slices = 0
+
+
+
+    def running(self):
+        return self.thread is not None
+
+
+
+    # Starts pondering with step (called again and again in the background thread until it returns False)
+    def start(self, step):
+        self.stop()
+        self.cancelled.clear()
+        self.busy = 0.0
+        self.slices = 0
+        self.thread = threading.Thread(target=self.run, args=(step,), daemon=True)
+        self.thread.start()
+
+
+
+    def run(self, step):
+        while not self.cancelled.is_set():
+            start = time.perf_counter()
+            more = step()
+            used = time.perf_counter() - start
+            self.busy += used
+            self.slices += 1
+            if not more or (self.max_time is not None and self.busy >= self.max_time):
+                return
+            # Waiting on the event instead of sleeping: a cancel wakes the thread right away
+            self.cancelled.wait(used * (1 - self.share) / self.share)
+
+
+
+    # Cancels pondering and waits for the slice in progress to end
+    # Returns what was done ({ 'time': seconds of work, 'slices': number of slices }), None if nothing was running
+    def stop(self):
+        if self.thread is None:
+            return None
+        self.cancelled.set()
+        self.thread.join()
+        self.thread = None
+        return { 'time': self.busy, 'slices': self.slices }
@@ -0,0 +1,248 @@
+import argparse
+import struct
+import sys
+import time
+
+from connect4 import C4, COLUMN_COUNT
+
+# GAME RECORDS
+# Games are saved in a compact binary file, one record after the other, and read back one at a time so files of
+# millions of games never need to fit in memory
+# File layout (little endian): the magic, then for every game its length (uint32, bytes after the length), a header
+# (number of plies, winner, flags, seed), the names of the two agents (uint8 length then UTF-8), the moves packed two
+# per byte (one nibble per column, the first move in the high nibble) and, when the flags say so, the think time of
+# every move (float32 seconds)
+# A record is a dictionary like the ones of arena.play_game: seed, winner, plies, moves, think_times, agent_1, agent_2
+# Usage: python records.py games.rec                  (summary of the file)
+#        python records.py games.rec --replay 12      (shows game 12 in the pygame window)
+
+RECORD_MAGIC = b'C4REC001'
+RECORD_LENGTH = struct.Struct('<I')
+RECORD_HEADER = struct.Struct('<BbBq')
+# Flags of a record
+RECORD_HAS_SEED = 1
+RECORD_HAS_TIMES = 2
+# Seconds between two moves of a replay
+REPLAY_DELAY = 1.0
+
+
+
+# Moves (columns) packed two per byte
+def pack_moves(moves):
+    for col in moves:
+        if not 0 <= col < COLUMN_COUNT:
+            raise ValueError("Column %s cannot be recorded" % col)
+    padded = list(moves) + [0] * (len(moves) % 2)
+    return bytes((padded[i] << 4) | padded[i + 1] for i in range(0, len(padded), 2))
+
+
+
+def unpack_moves(data, plies):
+    moves = []
+    for byte in data:
+        moves.append(byte >> 4)
+        moves.append(byte & 0xF)
+    return moves[:plies]
+
+
+
+def encode_record(record):
+    moves = record['moves']
+    seed = record.get('seed')
+    times = record.get('think_times')
+    flags = (RECORD_HAS_SEED if seed is not None else 0) | (RECORD_HAS_TIMES if times else 0)
+    parts = [RECORD_HEADER.pack(len(moves), record['winner'], flags, seed or 0)]
+    for name in (record.get('agent_1', ''), record.get('agent_2', '')):
+        encoded = name.encode('utf-8')
+        if len(encoded) > 255:
+            raise ValueError("Agent name '%s' is too long to be recorded" % name)
+        parts.append(bytes([len(encoded)]) + encoded)
+    parts.append(pack_moves(moves))
+    if times:
+        if len(times) != len(moves):
+            raise ValueError("A record needs one think time per move")
+        parts.append(struct.pack('<%df' % len(times), *times))
+    body = b''.join(parts)
+    return RECORD_LENGTH.pack(len(body)) + body
+
+
+
+def decode_record(body):
+    plies, winner, flags, seed = RECORD_HEADER.unpack_from(body)
+    offset = RECORD_HEADER.size
+    names = []
+    for _ in range(2):
+        length = body[offset]
+        names.append(body[offset + 1:offset + 1 + length].decode('utf-8'))
+        offset += 1 + length
+    moves = unpack_moves(body[offset:offset + (plies + 1) // 2], plies)
+    offset += (plies + 1) // 2
+    think_times = list(struct.unpack_from('<%df' % plies, body, offset)) if flags & RECORD_HAS_TIMES else []
+    return { 'seed': seed if flags & RECORD_HAS_SEED else None,
+             'winner': winner,
+             'plies': plies,
+             'moves': moves,
+             'think_times': think_times,
+             'agent_1': names[0],
+             'agent_2': names[1] }
+
+
+
+# Writes records as they come (the file is opened once, every record is written right away)
+# With append, the records are added at the end of an existing file
+class RecordWriter(object):
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.count = 0
+        self.file = open(path, 'ab' if append else 'wb')
+        if self.file.tell() == 0:
+            self.file.write(RECORD_MAGIC)
+
+
+
+    def write(self, record):
+        self.file.write(encode_record(record))
+        self.count += 1
+
+
+
+    # Makes sure the records written so far are on disk (readers of a file still being written see them)
+    def flush(self):
+        self.file.flush()
+
+
+
+    def close(self):
+        self.file.close()
+
+
+
+    def __enter__(self):
+        return self
+
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+
+# Yields the records of a file one by one (with the number of the game in the file)
+def read_records(path):
+    with open(path, 'rb') as f:
+        if f.read(len(RECORD_MAGIC)) != RECORD_MAGIC:
+            raise ValueError("'%s' is not a game record file" % path)
+        game = 0
+        while True:
+            size = f.read(RECORD_LENGTH.size)
+            if not size:
+                return
+            length = RECORD_LENGTH.unpack(size)[0] if len(size) == RECORD_LENGTH.size else None
+            body = f.read(length) if length is not None else b''
+            if length is None or len(body) < max(length, RECORD_HEADER.size):
+                raise ValueError("'%s' ends in the middle of game %d" % (path, game))
+            record = decode_record(body)
+            record['game'] = game
+            yield record
+            game += 1
+
+
+
+# Record of the game number game of a file (the records before it are skipped)
+def find_record(path, game):
+    for record in read_records(path):
+        if record['game'] == game:
+            return record
+    raise ValueError("'%s' has no game %d" % (path, game))
+
+
+
+# Yields (ply, column played, position after the move) for every move of a record
+# The same C4 is updated and yielded at every ply: copy it to keep a position
+def replay(record):
+    game = C4()
+    for ply, col in enumerate(record['moves']):
+        if not game.try_move(col):
+            raise ValueError("Illegal move in the record (column %d at ply %d)" % (col, ply))
+        game.play(col)
+        yield ply, col, game
+
+
+
+# Position of a record after its first plies moves
+def position_at(record, plies):
+    game = C4()
+    for col in record['moves'][:plies]:
+        game.play(col)
+    return game
+
+
+
+# Plays a record back in the pygame window, one move every delay seconds (only the new token is drawn each time)
+def show_replay(record, delay=REPLAY_DELAY):
+    import pygame
+    from connect4 import size
+    from gui import BoardView
+
+    pygame.init()
+    view = BoardView(pygame.display.set_mode(size))
+    view.draw_board(C4().board)
+    view.draw_header()
+    view.flip()
+    for _, _, game in replay(record):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return
+        pygame.time.wait(int(1000 * delay))
+        view.draw_board(game.board)
+        view.flip()
+    pygame.time.wait(int(1000 * delay))
+
+
+
+# Number of games, wins of each player, draws and plies of a file (read as a stream)
+def summarize_records(path):
+    summary = { 'games': 0, 'player_1_wins': 0, 'player_2_wins': 0, 'draws': 0, 'plies': 0 }
+    for record in read_records(path):
+        summary['games'] += 1
+        summary['plies'] += record['plies']
+        if record['winner'] == 1:
+            summary['player_1_wins'] += 1
+        elif record['winner'] == -1:
+            summary['player_2_wins'] += 1
+        else:
+            summary['draws'] += 1
+    return summary
+
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Read and replay a file of Connect4 game records")
+    parser.add_argument('path', help="game record file")
+    parser.add_argument('--replay', type=int, default=None, help="show this game in the pygame window")
+    parser.add_argument('--moves', type=int, default=None, help="print the moves of this game")
+    parser.add_argument('--delay', type=float, default=REPLAY_DELAY, help="seconds between two moves of the replay")
+    return parser.parse_args(argv)
+
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.replay is not None:
+        show_replay(find_record(args.path, args.replay), args.delay)
+    elif args.moves is not None:
+        record = find_record(args.path, args.moves)
+        print("%s (Player 1) vs %s (Player 2), winner %d: %s" % (
+            record['agent_1'], record['agent_2'], record['winner'], ''.join(str(m) for m in record['moves'])))
+    else:
+        start = time.perf_counter()
+        summary = summarize_records(args.path)
+        print("%d games (%d plies), %d - %d, %d draws, read in %.1fs" % (
+            summary['games'], summary['plies'], summary['player_1_wins'], summary['player_2_wins'], summary['draws'],
+            time.perf_counter() - start))
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
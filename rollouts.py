@@ -0,0 +1,69 @@
+import numpy as np
+
+from connect4 import COLUMN_COUNT, COLUMN_HEIGHT, DIRECTIONS, ROW_COUNT
+
+# VECTORIZED RANDOM PLAYOUTS
+# Plays k random games at once from the same position, each game being a pair of bitboards in NumPy uint64 arrays
+# All the games move forward together, one ply at a time: a random legal column is picked for every game still
+# running, the token is added with a shift, and wins are detected with the same shift-and-mask test as C4
+
+ONE = np.uint64(1)
+SHIFTS = [(np.uint64(shift), np.uint64(2 * shift)) for shift in DIRECTIONS]
+
+
+
+# Vectorized version of C4.connected_four: one boolean per bitboard
+def connected_four(bitboards):
+    found = np.zeros(bitboards.shape, dtype=bool)
+    for shift, double_shift in SHIFTS:
+        m = bitboards & (bitboards >> shift)
+        found |= (m & (m >> double_shift)) != 0
+    return found
+
+
+
+# Plays k random games from state, player moving first, and returns the winner of each game (1, -1 or 0 for a draw)
+# state is not modified, rng is a NumPy generator (the global np.random functions are used when it is None)
+def playout_winners(state, player, k, rng=None):
+    winner = state.is_winner()
+    if winner != 0 or state.game_ended():
+        return np.full(k, winner, dtype=np.int8)
+
+    random = np.random.random if rng is None else rng.random
+    masks = { 1: np.full(k, state.masks[1], dtype=np.uint64),
+             -1: np.full(k, state.masks[-1], dtype=np.uint64) }
+    heights = np.tile(np.array(state.heights, dtype=np.int64), (k, 1))
+    column_offsets = np.arange(COLUMN_COUNT, dtype=np.int64) * COLUMN_HEIGHT
+    winners = np.zeros(k, dtype=np.int8)
+    # Games still being played
+    active = np.arange(k)
+
+    empty_cells = ROW_COUNT * COLUMN_COUNT - sum(state.heights)
+    for ply in range(empty_cells):
+        h = heights[active]
+        # Random legal column for every game: random scores, full columns can never have the highest one
+        scores = random((len(active), COLUMN_COUNT))
+        scores[h >= ROW_COUNT] = -1.0
+        cols = scores.argmax(axis=1)
+
+        rows = np.arange(len(active))
+        bits = ONE << (column_offsets[cols] + h[rows, cols]).astype(np.uint64)
+        player_masks = masks[player][active] | bits
+        masks[player][active] = player_masks
+        heights[active, cols] += 1
+
+        won = connected_four(player_masks)
+        winners[active[won]] = player
+        # The games that were won (or filled the board) stop here
+        active = active[~won & (heights[active].sum(axis=1) < ROW_COUNT * COLUMN_COUNT)]
+        if len(active) == 0:
+            break
+        player *= -1
+
+    return winners
+
+
+
+# Total reward of k random playouts (the sum of the winners), to backpropagate as k visits
+def batch_playouts(state, player, k, rng=None):
+    return int(playout_winners(state, player, k, rng).sum())
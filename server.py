@@ -0,0 +1,440 @@
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import sys
+import time
+
+from connect4 import C4, COLUMN_COUNT, ROW_COUNT, SOLVER_EMPTY_CELLS, agent_classes, create_agent
+
+# GAME SERVER
+# Hosts many games against the AI agents at once, over TCP with a line-delimited JSON protocol:
+# every request is one JSON object on one line, and gets exactly one JSON line back with the same "id"
+#   {"id": 1, "op": "new", "agent": "mcts", "ai_player": -1, "options": {"max_iter": 2000}}  -> {"id": 1, "ok": true, "game": 7, ...}
+#   {"id": 2, "op": "move", "game": 7, "col": 3, "deadline": 1.5}  -> the human move, then the answer of the AI
+#   {"id": 3, "op": "ai", "game": 7}  -> asks the AI to move (when it starts, or after a search that missed its deadline)
+#   {"id": 4, "op": "state", "game": 7}, {"id": 5, "op": "close", "game": 7}, {"id": 6, "op": "metrics"}
+# Errors come back as {"id": ..., "ok": false, "error": "..."} (with the state of the game when a search failed, the
+# client can then ask again with "ai")
+# The event loop only handles the sessions and the sockets: every search runs in a bounded pool of worker processes
+# - every search has a deadline (seconds, per request or SERVER_DEADLINE): the agent is given the time left when its
+#   worker picks the task up, a task that waited past its deadline is dropped, and the answer is an error if it is late
+# - backpressure: past SERVER_MAX_PENDING searches waiting or running, new searches are refused ("busy") right away,
+#   and every connection has at most SERVER_CONNECTION_REQUESTS requests in progress (then its socket is not read)
+# - the "metrics" request reports the queue depth, the searches done, refused or late and their latency
+# Usage: python server.py --port 8765 --workers 8
+
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8765
+SERVER_MAX_SESSIONS = 10000
+SERVER_MAX_PENDING = 256
+SERVER_CONNECTION_REQUESTS = 32
+# Default deadline of a search (seconds), share of it given to the agent, the rest covering queueing and messages
+SERVER_DEADLINE = 2.0
+SERVER_SEARCH_SHARE = 0.8
+# Sessions without any request for this long are closed (seconds)
+SERVER_SESSION_TIMEOUT = 600
+# Longest request line accepted (bytes)
+SERVER_MAX_LINE = 64 * 1024
+# Options the clients can give to the agents (the others are set by the server) and the values they accept:
+# a (lowest, highest) range of numbers (whole numbers when the bounds are), or a list of choices
+SERVER_AGENT_OPTIONS = { 'rand': {},
+                         'minmax': { 'max_depth': (1, ROW_COUNT * COLUMN_COUNT) },
+                         'mcts': { 'max_iter': (1, 10 ** 7),
+                                   'factor': (0.0, 100.0),
+                                   'playouts': (1, 1024),
+                                   'early_stop': [False, True],
+                                   'storage': ['nodes', 'array', 'graph'],
+                                   'max_nodes': (2 * ROW_COUNT * COLUMN_COUNT, 10 ** 7) } }
+# Agents kept by every worker process (reused by the searches with the same options)
+SERVER_WORKER_AGENTS = 16
+
+
+
+# WORKER PROCESSES
+# Agents of the worker, by name and options, so their transposition tables and trees are reused from move to move
+worker_agents = {}
+
+
+
+# Worker: plays one move of a session, with a time budget taken from the deadline (wall clock, as time.perf_counter
+# cannot be compared between processes)
+# Returns None when the deadline has already passed, otherwise (column, search info)
+def search_move(task):
+    name, options, state, player, deadline = task
+    budget = (deadline - time.time()) * SERVER_SEARCH_SHARE
+    if budget <= 0:
+        return None
+
+    key = (name, tuple(sorted(options.items())))
+    agent = worker_agents.get(key)
+    if agent is None:
+        if len(worker_agents) >= SERVER_WORKER_AGENTS:
+            worker_agents.pop(next(iter(worker_agents))).close()
+        agent = worker_agents[key] = create_agent(name, **options)
+    if hasattr(agent, 'time_budget'):
+        agent.time_budget = budget
+    col = agent.move(state, player)
+    return int(col), agent.last_search
+
+
+
+# Refuses a value of an agent option that is not in the values accepted (see SERVER_AGENT_OPTIONS)
+# The options are checked when the game is created, they would only fail in a worker once the game is under way
+def check_option(name, value, accepted):
+    if isinstance(accepted, list):
+        valid = any(value == choice and type(value) is type(choice) for choice in accepted)
+    else:
+        low, high = accepted
+        kinds = (int,) if isinstance(low, int) else (int, float)
+        valid = isinstance(value, kinds) and not isinstance(value, bool) and low <= value <= high
+    if not valid:
+        raise RequestError("invalid value %s for option '%s'" % (json.dumps(value), name))
+
+
+
+# One game between a client and an agent
+class Session(object):
+
+    def __init__(self, game_id, agent, options, ai_player):
+        self.id = game_id
+        self.agent = agent
+        self.options = options
+        self.ai_player = ai_player
+        self.game = C4()
+        self.winner = 0
+        # Requests of a session are handled one at a time
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+
+
+    def over(self):
+        return self.winner != 0 or self.game.game_ended()
+
+
+
+    def play(self, col, player):
+        self.game.play(col, player)
+        if self.game.winning_move(player):
+            self.winner = player
+
+
+
+    def describe(self):
+        return { 'game': self.id,
+                 'board': self.game.board.astype(int).tolist(),
+                 'moves': [move[2] for move in self.game.moves],
+                 'to_move': self.game.to_move(),
+                 'ai_player': self.ai_player,
+                 'winner': self.winner,
+                 'over': self.over() }
+
+
+
+# Error answered to a request, with what the client needs to know to go on (the state of its game for instance)
+class RequestError(Exception):
+
+    def __init__(self, message, details=None):
+        Exception.__init__(self, message)
+        self.details = details or {}
+
+
+
+class GameServer(object):
+
+    def __init__(self, workers=None, max_pending=SERVER_MAX_PENDING, max_sessions=SERVER_MAX_SESSIONS, deadline=SERVER_DEADLINE,
+                 book=None, solver_cells=SOLVER_EMPTY_CELLS):
+        self.pool = concurrent.futures.ProcessPoolExecutor(workers)
+        self.workers = self.pool._max_workers
+        # Start the worker processes now rather than on the first searches
+        for _ in range(self.workers):
+            self.pool.submit(int)
+        self.max_pending = max_pending
+        self.max_sessions = max_sessions
+        self.deadline = deadline
+        # Options every agent gets from the server (the time budget is replaced by the deadline of every search)
+        budget = deadline * SERVER_SEARCH_SHARE
+        self.server_options = { 'minmax': { 'book': book, 'solver_cells': solver_cells, 'time_budget': budget },
+                                'mcts': { 'book': book, 'solver_cells': solver_cells, 'time_budget': budget, 'reuse_tree': False } }
+        self.sessions = {}
+        self.ids = itertools.count(1)
+        # Searches sent to the pool and not finished yet (waiting for a worker or running)
+        self.pending = 0
+        self.counters = { 'connections': 0, 'requests': 0, 'searches': 0, 'busy': 0, 'late': 0, 'errors': 0,
+                          'max_pending': 0, 'search_time': 0.0, 'max_search_time': 0.0 }
+
+
+
+    # METRICS
+    def metrics(self):
+        searches = self.counters['searches']
+        metrics = dict(self.counters)
+        metrics.update({ 'sessions': len(self.sessions),
+                         'workers': self.workers,
+                         'pending': self.pending,
+                         'queue_depth': max(0, self.pending - self.workers),
+                         'mean_search_time': self.counters['search_time'] / searches if searches else 0.0 })
+        return metrics
+
+
+
+    # SEARCHES
+    # Asks the agent of a session for its move, without blocking the event loop
+    async def ai_move(self, session, deadline):
+        self.check_capacity(session)
+        task = (session.agent, session.options, session.game.copy(), session.ai_player, time.time() + deadline)
+
+        start = time.monotonic()
+        self.pending += 1
+        self.counters['max_pending'] = max(self.counters['max_pending'], self.pending)
+        future = asyncio.get_running_loop().run_in_executor(self.pool, search_move, task)
+        # A late search still holds its worker until it is over
+        future.add_done_callback(self.search_done)
+        try:
+            # A little grace on top of the deadline: the pool cannot stop a search, its result is simply dropped
+            answer = await asyncio.wait_for(asyncio.shield(future), deadline * 1.5)
+        except asyncio.TimeoutError:
+            answer = None
+        except Exception as e:
+            # The search failed in its worker: the client gets the state of its game to go on from
+            self.counters['errors'] += 1
+            raise RequestError('internal error: %s' % e, session.describe())
+        elapsed = time.monotonic() - start
+        self.counters['searches'] += 1
+        self.counters['search_time'] += elapsed
+        self.counters['max_search_time'] = max(self.counters['max_search_time'], elapsed)
+
+        if answer is None:
+            self.counters['late'] += 1
+            raise RequestError('deadline', session.describe())
+        col, info = answer
+        session.play(col, session.ai_player)
+        return { 'ai_move': col, 'search': info, 'search_time': elapsed }
+
+
+
+    def search_done(self, future):
+        self.pending -= 1
+
+
+
+    # Backpressure: refuses the request when too many searches are waiting already
+    def check_capacity(self, session=None):
+        if self.pending >= self.max_pending:
+            self.counters['busy'] += 1
+            raise RequestError('busy', session.describe() if session is not None else None)
+
+
+
+    # REQUESTS
+    async def handle(self, request):
+        op = request.get('op')
+        if op == 'new':
+            return await self.new_game(request)
+        if op == 'metrics':
+            return self.metrics()
+
+        session = self.sessions.get(request.get('game'))
+        if session is None:
+            raise RequestError('unknown game')
+        session.last_used = time.monotonic()
+        async with session.lock:
+            if op == 'state':
+                return session.describe()
+            if op == 'close':
+                del self.sessions[session.id]
+                return { 'game': session.id }
+            if op == 'move':
+                return await self.human_move(session, request)
+            if op == 'ai':
+                if session.over() or session.game.to_move() != session.ai_player:
+                    raise RequestError('not the turn of the AI')
+                result = await self.ai_move(session, self.request_deadline(request))
+                result.update(session.describe())
+                return result
+        raise RequestError("unknown op '%s'" % op)
+
+
+
+    async def new_game(self, request):
+        if len(self.sessions) >= self.max_sessions:
+            self.counters['busy'] += 1
+            raise RequestError('busy')
+        agent = request.get('agent', 'mcts')
+        if agent not in agent_classes or agent == 'human':
+            raise RequestError("unknown agent '%s'" % agent)
+        options = request.get('options') or {}
+        if not isinstance(options, dict):
+            raise RequestError('options must be an object')
+        for name, value in options.items():
+            if name not in SERVER_AGENT_OPTIONS[agent]:
+                raise RequestError("option '%s' cannot be set for %s" % (name, agent))
+            check_option(name, value, SERVER_AGENT_OPTIONS[agent][name])
+        options = dict(options, **self.server_options.get(agent, {}))
+        ai_player = request.get('ai_player', -1)
+        if isinstance(ai_player, bool) or ai_player not in (1, -1):
+            raise RequestError('ai_player must be 1 or -1')
+
+        session = Session(next(self.ids), agent, options, ai_player)
+        self.sessions[session.id] = session
+        result = session.describe()
+        if ai_player == 1:
+            async with session.lock:
+                result = await self.ai_move(session, self.request_deadline(request))
+                result.update(session.describe())
+        return result
+
+
+
+    async def human_move(self, session, request):
+        col = request.get('col')
+        player = -session.ai_player
+        if session.over():
+            raise RequestError('the game is over')
+        if session.game.to_move() != player:
+            raise RequestError('not your turn')
+        if not isinstance(col, int) or isinstance(col, bool) or not session.game.try_move(col):
+            raise RequestError('illegal move')
+        # The move is refused as a whole (and can be sent again) if the AI could not answer it
+        self.check_capacity(session)
+        session.play(col, player)
+        if session.over():
+            return session.describe()
+        result = await self.ai_move(session, self.request_deadline(request))
+        result.update(session.describe())
+        return result
+
+
+
+    def request_deadline(self, request):
+        deadline = request.get('deadline', self.deadline)
+        if not isinstance(deadline, (int, float)) or isinstance(deadline, bool) or deadline <= 0:
+            raise RequestError('deadline must be a positive number of seconds')
+        return float(deadline)
+
+
+
+    # CONNECTIONS
+    async def answer(self, line, writer, write_lock, slots):
+        try:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError()
+            except ValueError:
+                request = {}
+                response = { 'ok': False, 'error': 'invalid JSON request' }
+            else:
+                try:
+                    response = dict(await self.handle(request), ok=True)
+                except RequestError as e:
+                    response = dict(e.details, ok=False, error=str(e))
+                except Exception as e:
+                    self.counters['errors'] += 1
+                    session = self.sessions.get(request.get('game'))
+                    response = dict(session.describe() if session is not None else {}, ok=False, error='internal error: %s' % e)
+            response['id'] = request.get('id')
+            async with write_lock:
+                writer.write((json.dumps(response) + '\n').encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            slots.release()
+
+
+
+    async def serve_connection(self, reader, writer):
+        self.counters['connections'] += 1
+        write_lock = asyncio.Lock()
+        # Requests of this connection in progress: the socket is not read while they are all taken
+        slots = asyncio.Semaphore(SERVER_CONNECTION_REQUESTS)
+        tasks = set()
+        try:
+            while True:
+                await slots.acquire()
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    # Line too long or connection lost
+                    slots.release()
+                    break
+                if not line:
+                    slots.release()
+                    break
+                if not line.strip():
+                    slots.release()
+                    continue
+                self.counters['requests'] += 1
+                task = asyncio.ensure_future(self.answer(line, writer, write_lock, slots))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except asyncio.CancelledError:
+            # The server is shutting down
+            pass
+        finally:
+            writer.close()
+
+
+
+    # Closes the sessions nobody used for a while
+    async def expire_sessions(self, timeout=SERVER_SESSION_TIMEOUT):
+        while True:
+            await asyncio.sleep(min(timeout, 60))
+            now = time.monotonic()
+            for game_id in [s.id for s in self.sessions.values() if now - s.last_used > timeout]:
+                del self.sessions[game_id]
+
+
+
+    async def serve(self, host=SERVER_HOST, port=SERVER_PORT, ready=None):
+        server = await asyncio.start_server(self.serve_connection, host, port, limit=SERVER_MAX_LINE)
+        expiry = asyncio.ensure_future(self.expire_sessions())
+        if ready is not None:
+            ready(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            expiry.cancel()
+
+
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve Connect4 games against the AI agents (line-delimited JSON over TCP)")
+    parser.add_argument('--host', default=SERVER_HOST, help="address to listen on")
+    parser.add_argument('--port', type=int, default=SERVER_PORT, help="port to listen on")
+    parser.add_argument('--workers', type=int, default=None, help="search worker processes (default: one per core)")
+    parser.add_argument('--max-pending', type=int, default=SERVER_MAX_PENDING, help="searches waiting or running before new ones are refused")
+    parser.add_argument('--max-sessions', type=int, default=SERVER_MAX_SESSIONS, help="games played at the same time")
+    parser.add_argument('--deadline', type=float, default=SERVER_DEADLINE, help="default deadline of a search (seconds)")
+    parser.add_argument('--book', default=None, help="opening book file used by minmax and MCTS (see book.py)")
+    parser.add_argument('--solver-cells', type=int, default=SOLVER_EMPTY_CELLS, help="empty cells left when the agents start solving the game exactly (0 never)")
+    return parser.parse_args(argv)
+
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = GameServer(args.workers, args.max_pending, args.max_sessions, args.deadline, args.book, args.solver_cells)
+    print("Serving Connect4 on %s:%d (%d workers)" % (args.host, args.port, server.workers), flush=True)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,266 @@
+import time
+
+from connect4 import (BOARD_MASK, BOTTOM_MASK, COLUMN_COUNT, COLUMN_HEIGHT, ROW_COUNT, TT_LOWER, TT_UPPER, TranspositionTable, mirror_bitboard,
+                      mirror_col, winning_positions)
+
+# EXACT ENDGAME SOLVER
+# Negamax on the bitboards, searched to the end of the game, that returns the game-theoretic score of a position:
+# 0 for a draw, positive when the player to move wins (the sooner, the higher) and negative when it loses
+# The score of a win is 22 minus the number of tokens the winner has played when it connects four, so it also
+# tells how far away the end of the game is (see result)
+# - the moves that win right away are found with winning_positions, and a threat of the opponent is blocked first
+#   (two threats at once lose)
+# - the exact score is found with null-window searches (is the score above x?) that narrow the window down
+# - the transposition table keeps a bound and the best move of every position searched (a position and its mirror
+#   image share their entry), and the mirror moves of a symmetric position are only searched once
+# Usage: Solver().best_move(state) returns the best column and its score
+#        python solver.py --check 150    (compares the solver with an exhaustive search on random endgames)
+
+# Memory of the transposition table of a solver
+SOLVER_TT_BYTES = 16 * 1024 * 1024
+
+CELLS = ROW_COUNT * COLUMN_COUNT
+# Columns from the centre out (the best moves are usually in the middle)
+COLUMN_ORDER = sorted(range(COLUMN_COUNT), key=lambda c: abs(c - COLUMN_COUNT // 2))
+COLUMN_MASKS = [((1 << ROW_COUNT) - 1) << (c * COLUMN_HEIGHT) for c in range(COLUMN_COUNT)]
+
+
+
+def popcount(bitboard):
+    return bin(bitboard).count('1')
+
+
+
+# Outcome of a score for the player to move after moves tokens were played: ('win', 'loss' or 'draw', number of
+# plies until the end of the game with perfect play)
+def result(score, moves):
+    if score > 0:
+        stones = CELLS // 2 + 1 - score
+        return 'win', 2 * (stones - moves // 2) - 1
+    if score < 0:
+        stones = CELLS // 2 + 1 + score
+        return 'loss', 2 * (stones - (moves + 1) // 2)
+    return 'draw', CELLS - moves
+
+
+
+# The solver keeps its transposition table from one search to the next (entries stay valid for the whole game)
+class Solver(object):
+
+    def __init__(self, tt_bytes=SOLVER_TT_BYTES):
+        self.tt = TranspositionTable(tt_bytes)
+        # Positions searched since the solver was created
+        self.nodes = 0
+
+
+
+    # Score of state for the player to move (the game must not be over)
+    def solve(self, state):
+        return self.solve_position(state.masks[state.to_move()], state.mask(), sum(state.heights))
+
+
+
+    # Best move of the player to move in state and its score (the game must not be over)
+    def best_move(self, state):
+        current = state.masks[state.to_move()]
+        mask = state.mask()
+        moves = sum(state.heights)
+        possible = (mask + BOTTOM_MASK) & BOARD_MASK
+
+        wins = winning_positions(current, mask) & possible
+        if wins:
+            return column_of(wins & -wins), (CELLS + 1 - moves) // 2
+
+        best_col, best_score = None, None
+        symmetric = state.is_symmetric()
+        for col in COLUMN_ORDER:
+            move = possible & COLUMN_MASKS[col]
+            if not move or (symmetric and col > (COLUMN_COUNT - 1) // 2):
+                continue
+            # The opponent moves next: its tokens are the ones that are not ours
+            score = -self.solve_position(current ^ mask, mask | move, moves + 1)
+            if best_score is None or score > best_score:
+                best_col, best_score = col, score
+        return best_col, best_score
+
+
+
+    # Score of a position given by the tokens of the player to move, the tokens of both players and the number of
+    # tokens played, found by null-window searches closing in on the score (nearer to 0 first)
+    def solve_position(self, current, mask, moves):
+        if winning_positions(current, mask) & (mask + BOTTOM_MASK) & BOARD_MASK:
+            return (CELLS + 1 - moves) // 2
+        low = -((CELLS - moves) // 2)
+        high = (CELLS + 1 - moves) // 2
+        while low < high:
+            med = low + (high - low) // 2
+            if med <= 0 and int(low / 2) < med:
+                med = int(low / 2)
+            elif med >= 0 and int(high / 2) > med:
+                med = int(high / 2)
+            r = self.negamax(current, mask, moves, med, med + 1)
+            if r <= med:
+                high = r
+            else:
+                low = r
+        return low
+
+
+
+    # Score of the position if it lies in [alpha, beta], otherwise a bound on the side of the window it is on
+    # The player to move cannot win right away (checked before calling)
+    def negamax(self, current, mask, moves, alpha, beta):
+        self.nodes += 1
+        possible = (mask + BOTTOM_MASK) & BOARD_MASK
+        opponent_wins = winning_positions(current ^ mask, mask)
+        forced = possible & opponent_wins
+        if forced:
+            # Two threats cannot both be blocked
+            if forced & (forced - 1):
+                return -((CELLS - moves) // 2)
+            possible = forced
+        # Never play right below a winning cell of the opponent
+        safe = possible & ~(opponent_wins >> 1)
+        if not safe:
+            return -((CELLS - moves) // 2)
+        if moves >= CELLS - 2:
+            return 0
+
+        # The opponent cannot win on its next move, and we cannot win sooner than in two moves
+        alpha = max(alpha, -((CELLS - 2 - moves) // 2))
+        beta = min(beta, (CELLS - 1 - moves) // 2)
+        if alpha >= beta:
+            return alpha
+
+        key = current + mask + BOTTOM_MASK
+        mirrored_key = mirror_bitboard(key)
+        symmetric = key == mirrored_key
+        mirrored = mirrored_key < key
+        if mirrored:
+            key = mirrored_key
+        entry = self.tt.probe(key)
+        tt_move = None
+        if entry is not None:
+            _, value, tt_move, flag = entry
+            if mirrored:
+                tt_move = mirror_col(tt_move)
+            if flag == TT_UPPER:
+                beta = min(beta, value)
+            elif flag == TT_LOWER:
+                alpha = max(alpha, value)
+            if alpha >= beta:
+                return value
+
+        # Moves creating the most threats first, then the centre, the best move of a previous search before all
+        order = []
+        for col in COLUMN_ORDER:
+            move = safe & COLUMN_MASKS[col]
+            if move and not (symmetric and col > (COLUMN_COUNT - 1) // 2):
+                threats = popcount(winning_positions(current | move, mask))
+                order.append((col == tt_move, threats, col, move))
+        order.sort(key=lambda m: (m[0], m[1]), reverse=True)
+
+        best_col = order[0][2]
+        for _, _, col, move in order:
+            score = -self.negamax(current ^ mask, mask | move, moves + 1, -beta, -alpha)
+            if score >= beta:
+                self.tt.store(key, CELLS - moves, score, mirror_col(col) if mirrored else col, TT_LOWER)
+                return score
+            if score > alpha:
+                alpha = score
+                best_col = col
+        self.tt.store(key, CELLS - moves, alpha, mirror_col(best_col) if mirrored else best_col, TT_UPPER)
+        return alpha
+
+
+
+# Column of a bitboard holding a single cell
+def column_of(bit):
+    return (bit.bit_length() - 1) // COLUMN_HEIGHT
+
+
+
+# Solves the position of game for the agents: (column, search info)
+def solve_move(solver, game):
+    start = time.perf_counter()
+    nodes = solver.nodes
+    col, score = solver.best_move(game)
+    outcome, plies = result(score, sum(game.heights))
+    elapsed = time.perf_counter() - start
+    return col, { 'solver': True,
+                  'column': col,
+                  'score': score,
+                  'result': outcome,
+                  'plies_to_end': plies,
+                  'nodes': solver.nodes - nodes,
+                  'elapsed': elapsed }
+
+
+
+# CHECK AGAINST AN EXHAUSTIVE SEARCH
+# Score of state for the player to move found by trying every move to the end of the game (no pruning, no table),
+# with the same scale as the solver: slow, only meant for endgames with few empty cells
+def exhaustive_score(state):
+    moves = sum(state.heights)
+    best = None
+    for col in state.available_cols():
+        state.play(col)
+        if state.is_winner() != 0:
+            score = (CELLS + 1 - moves) // 2
+        elif moves + 1 == CELLS:
+            score = 0
+        else:
+            score = -exhaustive_score(state)
+        state.undo()
+        if best is None or score > best:
+            best = score
+    return best
+
+
+
+# Solves random endgames (empty cells left empty, the game not over) with a fresh solver and compares every score
+# with exhaustive_score: returns the number of positions checked and the moves of those that disagree
+def check_solver(positions=150, empty=10, seed=0):
+    import random
+    from connect4 import C4
+    rng = random.Random(seed)
+    solver = Solver()
+    checked = 0
+    mismatches = []
+    while checked < positions:
+        game = C4()
+        while sum(game.heights) < CELLS - empty and game.is_winner() == 0:
+            game.play(rng.choice(game.available_cols()))
+        if game.is_winner() != 0:
+            continue
+        if solver.solve(game) != exhaustive_score(game):
+            mismatches.append([move[2] for move in game.moves])
+        checked += 1
+    return checked, mismatches
+
+
+
+def parse_args(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Check the endgame solver against an exhaustive search on random endgames")
+    parser.add_argument('--check', type=int, default=150, help="number of random endgames")
+    parser.add_argument('--empty', type=int, default=10, help="empty cells left in every endgame")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the random endgames")
+    return parser.parse_args(argv)
+
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    start = time.perf_counter()
+    checked, mismatches = check_solver(args.check, args.empty, args.seed)
+    for moves in mismatches:
+        print("Mismatch: %s" % ''.join(str(m) for m in moves))
+    print("%d endgames checked in %.1fs, %d mismatches" % (checked, time.perf_counter() - start, len(mismatches)))
+    return 1 if mismatches else 0
+
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
@@ -0,0 +1,161 @@
+import argparse
+import math
+import multiprocessing
+import sys
+
+from arena import agent_name, agent_options, play_game, write_csv, write_json
+from connect4 import MCTS_MAX_ITER, MINMAX_MAX_DEPTH, MINMAX_TIME_BUDGET, SOLVER_EMPTY_CELLS, agents, agent_classes, create_agent
+from records import RecordWriter
+
+# MULTI-CORE TOURNAMENT
+# Plays many games between two agents, spread over a pool of worker processes
+# Agents take turns moving first, and every game has its own seed (seed + game number), so results do not depend
+# on which worker played which game or in which order the games finished
+# (minmax searches to a time budget, so its moves can still depend on how busy the machine is; give it a --minmax-depth it always reaches within --minmax-time for exact replays)
+# Usage: python tournament.py mcts minmax --games 1000 --workers 8 --seed 1
+
+
+
+# Builds the list of games to play: (game number, Player 1 name, Player 2 name, seed, Player 1 options, Player 2 options)
+# agent_a moves first in even games, agent_b in odd games
+def schedule(agent_a, agent_b, n_games, seed=0, agent_a_options=None, agent_b_options=None):
+    tasks = []
+    for i in range(n_games):
+        if i % 2 == 0:
+            tasks.append((i, agent_a, agent_b, seed + i, agent_a_options or {}, agent_b_options or {}))
+        else:
+            tasks.append((i, agent_b, agent_a, seed + i, agent_b_options or {}, agent_a_options or {}))
+    return tasks
+
+
+
+# Worker: plays one scheduled game with freshly built agents (nothing is carried over from the previous game)
+def play_scheduled_game(task):
+    i, agent_1_name, agent_2_name, seed, agent_1_options, agent_2_options = task
+    agent_1 = create_agent(agent_1_name, **agent_1_options)
+    agent_2 = create_agent(agent_2_name, **agent_2_options)
+    result = play_game(agent_1, agent_2, seed)
+    agent_1.close()
+    agent_2.close()
+    result['game'] = i
+    result['agent_1'] = agent_1_name
+    result['agent_2'] = agent_2_name
+    return result
+
+
+
+# Plays the tournament and yields every game record as soon as it is finished (in completion order)
+def run_tournament(agent_a, agent_b, n_games, workers=None, seed=0, agent_a_options=None, agent_b_options=None):
+    agent_a = agents.get(agent_a, agent_a)
+    agent_b = agents.get(agent_b, agent_b)
+    tasks = schedule(agent_a, agent_b, n_games, seed, agent_a_options, agent_b_options)
+
+    with multiprocessing.Pool(workers) as pool:
+        for result in pool.imap_unordered(play_scheduled_game, tasks):
+            yield result
+
+
+
+# Wilson score interval of a proportion (k successes out of n), 95% confidence by default
+def wilson_interval(k, n, z=1.96):
+    if n == 0:
+        return 0.0, 1.0
+    p = k / n
+    denominator = 1 + z * z / n
+    centre = (p + z * z / (2 * n)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return max(0.0, centre - margin), min(1.0, centre + margin)
+
+
+
+# Wins, draws and losses of agent from a list of game records, with their rates and confidence intervals
+# When both agents are the same, wins are counted for the one that moved first in even games (Player 1 of game 0)
+def standings(results, agent):
+    wins = draws = losses = 0
+    for r in results:
+        if r['winner'] == 0:
+            draws += 1
+            continue
+        if r['agent_1'] == r['agent_2']:
+            agent_player = 1 if r['game'] % 2 == 0 else -1
+        else:
+            agent_player = 1 if r['agent_1'] == agent else -1
+        if r['winner'] == agent_player:
+            wins += 1
+        else:
+            losses += 1
+
+    n = wins + draws + losses
+    table = { 'agent': agent, 'games': n, 'wins': wins, 'draws': draws, 'losses': losses }
+    for name, k in (('win', wins), ('draw', draws), ('loss', losses)):
+        table[name + '_rate'] = k / n if n > 0 else 0.0
+        table[name + '_ci'] = wilson_interval(k, n)
+    return table
+
+
+
+# One line report of the standings
+def format_standings(table):
+    return "%s: %d games, %d W / %d D / %d L, win %.1f%% [%.1f-%.1f], draw %.1f%% [%.1f-%.1f], loss %.1f%% [%.1f-%.1f]" % (
+        table['agent'], table['games'], table['wins'], table['draws'], table['losses'],
+        100 * table['win_rate'], 100 * table['win_ci'][0], 100 * table['win_ci'][1],
+        100 * table['draw_rate'], 100 * table['draw_ci'][0], 100 * table['draw_ci'][1],
+        100 * table['loss_rate'], 100 * table['loss_ci'][0], 100 * table['loss_ci'][1])
+
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Play a Connect4 tournament between two agents on several cores")
+    parser.add_argument('agent_a', type=agent_name, help="first agent (%s)" % ', '.join(agent_classes))
+    parser.add_argument('agent_b', type=agent_name, help="second agent (%s)" % ', '.join(agent_classes))
+    parser.add_argument('--games', type=int, default=100, help="number of games to play")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes (default: one per core)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first game (game i uses seed + i)")
+    parser.add_argument('--every', type=int, default=1, help="print the standings every this many games")
+    parser.add_argument('--json', default=None, help="write the game records to this JSON file")
+    parser.add_argument('--csv', default=None, help="write the game records to this CSV file")
+    parser.add_argument('--record', default=None, help="add the games to this game record file as they finish (see records.py)")
+    parser.add_argument('--book', default=None, help="opening book file used by minmax and MCTS (see book.py)")
+    parser.add_argument('--solver-cells', type=int, default=SOLVER_EMPTY_CELLS, help="empty cells left when minmax and MCTS start solving the game exactly (0 never)")
+    parser.add_argument('--minmax-time', type=float, default=MINMAX_TIME_BUDGET, help="minmax time budget per move (seconds)")
+    parser.add_argument('--minmax-depth', type=int, default=MINMAX_MAX_DEPTH, help="minmax maximum search depth")
+    parser.add_argument('--mcts-iter', type=int, default=MCTS_MAX_ITER, help="MCTS iterations per move (cap, 0 for no cap)")
+    parser.add_argument('--mcts-time', type=float, default=None, help="MCTS time budget per move (seconds)")
+    parser.add_argument('--mcts-game-time', type=float, default=None, help="MCTS clock for the whole game (seconds)")
+    parser.add_argument('--mcts-early-stop', action='store_true', help="stop MCTS searches once the best move cannot change")
+    parser.add_argument('--mcts-playouts', type=int, default=1, help="random playouts per MCTS leaf (played at once with NumPy)")
+    parser.add_argument('--mcts-storage', choices=('nodes', 'array', 'graph'), default='nodes', help="MCTS tree storage (Node objects, NumPy arrays or a graph of positions)")
+    parser.add_argument('--mcts-nodes', type=int, default=None, help="maximum number of nodes of the array MCTS tree or of the graph table")
+    parser.add_argument('--mcts-tree-size', type=int, default=None, help="maximum number of nodes of the MCTS subtree kept for the next move (no limit by default)")
+    # The games already run in worker processes, which cannot start processes of their own
+    parser.set_defaults(mcts_workers=1, mcts_parallel='root', minmax_workers=1)
+    return parser.parse_args(argv)
+
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    recorder = RecordWriter(args.record, append=True) if args.record else None
+    for result in run_tournament(args.agent_a, args.agent_b, args.games, args.workers, args.seed,
+                                 agent_options(args.agent_a, args), agent_options(args.agent_b, args)):
+        results.append(result)
+        if recorder:
+            recorder.write(result)
+        if len(results) % args.every == 0 or len(results) == args.games:
+            print("[%d/%d] %s" % (len(results), args.games, format_standings(standings(results, args.agent_a))), flush=True)
+
+    if recorder:
+        recorder.close()
+
+    # Save the records in game order
+    results.sort(key=lambda r: r['game'])
+    if args.json:
+        write_json(results, args.json)
+    if args.csv:
+        write_csv(results, args.csv)
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())